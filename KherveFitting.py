@@ -27,10 +27,12 @@ from libraries.AreaFit_Screen import *
 from libraries.Save import *
 from libraries.NoiseAnalysis import NoiseAnalysisWindow
 from libraries.ConfigFile import *
-from libraries.Export import export_results
+from libraries.Export import export_results, quantification_divisor
 from libraries.PlotConfig import PlotConfig
 
 from libraries.Peak_Functions import PeakFunctions
+from libraries import Compiled_Kernels
+from libraries.Voigt_Conversions import voigt_height_to_area, pseudo_voigt_height_to_area
 
 # from libraries.Peak_Functions import AtomicConcentrations
 # from libraries.Peak_Functions import gauss_lorentz, S_gauss_lorentz
@@ -162,6 +164,20 @@ class MyFrame(wx.Frame):
 
         # Initial max iteration value
         self.max_iterations = 50
+        # Wall-clock budget of a fit run in seconds (0: no limit)
+        self.fit_time_budget = 0
+        # Relative change of chi² and parameters that stops Fit Multiple Times (0: fixed number of fits)
+        self.fit_tolerance = 1e-4
+        # Multi-start search: number of starts, sampler seed and sampler, number of best solutions listed
+        self.multi_start_count = 32
+        self.multi_start_seed = 0
+        self.multi_start_sampler = "Sobol"
+        self.multi_start_best = 5
+        # Uncertainty estimate: number of replicates, resampling, seed and confidence level
+        self.uncertainty_replicates = 100
+        self.uncertainty_mode = "Residual bootstrap"
+        self.uncertainty_seed = 0
+        self.uncertainty_level = "95%"
         # Initial fitting method
         self.selected_fitting_method = "GL (Area)"
 
@@ -236,6 +252,12 @@ class MyFrame(wx.Frame):
 
         self.averaging_points = 5
 
+        # Shift-drag editing of the background offsets
+        self.background_drag_active = None
+        self.background_drag_timer = None
+        self.pending_offset_click = None
+        self.background_drag_interval = 16
+
         # Number of column to remove from the excel file
         self.num_fitted_columns = 15
 
@@ -285,9 +307,13 @@ class MyFrame(wx.Frame):
         self.max_recent_files = 10  # Maximum number of recent files to keep
 
         self.library_type = "TPP-2M"  # Default value
+        self.kernel_backend = "NumPy"
+        self.jacobian_mode = "Analytic"
+        self.persist_fit_cache = False
 
         # Load config if exists
         self.load_config()
+        self.kernel_backend = Compiled_Kernels.set_backend(self.kernel_backend)
 
         create_widgets(self)
         # self.create_widgets()
@@ -1481,45 +1507,20 @@ class MyFrame(wx.Frame):
         if event.inaxes:
             x_click = event.xdata
             if event.button == 1 and event.key == 'shift' and self.background_tab_selected:
-                # Store current motion handler if it exists
+                # Drop the handlers of a previous drag before connecting new ones
+                self.disconnect_background_drag()
                 self.motion_notify_id = self.canvas.mpl_connect('motion_notify_event', self.on_motion)
                 self.button_release_id = self.canvas.mpl_connect('button_release_event', self.on_release)
 
-                x_click = event.xdata
-                sheet_name = self.sheet_combobox.GetValue()
                 if self.vline1 is not None and self.vline2 is not None:
-                    vline1_x = self.vline1.get_xdata()[0]
-                    vline2_x = self.vline2.get_xdata()[0]
-
-                    # Determine which vline is at low/high BE
-                    low_be_x = min(vline1_x, vline2_x)
-                    high_be_x = max(vline1_x, vline2_x)
-
-                    dist1 = abs(x_click - vline1_x)
-                    dist2 = abs(x_click - vline2_x)
-
-                    if dist1 < dist2:  # Closer to vline1
-                        raw_y = self.y_values[np.argmin(np.abs(self.x_values - vline1_x))]
-                        if vline1_x == low_be_x:
-                            self.offset_l = event.ydata - raw_y
-                            self.Data['Core levels'][sheet_name]['Background']['Bkg Offset Low'] = self.offset_l
-                            self.fitting_window.offset_l_text.SetValue(f'{self.offset_l:.1f}')
-                        else:
-                            self.offset_h = event.ydata - raw_y
-                            self.Data['Core levels'][sheet_name]['Background']['Bkg Offset High'] = self.offset_h
-                            self.fitting_window.offset_h_text.SetValue(f'{self.offset_h:.1f}')
-                    else:  # Closer to vline2
-                        raw_y = self.y_values[np.argmin(np.abs(self.x_values - vline2_x))]
-                        if vline2_x == low_be_x:
-                            self.offset_l = event.ydata - raw_y
-                            self.Data['Core levels'][sheet_name]['Background']['Bkg Offset Low'] = self.offset_l
-                            self.fitting_window.offset_l_text.SetValue(f'{self.offset_l:.1f}')
-                        else:
-                            self.offset_h = event.ydata - raw_y
-                            self.Data['Core levels'][sheet_name]['Background']['Bkg Offset High'] = self.offset_h
-                            self.fitting_window.offset_h_text.SetValue(f'{self.offset_h:.1f}')
-
+                    self.set_offset_from_click(event.xdata, event.ydata)
                     self.plot_manager.plot_background(self)
+
+                    # Interactive mode: motion events only refresh the background line until release
+                    self.background_drag_active = self.plot_manager.start_background_drag(self)
+                    self.pending_offset_click = None
+                    self.background_drag_timer = None
+                    self.background_drag_interval = self.get_display_refresh_interval()
             elif event.button == 1:  # Left click
                 if event.key == 'shift':  # SHIFT + left click
                     if self.peak_fitting_tab_selected and self.selected_peak_index is not None:
@@ -2007,44 +2008,59 @@ class MyFrame(wx.Frame):
 
         self.canvas.draw_idle()
 
+    def set_offset_from_click(self, x_click, y_click):
+        """Set the low or high background offset from a click next to the closest background range line."""
+        sheet_name = self.sheet_combobox.GetValue()
+        vline1_x = self.vline1.get_xdata()[0]
+        vline2_x = self.vline2.get_xdata()[0]
+
+        # Determine which vline is at low BE
+        low_be_x = min(vline1_x, vline2_x)
+        vline_x = vline1_x if abs(x_click - vline1_x) < abs(x_click - vline2_x) else vline2_x
+
+        raw_y = self.y_values[np.argmin(np.abs(self.x_values - vline_x))]
+        if vline_x == low_be_x:
+            self.offset_l = y_click - raw_y
+            self.Data['Core levels'][sheet_name]['Background']['Bkg Offset Low'] = self.offset_l
+            self.fitting_window.offset_l_text.SetValue(f'{self.offset_l:.1f}')
+        else:
+            self.offset_h = y_click - raw_y
+            self.Data['Core levels'][sheet_name]['Background']['Bkg Offset High'] = self.offset_h
+            self.fitting_window.offset_h_text.SetValue(f'{self.offset_h:.1f}')
+
+    def get_display_refresh_interval(self):
+        """Time in ms between two frames of the display showing the window (60 Hz if unknown)."""
+        display_index = wx.Display.GetFromWindow(self)
+        refresh_rate = wx.Display(max(display_index, 0)).GetCurrentMode().refresh or 60
+        return max(1, int(1000 / refresh_rate))
+
+    def flush_background_drag(self):
+        """Apply the last offset received while dragging and refresh the background preview."""
+        self.background_drag_timer = None
+        if self.pending_offset_click is None:
+            return
+        x_click, y_click = self.pending_offset_click
+        self.pending_offset_click = None
+        self.set_offset_from_click(x_click, y_click)
+        if self.background_drag_active:
+            self.plot_manager.update_background_drag(self)
+
+    def disconnect_background_drag(self):
+        if hasattr(self, 'motion_notify_id'):
+            self.canvas.mpl_disconnect(self.motion_notify_id)
+            delattr(self, 'motion_notify_id')
+        if hasattr(self, 'button_release_id'):
+            self.canvas.mpl_disconnect(self.button_release_id)
+            delattr(self, 'button_release_id')
+
     def on_motion(self, event):
         if event.button == 1 and event.key == 'shift' and self.background_tab_selected:
-            # print('ON MOTION')
-            x_click = event.xdata
-            sheet_name = self.sheet_combobox.GetValue()
-            if self.vline1 is not None and self.vline2 is not None:
-                vline1_x = self.vline1.get_xdata()[0]
-                vline2_x = self.vline2.get_xdata()[0]
-
-                # Determine which vline is at low/high BE
-                low_be_x = min(vline1_x, vline2_x)
-                high_be_x = max(vline1_x, vline2_x)
-
-                dist1 = abs(x_click - vline1_x)
-                dist2 = abs(x_click - vline2_x)
-
-                if dist1 < dist2:  # Closer to vline1
-                    raw_y = self.y_values[np.argmin(np.abs(self.x_values - vline1_x))]
-                    if vline1_x == low_be_x:
-                        self.offset_l = event.ydata - raw_y
-                        self.Data['Core levels'][sheet_name]['Background']['Bkg Offset Low'] = self.offset_l
-                        self.fitting_window.offset_l_text.SetValue(f'{self.offset_l:.1f}')
-                    else:
-                        self.offset_h = event.ydata - raw_y
-                        self.Data['Core levels'][sheet_name]['Background']['Bkg Offset High'] = self.offset_h
-                        self.fitting_window.offset_h_text.SetValue(f'{self.offset_h:.1f}')
-                else:  # Closer to vline2
-                    raw_y = self.y_values[np.argmin(np.abs(self.x_values - vline2_x))]
-                    if vline2_x == low_be_x:
-                        self.offset_l = event.ydata - raw_y
-                        self.Data['Core levels'][sheet_name]['Background']['Bkg Offset Low'] = self.offset_l
-                        self.fitting_window.offset_l_text.SetValue(f'{self.offset_l:.1f}')
-                    else:
-                        self.offset_h = event.ydata - raw_y
-                        self.Data['Core levels'][sheet_name]['Background']['Bkg Offset High'] = self.offset_h
-                        self.fitting_window.offset_h_text.SetValue(f'{self.offset_h:.1f}')
-
-                self.plot_manager.plot_background(self)
+            if self.vline1 is not None and self.vline2 is not None and event.inaxes:
+                # Coalesce motion events: keep only the latest position and refresh once per display frame
+                self.pending_offset_click = (event.xdata, event.ydata)
+                if getattr(self, 'background_drag_timer', None) is None:
+                    self.background_drag_timer = wx.CallLater(self.background_drag_interval,
+                                                              self.flush_background_drag)
         elif event.inaxes and self.moving_vline is not None:
             x_click = event.xdata
             self.moving_vline.set_xdata([x_click])
@@ -2083,6 +2099,17 @@ class MyFrame(wx.Frame):
             self.canvas.draw_idle()
 
     def on_release(self, event):
+        if getattr(self, 'background_drag_active', None) is not None:
+            # End of a shift-drag of the offsets: apply the last position and do the full recompute once
+            if self.background_drag_timer is not None:
+                self.background_drag_timer.Stop()
+                self.background_drag_timer = None
+            if self.pending_offset_click is not None:
+                self.set_offset_from_click(*self.pending_offset_click)
+                self.pending_offset_click = None
+            self.disconnect_background_drag()
+            self.background_drag_active = None
+            self.plot_manager.end_background_drag(self)
         if self.moving_vline is not None:
             # Disconnect motion handler when mouse is released
             if hasattr(self, 'motion_notify_id'):
@@ -2284,45 +2311,8 @@ class MyFrame(wx.Frame):
                 area = float(self.results_grid.GetCellValue(i, 5))
                 rsf = float(self.results_grid.GetCellValue(i, 8))
 
-                # Calculate kinetic energy
-                kinetic_energy = self.photons - binding_energy
-                print(f"Library Type:{self.library_type}")
-
-                # Calculate ECF based on method selected
-                if self.library_type == "Scofield":
-                    ecf = kinetic_energy ** 0.6
-                elif self.library_type == "Wagner":
-                    ecf = kinetic_energy ** 1.0
-                elif self.library_type == "TPP-2M":
-                    # Calculate IMFP using TPP-2M using the average matrix
-                    imfp = AtomicConcentrations.calculate_imfp_tpp2m(kinetic_energy)
-
-                    # 26.2 is a factor added by Avantage to match KE^0.6
-                    ecf = imfp * 26.2
-                elif self.library_type == "None":
-                    ecf = 1.0
-                else:
-                    ecf = 1.0  # Default no correction
-
-                # Get raw area and RSF
-                area = float(self.results_grid.GetCellValue(i, 5))
-                rsf = float(self.results_grid.GetCellValue(i, 8))
-
-
-                # Calculate Transmission function
-                txfn = 1.0  # Transmission function
-
-                # Angular correction
-                angular_correction = 1.0
-                if self.use_angular_correction:
-                    angular_correction = AtomicConcentrations.calculate_angular_correction(
-                        self,
-                        peak_name,
-                        self.analysis_angle
-                    )
-
-                # Calculate normalized area with ECF correction
-                normalized_area = area / (rsf * txfn * ecf * angular_correction)
+                # Calculate normalized area with RSF, TXFN, ECF and angular corrections
+                normalized_area = area / quantification_divisor(self, peak_name, binding_energy, rsf)
 
                 total_normalized_area += normalized_area
                 checked_indices.append((i, normalized_area))
@@ -2369,11 +2359,10 @@ class MyFrame(wx.Frame):
         if model in ["Voigt (Area, L/G, \u03c3)", "Voigt (Area, \u03c3, \u03b3)"]:
             if sigma is None or gamma is None:
                 raise ValueError("Sigma and gamma are required for Voigt models")
-            area = PeakFunctions.voigt_height_to_area(height, sigma / 2.355, gamma / 2)
+            area = voigt_height_to_area(height, sigma / 2.355, gamma / 2)
         elif model == "Pseudo-Voigt (Area)":
             sigma = fwhm / 2
-            amplitude = height / PeakFunctions.get_pseudo_voigt_height(1, sigma, fraction)
-            area = amplitude
+            area = pseudo_voigt_height_to_area(height, sigma, fraction)
         elif model in ["GL (Height)", "SGL (Height)", "Unfitted"]:
             area = height * fwhm * np.sqrt(np.pi / (4 * np.log(2)))
         elif model in ["GL (Area)", "SGL (Area)"]:
@@ -3074,6 +3063,9 @@ class MyFrame(wx.Frame):
                 self.ref_peak_name = config.get('ref_peak_name', 'C1s C-C')
                 self.ref_peak_be = config.get('ref_peak_be', 284.8)
                 self.photons = config.get('photons', 1486.67)
+                self.kernel_backend = config.get('kernel_backend', self.kernel_backend)
+                self.jacobian_mode = config.get('jacobian_mode', self.jacobian_mode)
+                self.persist_fit_cache = config.get('persist_fit_cache', self.persist_fit_cache)
 
         else:
             config = {}
@@ -3128,6 +3120,9 @@ class MyFrame(wx.Frame):
             'ref_peak_name': self.ref_peak_name,
             'ref_peak_be': self.ref_peak_be,
             'photons': self.photons,
+            'kernel_backend': self.kernel_backend,
+            'jacobian_mode': self.jacobian_mode,
+            'persist_fit_cache': self.persist_fit_cache,
 
 
             # Excel file settings
@@ -0,0 +1,116 @@
+# BACKGROUND CACHE --------------------------------------------------------
+# Content-addressed LRU cache shared by plotting, fitting and sheet switching
+# -------------------------------------------------------------------------
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+class BackgroundCache:
+    """
+    LRU cache of computed backgrounds keyed by a hash of everything the background depends on.
+
+    Keys are built by make_key from the x/y arrays, the method, the range (Bkg Low/High), the offsets,
+    the number of averaging points and the Tougaard cross-sections, so two identical requests coming from
+    different places (Background button, shift-drag, sheet switching, Peaks Library) share one entry.
+    Entries are evicted least-recently-used first once the stored arrays exceed max_bytes.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def make_key(x, y, method, bkg_low=None, bkg_high=None, offset_h=0, offset_l=0, num_points=5,
+                 cross_sections=None):
+        """
+        Build the cache key of a background request.
+
+        Args:
+            x (array): X-axis values the background is computed on
+            y (array): Y-axis values the background is computed on
+            method (str): Background method name
+            bkg_low (float): Low end of the background range
+            bkg_high (float): High end of the background range
+            offset_h (float): High offset
+            offset_l (float): Low offset
+            num_points (int): Number of points averaged at the endpoints
+            cross_sections (list): Tougaard (B, C, D, T0) tuples, None for other methods
+
+        Returns:
+            str: Hex digest identifying the request
+        """
+        digest = hashlib.sha1()
+        digest.update(np.ascontiguousarray(x, dtype=float).tobytes())
+        digest.update(b'|')
+        digest.update(np.ascontiguousarray(y, dtype=float).tobytes())
+        if cross_sections is not None:
+            cross_sections = tuple(tuple(float(v) for v in cs) for cs in cross_sections)
+        settings = (method,
+                    None if bkg_low is None else float(bkg_low),
+                    None if bkg_high is None else float(bkg_high),
+                    float(offset_h), float(offset_l), int(num_points), cross_sections)
+        digest.update(repr(settings).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return a copy of the cached background, or None on a miss."""
+        background = self._entries.get(key)
+        if background is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return background.copy()
+
+    def put(self, key, background):
+        """Store a background and evict the least recently used entries above the memory cap."""
+        background = np.array(background, dtype=float)
+        background.setflags(write=False)
+        if key in self._entries:
+            self.current_bytes -= self._entries.pop(key).nbytes
+        if background.nbytes > self.max_bytes:
+            return
+        self._entries[key] = background
+        self.current_bytes += background.nbytes
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """Return the cached background for key, calling compute() and storing its result on a miss."""
+        background = self.get(key)
+        if background is None:
+            background = np.asarray(compute(), dtype=float)
+            self.put(key, background)
+        return background
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def reset_counters(self):
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Counters shown in the cache statistics window."""
+        lookups = self.hits + self.misses
+        return {
+            'Entries': len(self._entries),
+            'Memory (MB)': self.current_bytes / 1024 ** 2,
+            'Memory cap (MB)': self.max_bytes / 1024 ** 2,
+            'Hits': self.hits,
+            'Misses': self.misses,
+            'Hit rate (%)': 100 * self.hits / lookups if lookups else 0.0,
+            'Evictions': self.evictions,
+        }
+
+
+# Shared by every caller of BackgroundCalculations.calculate_background
+background_cache = BackgroundCache()
@@ -0,0 +1,110 @@
+# ALL-SHEETS BACKGROUND PIPELINE ------------------------------------------
+# One task per core level, computed in a process pool.
+# -------------------------------------------------------------------------
+import copy
+
+import numpy as np
+
+from libraries.Peak_Functions import BackgroundCalculations
+from libraries.Process_Pipeline import ProcessPipeline
+from libraries.Background_Cache import background_cache
+
+
+BACKGROUND_METHODS = ["Multi-Regions Smart", "Smart", "Smart2", "Shirley", "Linear", "1x U4-Tougaard",
+                      "2x U4-Tougaard", "3x U4-Tougaard"]
+
+
+def _to_float(value, default):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def build_background_tasks(data, default_method="Multi-Regions Smart", num_points=5):
+    """
+    Build one background task per core level of window.Data.
+
+    Sheets with a region list replay it. Sheets with a Background entry but no regions use its method, range
+    and offsets. Sheets without a background use default_method over the full range with no offsets.
+
+    Args:
+        data (dict): window.Data
+        default_method (str): Method for the sheets without a background
+        num_points (int): Number of points averaged at the endpoints of new regions
+
+    Returns:
+        list: Task dicts with keys 'Sheet', 'Method', 'X', 'Y' and 'Regions'
+    """
+    tasks = []
+    for sheet_name, core_level_data in data['Core levels'].items():
+        x = np.asarray(core_level_data['B.E.'], dtype=float)
+        y = np.asarray(core_level_data['Raw Data'], dtype=float)
+        bg_data = core_level_data.get('Background', {})
+
+        regions = copy.deepcopy(bg_data.get('Regions') or [])
+        if regions:
+            method = bg_data.get('Bkg Type') or default_method
+            for region in regions:
+                region['Dirty'] = True
+        else:
+            method = bg_data.get('Bkg Type') or default_method
+            low = _to_float(bg_data.get('Bkg Low'), np.min(x))
+            high = _to_float(bg_data.get('Bkg High'), np.max(x))
+            cross_sections = None
+            if method in BackgroundCalculations.TOUGAARD_METHODS:
+                cross_sections = BackgroundCalculations.get_tougaard_cross_sections(
+                    bg_data, BackgroundCalculations.TOUGAARD_METHODS[method])
+            regions = [BackgroundCalculations.make_background_region(
+                BackgroundCalculations.region_method(method), low, high,
+                _to_float(bg_data.get('Bkg Offset High'), 0), _to_float(bg_data.get('Bkg Offset Low'), 0),
+                num_points, cross_sections)]
+
+        tasks.append({'Sheet': sheet_name, 'Method': method, 'X': x, 'Y': y, 'Regions': regions})
+    return tasks
+
+
+def compute_sheet_background(task):
+    """Worker: calculate the regions of one task and return (sheet name, background, regions)."""
+    background = BackgroundCalculations.update_region_backgrounds(task['X'], task['Y'], task['Regions'])
+    return task['Sheet'], background, task['Regions']
+
+
+def store_sheet_background(data, task, background, regions):
+    """Write a computed background into window.Data and its regions into the shared background cache."""
+    x, y = task['X'], task['Y']
+    core_level_data = data['Core levels'][task['Sheet']]
+    core_level_data.setdefault('Background', {}).update({
+        'Regions': regions,
+        'Bkg Y': np.asarray(background).tolist(),
+        'Bkg X': x.tolist(),
+        'Bkg Type': task['Method']
+    })
+
+    # The workers filled their own caches, repeat the entries here so the GUI gets hits
+    for region in regions:
+        mask = (x >= region['Low']) & (x <= region['High'])
+        if len(region['Bkg Y']) < 2 or len(region['Bkg Y']) != np.count_nonzero(mask):
+            continue
+        method = BackgroundCalculations.resolve_region_method(region, y[mask])
+        key = BackgroundCalculations.background_cache_key(method, x[mask], y[mask], region['Offset High'],
+                                                          region['Offset Low'], region['Averaging Points'],
+                                                          region['Cross Sections'])
+        background_cache.put(key, region['Bkg Y'])
+
+
+class BackgroundPipeline(ProcessPipeline):
+    """Compute background tasks in a process pool, results[sheet] holding the (background, regions) pair."""
+
+    def __init__(self, tasks, max_workers=None):
+        super().__init__(compute_sheet_background, tasks, max_workers)
+
+    def collect(self, task, result):
+        _, background, regions = result
+        self.results[task['Sheet']] = (background, regions)
+
+    def store_results(self, data):
+        """Write every computed background into window.Data and the background cache."""
+        tasks = {task['Sheet']: task for task in self.tasks}
+        for sheet_name, (background, regions) in self.results.items():
+            store_sheet_background(data, tasks[sheet_name], background, regions)
@@ -0,0 +1,70 @@
+import wx
+import numpy as np
+
+from libraries.Batch_Background import BACKGROUND_METHODS, BackgroundPipeline, build_background_tasks
+from libraries.Save import save_state
+
+
+def compute_all_backgrounds(window):
+    """
+    Compute the background of every core level in a process pool, with a cancellable progress dialog.
+
+    Per-sheet settings come from the existing Background entries, the method asked here is used for the
+    sheets without one. Results are written into window.Data and the background cache once all sheets are
+    done, a cancelled run leaves window.Data unchanged.
+
+    Args:
+        window: The main application window.
+    """
+    if not window.Data.get('Core levels'):
+        wx.MessageBox("No core levels to process.", "Information", wx.OK | wx.ICON_INFORMATION)
+        return
+
+    dialog = wx.SingleChoiceDialog(window, "Method for the sheets without a background:",
+                                   "Compute All Backgrounds", BACKGROUND_METHODS)
+    if window.background_method in BACKGROUND_METHODS:
+        dialog.SetSelection(BACKGROUND_METHODS.index(window.background_method))
+    if dialog.ShowModal() != wx.ID_OK:
+        dialog.Destroy()
+        return
+    default_method = dialog.GetStringSelection()
+    dialog.Destroy()
+
+    try:
+        num_points = max(1, int(window.averaging_points))
+    except (AttributeError, ValueError, TypeError):
+        num_points = 5
+
+    tasks = build_background_tasks(window.Data, default_method, num_points)
+    progress = wx.ProgressDialog("Compute All Backgrounds", f"Computing {len(tasks)} backgrounds...",
+                                 maximum=len(tasks), parent=window,
+                                 style=wx.PD_APP_MODAL | wx.PD_CAN_ABORT | wx.PD_ELAPSED_TIME | wx.PD_AUTO_HIDE)
+
+    pipeline = BackgroundPipeline(tasks)
+    try:
+        pipeline.start()
+        while not pipeline.finished:
+            finished_sheets = pipeline.poll(0.1)
+            message = f"Finished {finished_sheets[-1]}" if finished_sheets else \
+                f"Computing {len(tasks)} backgrounds..."
+            keep_going, _ = progress.Update(pipeline.completed, message)
+            if not keep_going:
+                pipeline.cancel()
+    finally:
+        progress.Destroy()
+
+    if pipeline.cancelled:
+        return
+
+    pipeline.store_results(window.Data)
+
+    # Show the new background of the current sheet
+    sheet_name = window.sheet_combobox.GetValue()
+    if sheet_name in window.Data['Core levels']:
+        window.background = np.array(window.Data['Core levels'][sheet_name]['Background']['Bkg Y'])
+        window.clear_and_replot()
+    save_state(window)
+
+    if pipeline.errors:
+        errors = "\n".join(f"{sheet}: {error}" for sheet, error in pipeline.errors.items())
+        wx.MessageBox(f"Background failed for:\n{errors}", "Compute All Backgrounds", wx.OK | wx.ICON_WARNING)
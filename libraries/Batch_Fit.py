@@ -0,0 +1,135 @@
+# ALL-SHEETS FIT PIPELINE -------------------------------------------------
+# One fit task per core level, fitted in a process pool.
+# -------------------------------------------------------------------------
+import time
+
+import numpy as np
+
+from libraries.Fit_Executor import snapshot_core_level
+from libraries.Fit_Problem import compile_fit_problem, PeakFitter, peak_results, SKIPPED_MODELS
+from libraries.Peak_Functions import PeakFunctions
+from libraries.Process_Pipeline import ProcessPipeline
+
+FIT_METHODS = ["leastsq", "least_squares", "nelder", "powell", "cobyla", "trust-constr"]
+
+# A fit is reported as slow when it takes this many times the median fit time of the run, and at least
+# SLOW_FIT_MIN_TIME seconds (the first fit of every worker process also builds the model caches)
+SLOW_FIT_FACTOR = 3.0
+SLOW_FIT_MIN_TIME = 1.0
+
+
+def build_fit_tasks(data, method='least_squares', max_nfev=None, jacobian_mode="Analytic"):
+    """
+    Build one fit task per core level of window.Data that has peaks to fit.
+
+    Sheets without peaks, and sheets with Unfitted or D-parameter peaks, get no task.
+
+    Args:
+        data (dict): window.Data
+        method (str): lmfit minimizer method
+        max_nfev (int): Maximum number of function evaluations per fit
+        jacobian_mode (str): One of Peak_Jacobians.JACOBIAN_MODES ("Analytic", "Finite Differences", "Cross-Check", "Sparse")
+
+    Returns:
+        list: Task dicts with keys 'Sheet', 'Data', 'Method', 'Max Nfev' and 'Jacobian'
+    """
+    tasks = []
+    for sheet_name, core_level_data in data['Core levels'].items():
+        peaks = core_level_data.get('Fitting', {}).get('Peaks', {})
+        if not peaks or 'Bkg Y' not in core_level_data.get('Background', {}):
+            continue
+        if any(peak.get('Fitting Model') in SKIPPED_MODELS for peak in peaks.values()):
+            continue
+        tasks.append({'Sheet': sheet_name, 'Data': snapshot_core_level(data, sheet_name), 'Method': method,
+                      'Max Nfev': max_nfev, 'Jacobian': jacobian_mode})
+    return tasks
+
+
+def fit_core_level(task):
+    """
+    Worker: fit one task and return its result dict.
+
+    The dict has the fitted peaks (as peak_results), their labels and models, and the fit statistics
+    'R2', 'RSD', 'Red. Chi2', 'Chi2', 'Nfev' and 'Time' (seconds).
+    """
+    start = time.perf_counter()
+    sheet_name = task['Sheet']
+    problem = compile_fit_problem(task['Data'], sheet_name)
+    if problem is None:
+        raise ValueError("Sheets with Unfitted or D-parameter peaks are not fitted")
+    result = PeakFitter(problem).fit(method=task['Method'], max_nfev=task['Max Nfev'],
+                                     jacobian_mode=task['Jacobian'])
+    peaks = peak_results(problem, result.params)
+
+    residuals = problem.y_subtracted - result.best_fit
+    ss_tot = np.sum((problem.y_subtracted - np.mean(problem.y_subtracted)) ** 2)
+    r_squared = 1 - np.sum(residuals ** 2) / ss_tot
+
+    # LA peaks are evaluated over the full range, as in apply_fit_result
+    if any("LA" in model_name for model_name in problem.model_names):
+        total_fit = np.zeros_like(problem.x)
+        for peak in peaks:
+            if 'y_values' in peak:
+                total_fit += np.asarray(peak['y_values'])[problem.mask]
+    else:
+        total_fit = result.best_fit
+    rsd = PeakFunctions.calculate_rsd(problem.y, total_fit + problem.background)
+
+    return {
+        'Sheet': sheet_name,
+        'Labels': problem.labels,
+        'Models': problem.model_names,
+        'Peaks': peaks,
+        'R2': float(r_squared),
+        'RSD': round(float(rsd), 3),
+        'Red. Chi2': float(result.redchi),
+        'Chi2': float(result.chisqr),
+        'Nfev': int(result.nfev),
+        'Time': time.perf_counter() - start,
+    }
+
+
+def store_fit_result(data, fit_result):
+    """
+    Write the fitted peaks of one result into window.Data.
+
+    Returns:
+        bool: False when the peaks of the sheet changed since the task was built (the result is dropped)
+    """
+    existing_peaks = data['Core levels'].get(fit_result['Sheet'], {}).get('Fitting', {}).get('Peaks', {})
+    if (list(existing_peaks) != fit_result['Labels'] or
+            [peak.get('Fitting Model') for peak in existing_peaks.values()] != fit_result['Models']):
+        return False
+    for label, peak in zip(fit_result['Labels'], fit_result['Peaks']):
+        existing_peaks[label].update(peak)
+    return True
+
+
+def slow_fits(fit_results, max_nfev=None, factor=SLOW_FIT_FACTOR, min_time=SLOW_FIT_MIN_TIME):
+    """
+    Names of the sheets whose fit took more than factor times the median fit time (and more than min_time
+    seconds), or used all max_nfev.
+
+    Args:
+        fit_results (dict): {sheet name: result dict of fit_core_level}
+    """
+    if not fit_results:
+        return []
+    median_time = np.median([fit_result['Time'] for fit_result in fit_results.values()])
+    return [sheet_name for sheet_name, fit_result in fit_results.items()
+            if (len(fit_results) > 2 and fit_result['Time'] > max(factor * median_time, min_time)) or
+            (max_nfev and fit_result['Nfev'] >= max_nfev)]
+
+
+class FitPipeline(ProcessPipeline):
+    """Fit tasks in a process pool, results[sheet] holding the result dict of fit_core_level."""
+
+    def __init__(self, tasks, max_workers=None):
+        super().__init__(fit_core_level, tasks, max_workers)
+        self.stale = []
+
+    def store_results(self, data):
+        """Write every fit into window.Data, the sheets edited meanwhile are listed in stale and left unchanged."""
+        self.stale = [sheet_name for sheet_name, fit_result in self.results.items()
+                      if not store_fit_result(data, fit_result)]
+        return [sheet_name for sheet_name in self.results if sheet_name not in self.stale]
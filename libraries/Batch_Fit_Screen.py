@@ -0,0 +1,127 @@
+import wx
+
+from libraries.Batch_Fit import FIT_METHODS, FitPipeline, build_fit_tasks, slow_fits
+from libraries.Export import export_sheet_results
+from libraries.Grid_Operations import populate_results_grid
+from libraries.Open import load_library_data
+from libraries.Save import save_state
+from libraries.Sheet_Operations import on_sheet_selected
+
+
+def fit_all_core_levels(window):
+    """
+    Fit every core level with peaks in a process pool, with a cancellable progress dialog.
+
+    Each sheet is fitted from its own peaks, constraints and background, with the optimization method asked
+    here and the maximum iterations and Jacobian mode of the fitting window. Once all fits are done, the peaks
+    and results of every sheet are written into window.Data, the Results grid is refreshed once and a summary
+    of the fits (failures and slow fits first) is shown. A cancelled run leaves window.Data unchanged.
+
+    Args:
+        window: The main application window.
+    """
+    if not window.Data.get('Core levels'):
+        wx.MessageBox("No core levels to fit.", "Information", wx.OK | wx.ICON_INFORMATION)
+        return
+
+    dialog = wx.SingleChoiceDialog(window, "Optimization method:", "Fit All Core Levels", FIT_METHODS)
+    method = "least_squares"
+    if window.fitting_window:
+        method = window.fitting_window.get_optimization_method()
+    if method in FIT_METHODS:
+        dialog.SetSelection(FIT_METHODS.index(method))
+    if dialog.ShowModal() != wx.ID_OK:
+        dialog.Destroy()
+        return
+    method = dialog.GetStringSelection()
+    dialog.Destroy()
+
+    max_nfev = window.max_iterations
+    tasks = build_fit_tasks(window.Data, method, max_nfev, getattr(window, 'jacobian_mode', "Analytic"))
+    if not tasks:
+        wx.MessageBox("No core levels with peaks to fit.", "Information", wx.OK | wx.ICON_INFORMATION)
+        return
+
+    save_state(window)
+    progress = wx.ProgressDialog("Fit All Core Levels", f"Fitting {len(tasks)} core levels...",
+                                 maximum=len(tasks), parent=window,
+                                 style=wx.PD_APP_MODAL | wx.PD_CAN_ABORT | wx.PD_ELAPSED_TIME | wx.PD_AUTO_HIDE)
+
+    pipeline = FitPipeline(tasks)
+    try:
+        pipeline.start()
+        while not pipeline.finished:
+            finished_sheets = pipeline.poll(0.1)
+            message = f"Finished {finished_sheets[-1]}" if finished_sheets else \
+                f"Fitting {len(tasks)} core levels..."
+            keep_going, _ = progress.Update(pipeline.completed, message)
+            if not keep_going:
+                pipeline.cancel()
+    finally:
+        progress.Destroy()
+
+    if pipeline.cancelled:
+        return
+
+    # Peaks and results of every sheet first, then the Results grid in one pass
+    stored_sheets = pipeline.store_results(window.Data)
+    library_data = load_library_data()
+    for sheet_name in stored_sheets:
+        export_sheet_results(window, sheet_name, library_data)
+    populate_results_grid(window)
+
+    # Show the new fit of the current sheet
+    sheet_name = window.sheet_combobox.GetValue()
+    if sheet_name in stored_sheets:
+        on_sheet_selected(window, sheet_name)
+    save_state(window)
+
+    BatchFitSummaryWindow(window, pipeline, max_nfev).Show()
+
+
+class BatchFitSummaryWindow(wx.Frame):
+    """Fit statistics of every core level of a Fit All Core Levels run, failures and slow fits first."""
+
+    COLUMNS = [("Core level", 110), ("Status", 90), ("R²", 70), ("RSD", 60), ("Red. Chi²", 80), ("Iterations", 70),
+               ("Time (s)", 60), ("Message", 250)]
+
+    def __init__(self, parent, pipeline, max_nfev=None):
+        super().__init__(parent, title="Fit All Core Levels", size=(820, 360),
+                         style=wx.DEFAULT_FRAME_STYLE | wx.STAY_ON_TOP)
+        panel = wx.Panel(self)
+        main_sizer = wx.BoxSizer(wx.VERTICAL)
+
+        slow = slow_fits(pipeline.results, max_nfev)
+        rows = [(sheet_name, "Failed", None, error) for sheet_name, error in pipeline.errors.items()]
+        rows += [(sheet_name, "Not applied", pipeline.results[sheet_name], "Peaks changed during the fit")
+                 for sheet_name in pipeline.stale]
+        rows += [(sheet_name, "Slow", pipeline.results[sheet_name],
+                  "Maximum iterations reached" if max_nfev and pipeline.results[sheet_name]['Nfev'] >= max_nfev
+                  else "Much slower than the other fits") for sheet_name in slow if sheet_name not in pipeline.stale]
+        rows += [(sheet_name, "OK", fit_result, "") for sheet_name, fit_result in pipeline.results.items()
+                 if sheet_name not in slow and sheet_name not in pipeline.stale]
+
+        summary = wx.StaticText(panel, label=f"{len(pipeline.results) - len(pipeline.stale)} fitted, "
+                                             f"{len(pipeline.errors)} failed, {len(slow)} slow")
+        main_sizer.Add(summary, 0, wx.ALL, 5)
+
+        self.summary_list = wx.ListCtrl(panel, style=wx.LC_REPORT | wx.LC_SINGLE_SEL)
+        for col, (label, width) in enumerate(self.COLUMNS):
+            self.summary_list.InsertColumn(col, label, width=width)
+        for row, (sheet_name, status, fit_result, message) in enumerate(rows):
+            self.summary_list.InsertItem(row, sheet_name)
+            self.summary_list.SetItem(row, 1, status)
+            if fit_result is not None:
+                self.summary_list.SetItem(row, 2, f"{fit_result['R2']:.5f}")
+                self.summary_list.SetItem(row, 3, f"{fit_result['RSD']:.3f}")
+                self.summary_list.SetItem(row, 4, f"{fit_result['Red. Chi2']:.2f}")
+                self.summary_list.SetItem(row, 5, str(fit_result['Nfev']))
+                self.summary_list.SetItem(row, 6, f"{fit_result['Time']:.2f}")
+            self.summary_list.SetItem(row, 7, message)
+        main_sizer.Add(self.summary_list, 1, wx.EXPAND | wx.ALL, 5)
+
+        close_button = wx.Button(panel, label="Close")
+        close_button.Bind(wx.EVT_BUTTON, lambda event: self.Close())
+        main_sizer.Add(close_button, 0, wx.ALIGN_CENTER | wx.ALL, 5)
+
+        panel.SetSizer(main_sizer)
@@ -0,0 +1,207 @@
+# BENCHMARKS FOR THE NUMERICAL ENGINES ------------------------------------
+# Run with: python -m libraries.Benchmark
+# -------------------------------------------------------------------------
+import time
+import lmfit
+import numpy as np
+
+from libraries.Peak_Functions import BackgroundCalculations, PeakFunctions
+from libraries.Peak_Evaluator import BroadcastPeakModel
+from libraries.Peak_Jacobians import CompositeJacobian
+from libraries.Fit_Problem import (compile_fit_problem, PeakFitter, peak_supports, jacobian_density,
+                                    SPARSE_MIN_PEAKS)
+
+
+def make_test_spectrum(num_points, be_start=295.0, be_end=280.0, noise=20.0, seed=0):
+    """
+    Build a synthetic C1s-like spectrum on a descending binding energy axis.
+
+    Args:
+        num_points (int): Number of data points
+        be_start (float): First binding energy of the axis
+        be_end (float): Last binding energy of the axis
+        noise (float): Standard deviation of the added Gaussian noise
+        seed (int): Seed of the random generator
+
+    Returns:
+        tuple: (x, y) arrays
+    """
+    x = np.linspace(be_start, be_end, num_points)
+    y = (1000 + 5000 * np.exp(-((x - 285) / 0.6) ** 2) + 3000 * np.exp(-((x - 288.5) / 0.8) ** 2)
+         + 800 / (1 + np.exp(-(x - 285) / 0.5)))
+    y = y + np.random.default_rng(seed).normal(0, noise, num_points)
+    return x, y
+
+
+def time_call(func, *args, repeat=1, **kwargs):
+    """Return (best time in seconds, result) of calling func repeat times."""
+    best = np.inf
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def benchmark_shirley(sizes=(500, 2000, 5000)):
+    """Compare the cumulative-integral Shirley background with the original O(N²) loop."""
+    print("Shirley background: cumulative integrals vs original loop")
+    print(f"{'Points':>8} {'Old (s)':>10} {'New (s)':>10} {'Speed-up':>10} {'Max |diff|':>12}")
+    for n in sizes:
+        x, y = make_test_spectrum(n)
+        t_old, bg_old = time_call(BackgroundCalculations.calculate_shirley_background_OLD, x, y, 0, 0)
+        t_new, bg_new = time_call(BackgroundCalculations.calculate_shirley_background, x, y, 0, 0, repeat=5)
+        diff = np.max(np.abs(bg_old - bg_new))
+        print(f"{n:>8} {t_old:>10.4f} {t_new:>10.4f} {t_old / t_new:>10.1f} {diff:>12.2e}")
+
+
+def benchmark_tougaard(sizes=(500, 2000, 5000)):
+    """Compare the FFT Tougaard engine with the original per-point loop for one U4 cross-section."""
+    class _Window:
+        Data = {'Core levels': {'Bench': {'Background': {}}}}
+
+    print("1x U4-Tougaard background: FFT convolution vs original loop")
+    print(f"{'Points':>8} {'Old (s)':>10} {'New (s)':>10} {'Speed-up':>10} {'Max |diff|':>12}")
+    for n in sizes:
+        x, y = make_test_spectrum(n)
+        t_old, bg_old = time_call(BackgroundCalculations.calculate_tougaard_background_OLD, x, y, 'Bench', _Window)
+        t_new, bg_new = time_call(BackgroundCalculations.calculate_tougaard_background, x, y, 'Bench', _Window,
+                                  repeat=5)
+        diff = np.max(np.abs(bg_old - bg_new))
+        print(f"{n:>8} {t_old:>10.4f} {t_new:>10.4f} {t_old / t_new:>10.1f} {diff:>12.2e}")
+
+
+def benchmark_smart2(sizes=(500, 1000, 2000, 5000)):
+    """
+    Compare the vectorized Smart2 background with the original per-point loop, with the same 30-point
+    Savitzky-Golay window as the original.
+    """
+    print("Smart2 background: vectorized vs original loop")
+    print(f"{'Points':>8} {'Old (s)':>10} {'New (s)':>10} {'Speed-up':>10} {'Max |diff|':>12}")
+    for n in sizes:
+        x, y = make_test_spectrum(n)
+        t_old, bg_old = time_call(BackgroundCalculations.calculate_smart2_background_OLD, x, y)
+        t_new, bg_new = time_call(BackgroundCalculations.calculate_smart2_background, x, y, window_length=30,
+                                  repeat=5)
+        diff = np.max(np.abs(bg_old - bg_new))
+        print(f"{n:>8} {t_old:>10.4f} {t_new:>10.4f} {t_old / t_new:>10.1f} {diff:>12.2e}")
+
+
+def benchmark_laxg(sizes=(300, 1000, 3000), factors=(2, 4, 8, 16, 32)):
+    """Time the cached FFT LA*G against the original and check that the oversampling factor has converged."""
+    args = (285.0, 1000.0, 1.0, 1.2, 0.9, 0.6)  # center, area, fwhm, sigma, gamma, fwhm_g
+
+    print("LA*G line shape: cached FFT convolution vs original convolution")
+    print(f"{'Points':>8} {'Old (s)':>10} {'New (s)':>10} {'Speed-up':>10}")
+    for n in sizes:
+        x, _ = make_test_spectrum(n)
+        t_old, _ = time_call(PeakFunctions.LAxG_OLD, x, *args, repeat=5)
+        t_new, _ = time_call(PeakFunctions.LAxG, x, *args, repeat=5)
+        print(f"{n:>8} {t_old:>10.5f} {t_new:>10.5f} {t_old / t_new:>10.1f}")
+
+    x, _ = make_test_spectrum(sizes[0])
+    print(f"LA*G oversampling convergence ({sizes[0]} points, max deviation from x{factors[-1]} / height)")
+    for factor, deviation in PeakFunctions.laxg_oversampling_check(x, *args, factors=factors).items():
+        marker = " <- default" if factor == PeakFunctions.LAXG_OVERSAMPLING else ""
+        print(f"{'x' + str(factor):>8} {deviation:>12.2e}{marker}")
+
+
+def make_peak_model(num_peaks, be_start=295.0, be_end=280.0):
+    """Composite model and parameters of num_peaks GL (Area) and SGL (Area) peaks spread over the range."""
+    model = None
+    params = lmfit.Parameters()
+    for i in range(num_peaks):
+        prefix = f'peak{i}_'
+        func = PeakFunctions.gauss_lorentz_Area if i % 2 == 0 else PeakFunctions.S_gauss_lorentz_Area
+        peak_model = lmfit.Model(func, prefix=prefix)
+        params.add(f'{prefix}center', value=be_end + (be_start - be_end) * (i + 0.5) / num_peaks)
+        params.add(f'{prefix}area', value=2000.0, min=0)
+        params.add(f'{prefix}fwhm', value=1.2, min=0.3, max=3.5)
+        params.add(f'{prefix}fraction', value=30.0, min=0, max=100)
+        model = peak_model if model is None else model + peak_model
+    return model, params
+
+
+def benchmark_peak_sum(peak_counts=(8, 14, 20), num_points=1000):
+    """Time one evaluation of the summed lmfit components against the broadcast evaluator."""
+    x, _ = make_test_spectrum(num_points)
+
+    print(f"Multi-peak model evaluation ({num_points} points): lmfit composite vs broadcast")
+    print(f"{'Peaks':>8} {'Old (ms)':>10} {'New (ms)':>10} {'Speed-up':>10} {'Max |diff|':>12}")
+    for n in peak_counts:
+        model, params = make_peak_model(n)
+        broadcast = BroadcastPeakModel(model)
+        t_old, y_old = time_call(model.eval, params, x=x, repeat=20)
+        t_new, y_new = time_call(broadcast.eval, params, x=x, repeat=20)
+        print(f"{n:>8} {t_old * 1e3:>10.3f} {t_new * 1e3:>10.3f} {t_old / t_new:>10.1f} "
+              f"{np.max(np.abs(y_old - y_new)):>12.2e}")
+
+
+def make_survey_data(num_peaks, num_points=4000, be_start=1100.0, be_end=0.0, seed=0):
+    """
+    window.Data with one wide-range sheet of num_peaks well separated GL (Area) peaks, started off their
+    true values, each position bound within ±1 eV.
+    """
+    rng = np.random.default_rng(seed)
+    x = np.linspace(be_start, be_end, num_points)
+    centers = be_end + (be_start - be_end) * (np.arange(num_peaks) + 0.5) / num_peaks
+    fwhms = rng.uniform(1.2, 2.5, num_peaks)
+    areas = rng.uniform(2000, 20000, num_peaks)
+    y = np.full(num_points, 500.0)
+    peaks = {}
+    for i, (center, fwhm, area) in enumerate(zip(centers, fwhms, areas)):
+        y += PeakFunctions.gauss_lorentz_Area(x, center, area, fwhm, 30.0)
+        peaks[f"Peak {i}"] = {
+            'Position': round(center + rng.normal(0, 0.2), 2), 'Height': 0.0, 'FWHM': round(fwhm * 1.2, 2),
+            'L/G': 20.0, 'Area': round(area * 0.8, 2), 'Sigma': 1.0, 'Gamma': 0.5, 'Skew': 0.64,
+            'Fitting Model': "GL (Area)",
+            'Constraints': {'Position': f"{center - 1:.2f}:{center + 1:.2f}", 'Height': '1:1e7', 'FWHM': '0.3:4',
+                            'L/G': '0:80', 'Area': '1:1e7', 'Sigma': '0.01:3', 'Gamma': '0.01:3',
+                            'Skew': '0.01:2'}}
+    y = y + rng.normal(0, 10, num_points)
+    return {'Core levels': {'Survey': {
+        'B.E.': list(x), 'Raw Data': list(y),
+        'Background': {'Bkg Y': list(np.full(num_points, 500.0)), 'Bkg Low': be_end, 'Bkg High': be_start},
+        'Fitting': {'Peaks': peaks}}}}
+
+
+def benchmark_sparse_jacobian(peak_counts=(8, 16, 32, 48), num_points=4000):
+    """
+    Time the dense and sparse (support-window) Jacobians of a wide-range spectrum, on their own and in
+    least_squares fits.
+    """
+    modes = ["Finite Differences", "Analytic", "Sparse"]
+    print(f"Wide-range spectrum ({num_points} points): Jacobian evaluation (ms), least_squares fit (s) and nfev")
+    print(f"{'Peaks':>8} {'Density':>8} {'Jac dense':>10} {'Jac sparse':>10}"
+          + "".join(f" {mode[:12]:>12} {'nfev':>5}" for mode in modes) + f" {'Chi² diff':>10}")
+    for n in peak_counts:
+        problem = compile_fit_problem(make_survey_data(n, num_points), 'Survey')
+        fitter = PeakFitter(problem)
+        params = problem.parameters()
+        params.update_constraints()
+        supports = peak_supports(problem, params)
+        density = jacobian_density(problem, params, supports)
+        t_dense, _ = time_call(CompositeJacobian(fitter.model).model_jacobian, params, problem.x, repeat=5)
+        t_sparse, _ = time_call(CompositeJacobian(fitter.model, supports).model_jacobian, params, problem.x,
+                                repeat=5)
+        row, chisqrs = f"{n:>8} {density:>8.3f} {t_dense * 1e3:>10.2f} {t_sparse * 1e3:>10.2f}", []
+        for mode in modes:
+            t, result = time_call(fitter.fit, method='least_squares', max_nfev=5000, jacobian_mode=mode)
+            chisqrs.append(result.chisqr)
+            row += f" {t:>12.3f} {result.nfev:>5}"
+        print(row + f" {(max(chisqrs) - min(chisqrs)) / min(chisqrs):>10.2e}")
+    print(f"Sparse fits fall back to Analytic below {SPARSE_MIN_PEAKS} peaks")
+
+
+def main():
+    benchmark_shirley()
+    benchmark_tougaard()
+    benchmark_smart2()
+    benchmark_laxg()
+    benchmark_peak_sum()
+    benchmark_sparse_jacobian()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import wx
+from libraries.Background_Cache import background_cache
+from libraries.Fit_Cache import fit_cache
+
+
+class CacheStatisticsWindow(wx.Frame):
+    """Debug panel showing the hit/miss counters of the shared caches."""
+
+    def __init__(self, parent):
+        super().__init__(parent, title="Cache Statistics", size=(360, 300),
+                         style=wx.DEFAULT_FRAME_STYLE | wx.STAY_ON_TOP)
+        self.parent = parent
+        self.caches = {'Background': background_cache, 'Fit': fit_cache}
+
+        panel = wx.Panel(self)
+        main_sizer = wx.BoxSizer(wx.VERTICAL)
+
+        self.stats_list = wx.ListCtrl(panel, style=wx.LC_REPORT | wx.LC_SINGLE_SEL)
+        self.stats_list.InsertColumn(0, "Counter", width=150)
+        for i, name in enumerate(self.caches):
+            self.stats_list.InsertColumn(i + 1, name, width=90)
+        main_sizer.Add(self.stats_list, 1, wx.EXPAND | wx.ALL, 5)
+
+        button_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        clear_button = wx.Button(panel, label="Clear Caches")
+        clear_button.Bind(wx.EVT_BUTTON, self.on_clear)
+        reset_button = wx.Button(panel, label="Reset Counters")
+        reset_button.Bind(wx.EVT_BUTTON, self.on_reset)
+        button_sizer.Add(clear_button, 0, wx.ALL, 2)
+        button_sizer.Add(reset_button, 0, wx.ALL, 2)
+        main_sizer.Add(button_sizer, 0, wx.ALIGN_CENTER)
+
+        panel.SetSizer(main_sizer)
+
+        # Refresh the counters once per second while the window is open
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, lambda event: self.update_stats(), self.timer)
+        self.timer.Start(1000)
+        self.Bind(wx.EVT_CLOSE, self.on_close)
+
+        self.update_stats()
+
+    def update_stats(self):
+        all_stats = [cache.stats() for cache in self.caches.values()]
+        self.stats_list.DeleteAllItems()
+        for row, counter in enumerate(all_stats[0]):
+            self.stats_list.InsertItem(row, counter)
+            for col, stats in enumerate(all_stats):
+                value = stats[counter]
+                self.stats_list.SetItem(row, col + 1, f"{value:.1f}" if isinstance(value, float) else str(value))
+
+    def on_clear(self, event):
+        for cache in self.caches.values():
+            cache.clear()
+        self.update_stats()
+
+    def on_reset(self, event):
+        for cache in self.caches.values():
+            cache.reset_counters()
+        self.update_stats()
+
+    def on_close(self, event):
+        self.timer.Stop()
+        self.Destroy()
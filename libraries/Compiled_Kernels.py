@@ -0,0 +1,216 @@
+# COMPILED LINE-SHAPE KERNELS ---------------------------------------------
+# Optional numba versions of the inner loops of the GL, SGL, LA, LA*G and
+# Pseudo-Voigt line shapes and of the Shirley and Tougaard integrals. numba is
+# detected at import, without it the NumPy code in Peak_Functions is used.
+# -------------------------------------------------------------------------
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """Stand-in for numba.njit: the kernels run as plain Python (only used by self_test)."""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+
+BACKENDS = ["NumPy", "Numba"]
+
+_backend = "NumPy"
+
+LN2 = np.log(2)
+
+
+def available_backends():
+    """Backends that can be selected on this installation."""
+    return BACKENDS if NUMBA_AVAILABLE else BACKENDS[:1]
+
+
+def get_backend():
+    return _backend
+
+
+def set_backend(name):
+    """
+    Select the kernel backend used by PeakFunctions and BackgroundCalculations.
+
+    Args:
+        name (str): "NumPy" or "Numba"; "Numba" falls back to "NumPy" when numba is not installed
+
+    Returns:
+        str: The backend actually in use
+    """
+    global _backend
+    _backend = name if name in available_backends() else "NumPy"
+    return _backend
+
+
+def use_compiled(x):
+    """True when the compiled backend is selected and x is an array the kernels accept."""
+    return _backend == "Numba" and isinstance(x, np.ndarray) and x.ndim == 1 and x.dtype == np.float64
+
+
+# LINE SHAPES --------------------------------------------------------------
+# Same operation order as the NumPy expressions so both backends agree to rounding.
+
+@njit(cache=True, error_model='numpy')
+def _gauss_lorentz(x, center, fwhm, fraction, amplitude):
+    out = np.empty_like(x)
+    for i in range(len(x)):
+        u = ((x[i] - center) / fwhm) ** 2
+        out[i] = amplitude * (np.exp(-4 * LN2 * (1 - fraction / 100) * u) * (1 / (1 + 4 * fraction / 100 * u)))
+    return out
+
+
+@njit(cache=True, error_model='numpy')
+def _s_gauss_lorentz(x, center, fwhm, fraction, amplitude):
+    out = np.empty_like(x)
+    for i in range(len(x)):
+        u = ((x[i] - center) / fwhm) ** 2
+        out[i] = amplitude * ((1 - fraction / 100) * np.exp(-4 * LN2 * u) +
+                              fraction / 100 * (1 / (1 + 4 * u)))
+    return out
+
+
+@njit(cache=True, error_model='numpy')
+def _pseudo_voigt(x, center, amplitude, sigma, fraction):
+    out = np.empty_like(x)
+    sigma2 = sigma ** 2
+    gamma = sigma * np.sqrt(2 * LN2)
+    for i in range(len(x)):
+        d2 = (x[i] - center) ** 2
+        gaussian = (1 - fraction / 100) * np.exp(-d2 / (2 * sigma2))
+        lorentzian = fraction / 100 * (gamma ** 2 / (d2 + gamma ** 2))
+        out[i] = amplitude * (gaussian + lorentzian)
+    return out
+
+
+@njit(cache=True, error_model='numpy')
+def _la_shape(x, center, F, sigma, gamma):
+    out = np.empty_like(x)
+    for i in range(len(x)):
+        exponent = gamma if x[i] <= center else sigma
+        out[i] = (1 + 4 * ((x[i] - center) / F) ** 2) ** -exponent
+    return out
+
+
+# BACKGROUNDS --------------------------------------------------------------
+
+@njit(cache=True, error_model='numpy')
+def _shirley_iterations(y_padded, dx, background, max_iter, tol):
+    n = len(y_padded)
+    I0, Iend = y_padded[0], y_padded[n - 1]
+    cumulative = np.empty(n)
+    for _ in range(max_iter):
+        cumulative[0] = 0.0
+        for k in range(1, n):
+            cumulative[k] = cumulative[k - 1] + 0.5 * ((y_padded[k] - background[k]) +
+                                                       (y_padded[k - 1] - background[k - 1])) * dx[k - 1]
+        converged = True
+        for i in range(1, n - 1):
+            A1 = cumulative[i - 1]
+            A2 = cumulative[n - 1] - cumulative[i]
+            new_value = Iend + (I0 - Iend) * A2 / (A1 + A2)
+            if not abs(new_value - background[i]) < tol:
+                converged = False
+            background[i] = new_value
+        if converged:
+            break
+    return background
+
+
+@njit(cache=True, error_model='numpy')
+def _u4_kernel_sum(E, cross_sections):
+    out = np.zeros_like(E)
+    for j in range(cross_sections.shape[0]):
+        B, C, D = cross_sections[j, 0], cross_sections[j, 1], cross_sections[j, 2]
+        for i in range(len(E)):
+            out[i] += B * E[i] / ((C - E[i] ** 2) ** 2 + D * E[i] ** 2)
+    return out
+
+
+# Python entry points: coerce the lmfit parameters (floats, numpy scalars or ints) to float so numba
+# compiles a single specialization per kernel.
+
+def gauss_lorentz(x, center, fwhm, fraction, amplitude):
+    return _gauss_lorentz(np.ascontiguousarray(x), float(center), float(fwhm), float(fraction), float(amplitude))
+
+
+def s_gauss_lorentz(x, center, fwhm, fraction, amplitude):
+    return _s_gauss_lorentz(np.ascontiguousarray(x), float(center), float(fwhm), float(fraction), float(amplitude))
+
+
+def pseudo_voigt(x, center, amplitude, sigma, fraction):
+    return _pseudo_voigt(np.ascontiguousarray(x), float(center), float(amplitude), float(sigma), float(fraction))
+
+
+def la_shape(x, center, F, sigma, gamma):
+    """Unit-height LA shape (1 + 4((x - center)/F)²)^-(gamma left, sigma right of center)."""
+    return _la_shape(np.ascontiguousarray(x), float(center), float(F), float(sigma), float(gamma))
+
+
+def shirley_iterations(y_padded, dx, background, max_iter, tol):
+    """Run the cumulative-trapezoid Shirley iterations on background in place and return it."""
+    return _shirley_iterations(np.ascontiguousarray(y_padded, dtype=float), np.ascontiguousarray(dx, dtype=float),
+                               background, int(max_iter), float(tol))
+
+
+def u4_kernel_sum(E, cross_sections):
+    """Sum of the U4 Tougaard kernels B*E / ((C - E²)² + D*E²) over [(B, C, D, T0), ...]."""
+    params = np.array([cs[:3] for cs in cross_sections], dtype=float).reshape(-1, 3)
+    return _u4_kernel_sum(np.ascontiguousarray(E, dtype=float), params)
+
+
+# SELF-TEST ----------------------------------------------------------------
+
+def self_test(num_points=801, rtol=1e-9):
+    """
+    Evaluate every line shape and background with both backends and compare them.
+
+    Without numba the kernels run interpreted, which checks the kernel code but not the compiled build.
+
+    Args:
+        num_points (int): Number of points of the synthetic spectrum
+        rtol (float): Maximum deviation relative to the largest value for a check to pass
+
+    Returns:
+        dict: {name: (max relative deviation, passed)} plus 'compiled': NUMBA_AVAILABLE
+    """
+    from libraries.Peak_Functions import PeakFunctions, BackgroundCalculations
+
+    x = np.linspace(295.0, 280.0, num_points)
+    y = (1000 * PeakFunctions.gauss_lorentz(x, 285.0, 1.2, 30, 1) +
+         600 * PeakFunctions.S_gauss_lorentz(x, 286.5, 1.4, 20, 1) +
+         200 + 150 / (1 + np.exp((x - 285.5) / 0.5)))
+
+    checks = {
+        'GL': lambda: PeakFunctions.gauss_lorentz(x, 285.0, 1.2, 30, 1000),
+        'SGL': lambda: PeakFunctions.S_gauss_lorentz(x, 285.0, 1.2, 30, 1000),
+        'Pseudo-Voigt': lambda: PeakFunctions.pseudo_voigt(x, 285.0, 1000, 0.6, 40),
+        'LA': lambda: PeakFunctions.LA(x, 285.0, 1000, 1.2, 1.5, 2.5),
+        'LA*G': lambda: PeakFunctions.LAxG(x, 285.0, 1000, 1.2, 1.5, 2.5, 0.6),
+        'Shirley': lambda: BackgroundCalculations.calculate_shirley_background(x, y, 0, 0),
+        'Tougaard': lambda: BackgroundCalculations.calculate_multi_tougaard_background(
+            x, y, [(2866, 1643, 1, 0), (500, 900, 2, 0)]),
+    }
+
+    global _backend
+    previous = _backend
+    results = {}
+    try:
+        for name, evaluate in checks.items():
+            _backend = "NumPy"
+            reference = evaluate()
+            _backend = "Numba"
+            compiled = evaluate()
+            deviation = float(np.max(np.abs(compiled - reference)) / np.max(np.abs(reference)))
+            results[name] = (deviation, deviation <= rtol)
+    finally:
+        _backend = previous
+
+    results['compiled'] = NUMBA_AVAILABLE
+    return results
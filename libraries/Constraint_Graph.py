@@ -0,0 +1,268 @@
+# CONSTRAINT GRAPH ----------------------------------------------------------
+# Parses the constraint cells of all peaks once into a dependency graph. Links to
+# other peaks (A+1.5, A*0.5) become lmfit expressions instead of narrow min/max
+# bands, links with a tolerance (A+1.5#0.2) a bounded offset or ratio parameter.
+# -------------------------------------------------------------------------
+import functools
+import re
+
+LINK_PATTERN = re.compile(r'^([A-P])([+\-*/])(\d+\.?\d*)(?:#([\d\.]+))?$')
+
+
+class ConstraintCycleError(ValueError):
+    """Raised when peaks reference each other in a loop (A FWHM = B*1 and B FWHM = A*1)."""
+
+
+# CELL PARSING -------------------------------------------------------------
+
+def parse_constraint(constraint_str, current_value, param_name):
+    """
+    Parse a constraint cell of the peak table into bounds.
+
+    Args:
+        constraint_str (str): "Fixed", "min:max", "min,max", a number, or a peak reference
+            ("A+1.5", "A*0.5", "A+1.5#0.5" with an explicit tolerance)
+        current_value (float): Current value of the parameter
+        param_name (str): Parameter the constraint belongs to (sets the tolerances)
+
+    Returns:
+        tuple: (min, max, vary), min and max are floats or peak references still to be evaluated
+    """
+    constraint_str = str(constraint_str).strip()
+    small_error = 0.05
+
+    # Pattern to match A+1.5#0.5 format
+    pattern = r'^([A-P])([+\-*/])(\d+\.?\d*)#([\d\.]+)$'
+    match = re.match(pattern, constraint_str)
+
+    # Pattern for A+2 or A*2 or A/2 or A-2 format
+    pattern_simple = r'^([A-P])([+\-*/])(\d+\.?\d*)$'
+    match_simple = re.match(pattern_simple, constraint_str)
+
+    if constraint_str in ['Fixed']:
+        small_error3 = 0.001
+        if param_name in ["L/G", "fraction"]:
+            return current_value - 0.5, current_value + 0.5, False
+        else:
+            return current_value - small_error3, current_value + small_error3, False
+    elif match:
+        ref_peak, operator, value, delta = match.groups()
+        value = float(value)
+        delta = float(delta)
+        if operator in ['+', '-']:
+            return (f"{ref_peak}{operator}{value - delta}", f"{ref_peak}{operator}{value + delta}", True)
+        elif operator in ['*', '/']:
+            if param_name in ['POSITION', 'FWHM', 'L/G', 'fwhm_g']:
+                delta_percent = delta
+                return (f"{ref_peak}{operator}{value - delta_percent}", f"{ref_peak}{operator}{value + delta_percent}",
+                        True)
+            else:
+                return (f"{ref_peak}{operator}{value-delta}", f"{ref_peak}{operator}{value+delta}", True)
+
+    elif match_simple:
+        ref_peak, operator, value = match_simple.groups()
+        value = float(value)
+        if operator in ['+', '-']:
+            return f"{ref_peak}{operator}{value - small_error}", f"{ref_peak}{operator}{value + small_error}", True
+        elif operator in ['*', '/']:
+            if param_name == 'fwhm_g':
+                small_error2 = 0.01
+            else:
+                small_error2 = 0.0001
+            return f"{ref_peak}{operator}{value - small_error2}", f"{ref_peak}{operator}{value + small_error2}", True
+
+    # If it's a simple number or range
+    if ',' in constraint_str:
+        min_val, max_val = map(float, constraint_str.split(','))
+        return min_val, max_val, True
+    if ':' in constraint_str:
+        min_val, max_val = map(float, constraint_str.split(':'))
+        return min_val, max_val, True
+
+    try:
+        value = float(constraint_str)
+        return value - 0.1, value + 0.1, True
+    except ValueError:
+        pass
+
+    # If we can't parse it, return the current value with a small range
+    return current_value - 0.1, current_value + 0.1, True
+
+
+def evaluate_bound(constraint, peak_value, param_name, current_value):
+    """
+    Turn a bound returned by parse_constraint into a number.
+
+    Args:
+        constraint (float or str): Number, or peak reference such as "A+1.45"
+        peak_value (callable): peak_value(letter, param_name) -> value of the referenced peak, or None
+        param_name (str): Parameter looked up on the referenced peak ('center', 'fwhm', ...)
+        current_value (float): Returned when the bound cannot be evaluated
+
+    Returns:
+        float: The bound
+    """
+    if isinstance(constraint, (int, float)):
+        return constraint
+    if constraint is None:
+        return None
+
+    # Handle the case A+1.5 or A*1.5 or A/1.5 or A-1.5
+    match = re.match(r'([A-J])([+\-*/])(-?\d+\.?\d*)', constraint)
+    if match:
+        peak, op, value = match.groups()
+        reference = peak_value(peak, param_name)
+        if reference is not None:
+            value = float(value)
+            if op == '+':
+                return reference + value
+            elif op == '-':
+                return reference - value
+            elif op == '*':
+                return reference * value
+            elif op == '/':
+                return reference / value if value != 0 else current_value
+
+    # Handle simple numeric constraints
+    try:
+        return float(constraint)
+    except ValueError:
+        return current_value
+
+
+# CONSTRAINT GRAPH ---------------------------------------------------------
+
+class Constraint:
+    """
+    One constraint cell, parsed once.
+
+    kind is 'fixed', 'range' (low:high), 'value' (a number), 'link' (reference peak index, operator, value and
+    optional tolerance), 'default' (empty cell, bounds around the current value) or 'text' (anything else,
+    left to parse_constraint).
+    """
+
+    def __init__(self, text):
+        self.text = text = str(text).strip()
+        self.low = self.high = None
+        self.reference = self.operator = self.value = self.tolerance = None
+
+        match = LINK_PATTERN.match(text)
+        self.kind = 'text'
+        if text == 'Fixed':
+            self.kind = 'fixed'
+        elif match:
+            letter, self.operator, value, tolerance = match.groups()
+            try:
+                self.tolerance = None if tolerance is None else float(tolerance)
+                self.kind = 'link'
+            except ValueError:
+                pass
+            self.reference = ord(letter) - 65
+            self.value = float(value)
+        elif text == '':
+            self.kind = 'default'
+        else:
+            separator = ',' if ',' in text else ':' if ':' in text else None
+            try:
+                if separator:
+                    self.low, self.high = map(float, text.split(separator))
+                    self.kind = 'range'
+                else:
+                    self.value = float(text)
+                    self.kind = 'value'
+            except ValueError:
+                pass
+
+    def bounds(self, current_value, param_name, value_name, peak_value):
+        """
+        (min, max, vary) of the parameter, same as parse_constraint followed by evaluate_bound.
+
+        Args:
+            current_value (float): Current value of the parameter
+            param_name (str): Parameter name used by parse_constraint ("Position", "L/G", "fwhm_g", ...)
+            value_name (str): Parameter looked up on a referenced peak ('center', 'fwhm', ...)
+            peak_value (callable): peak_value(letter, value_name) -> value of the referenced peak, or None
+
+        Returns:
+            tuple: (min, max, vary)
+        """
+        if self.kind == 'range':
+            return self.low, self.high, True
+        if self.kind == 'value':
+            return self.value - 0.1, self.value + 0.1, True
+        if self.kind == 'default':
+            return current_value - 0.1, current_value + 0.1, True
+        if self.kind == 'fixed':
+            error = 0.5 if param_name in ["L/G", "fraction"] else 0.001
+            return current_value - error, current_value + error, False
+        low, high, vary = parse_constraint(self.text, current_value, param_name)
+        return (evaluate_bound(low, peak_value, value_name, current_value),
+                evaluate_bound(high, peak_value, value_name, current_value), vary)
+
+
+DEFAULT_CONSTRAINT = Constraint('')
+
+
+class ConstraintGraph:
+    """
+    The parsed constraint cells of all peaks of a core level and the links between them.
+
+    constraints[i][key] is the Constraint of peak i for a column key ('Position', 'FWHM', ...). A link of peak i
+    on key points to the same key of its reference peak; order lists the linked (peak, key) pairs so that every
+    reference comes before the peaks linked to it.
+    """
+
+    def __init__(self, constraints):
+        self.constraints = constraints
+        self.links = {(i, key): constraint for i, peak in enumerate(constraints)
+                      for key, constraint in peak.items()
+                      if constraint.kind == 'link' and constraint.reference < len(constraints)}
+        self.order = self._link_order()
+
+    def constraint(self, peak, key):
+        return self.constraints[peak].get(key, DEFAULT_CONSTRAINT)
+
+    def link(self, peak, key):
+        """The link of peak on key, None when the cell is not a reference to an existing peak."""
+        return self.links.get((peak, key))
+
+    def _link_order(self):
+        order, state = [], {}
+
+        def visit(node, path):
+            if state.get(node) == 'done':
+                return
+            if state.get(node) == 'visiting':
+                cycle = path[path.index(node):] + [node]
+                raise ConstraintCycleError("Circular constraint: " +
+                                           " -> ".join(f"{chr(65 + peak)} {key}" for peak, key in cycle))
+            state[node] = 'visiting'
+            link = self.links[node]
+            reference = (link.reference, node[1])
+            if reference in self.links:
+                visit(reference, path + [node])
+            state[node] = 'done'
+            order.append(node)
+
+        for node in self.links:
+            visit(node, [])
+        return order
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_graph(cells):
+    return ConstraintGraph([{key: Constraint(text) for key, text in peak} for peak in cells])
+
+
+def constraint_graph(peaks):
+    """
+    The ConstraintGraph of a list of peak dictionaries (window.Data[...]['Fitting']['Peaks'] values).
+
+    Compiled graphs are cached on the text of the constraint cells, so a graph is only compiled again after a
+    constraint cell changes.
+
+    Raises:
+        ConstraintCycleError: When linked peaks reference each other in a loop
+    """
+    cells = tuple(tuple((key, str(text)) for key, text in peak.get('Constraints', {}).items()) for peak in peaks)
+    return _compile_graph(cells)
@@ -51,6 +51,58 @@ def export_results(window):
 
     save_state(window)
 
+def export_sheet_results(window, sheet_name, library_data=None):
+    """
+    Update the window.Data results of a sheet from its fitted peaks, without going through the peak table.
+
+    Used for sheets that are not displayed (e.g. after fitting all core levels); the Results grid is
+    refreshed separately with populate_results_grid.
+
+    Args:
+        window: The main application window.
+        sheet_name (str): Core level to export
+        library_data (dict): RSF library, loaded when not given
+    """
+    if library_data is None:
+        library_data = load_library_data()
+    core_level_data = window.Data['Core levels'][sheet_name]
+    bg_data = core_level_data.get('Background', {})
+    results = window.Data['Results'].setdefault('Peak', {})
+
+    for i, (label, peak) in enumerate(core_level_data['Fitting']['Peaks'].items()):
+        constraints = peak.get('Constraints', {})
+        rsf = _peak_rsf(library_data, label, window.current_instrument)
+        peak_params = {
+            'name': label,
+            'position': peak.get('Position', 0.0),
+            'height': peak.get('Height', 0.0),
+            'fwhm': peak.get('FWHM', 0.0),
+            'lg_ratio': peak.get('L/G', 0.0),
+            'rsf': rsf,
+            'area': peak.get('Area', 0.0),
+            'sigma': peak.get('Sigma', 0.0),
+            'gamma': peak.get('Gamma', 0.0),
+            'skew': peak.get('Skew', 0.0),
+            'constraints': {
+                'position': constraints.get('Position', ''),
+                'height': constraints.get('Height', ''),
+                'fwhm': constraints.get('FWHM', ''),
+                'lg_ratio': constraints.get('L/G', ''),
+                'area': constraints.get('Area', ''),
+                'sigma': constraints.get('Sigma', ''),
+                'gamma': constraints.get('Gamma', ''),
+                'skew': constraints.get('Skew', '')
+            }
+        }
+        area, normalized_area, rel_area = _peak_areas(window, chr(65 + i), label, float(peak_params['area']), rsf,
+                                                      float(peak_params['position']))
+        peak_label = _update_data_structure(window, sheet_name, i, peak_params, area, rel_area,
+                                            peak.get('Fitting Model', ''))
+        # The background range of the sheet itself, not of the displayed one
+        results[peak_label]['Bkg Low'] = bg_data.get('Bkg Low')
+        results[peak_label]['Bkg High'] = bg_data.get('Bkg High')
+
+
 def _ensure_results_grid_columns(window):
     """Ensure that all necessary columns exist in the results grid."""
     if window.results_grid.GetNumberCols() < 11:
@@ -150,26 +202,7 @@ def _extract_peak_parameters_OLD(window, row, library_data, current_instrument):
 def _extract_peak_parameters(window, row, library_data, current_instrument):
     peak_name = window.peak_params_grid.GetCellValue(row, 1)  # Label
 
-    # Use regex to extract element, orbital, and suborbital
-    match = re.match(r'([A-Z][a-z]*)(\d+[spdf])(?:(\d+/\d+))?', peak_name)
-    if match:
-        element, orbital, suborbital = match.groups()
-        if suborbital:
-            # Use full orbital including suborbital for RSF lookup
-            core_level = f"{element}{orbital}{suborbital}"
-        else:
-            core_level = f"{element}{orbital}"
-    else:
-        core_level = ''.join(filter(str.isalnum, peak_name.split()[0]))
-        element, orbital, suborbital = core_level, '', None
-
-    # Get RSF directly using complete orbital designation
-    key = (element, orbital + (suborbital or ''))
-    if key in library_data and current_instrument in library_data[key]:
-        rsf = library_data[key][current_instrument]['rsf']
-    else:
-        # Fallback to Al if instrument not found
-        rsf = library_data[key]['Al']['rsf'] if key in library_data else 1.0
+    rsf = _peak_rsf(library_data, peak_name, current_instrument)
 
     return {
         'name': peak_name,
@@ -194,6 +227,25 @@ def _extract_peak_parameters(window, row, library_data, current_instrument):
         }
     }
 
+
+def _peak_rsf(library_data, peak_name, current_instrument):
+    """RSF of a peak from its label (e.g. 'C1s', 'Ti2p3/2'), 1.0 when the core level is not in the library."""
+    # Use regex to extract element, orbital, and suborbital
+    match = re.match(r'([A-Z][a-z]*)(\d+[spdf])(?:(\d+/\d+))?', peak_name)
+    if match:
+        element, orbital, suborbital = match.groups()
+    else:
+        core_level = ''.join(filter(str.isalnum, peak_name.split()[0])) if peak_name.split() else ''
+        element, orbital, suborbital = core_level, '', None
+
+    # Get RSF directly using complete orbital designation
+    key = (element, orbital + (suborbital or ''))
+    if key in library_data and current_instrument in library_data[key]:
+        return library_data[key][current_instrument]['rsf']
+    # Fallback to Al if instrument not found
+    return library_data[key]['Al']['rsf'] if key in library_data else 1.0
+
+
 def get_rsf_from_library_OLD(library_data, element, orbital, instrument):
     key = (element, orbital)
     if key in library_data and instrument in library_data[key]:
@@ -212,9 +264,12 @@ def get_rsf_from_library(library_data, element, orbital, instrument):
 def _calculate_peak_areas(window, peak_params, row):
     area = float(window.peak_params_grid.GetCellValue(row, 6))
     peak_name = window.peak_params_grid.GetCellValue(row, 0)
-    rsf = peak_params['rsf']
-
     binding_energy = float(window.peak_params_grid.GetCellValue(row, 2))
+    return _peak_areas(window, peak_name, peak_params['name'], area, peak_params['rsf'], binding_energy)
+
+
+def _peak_areas(window, peak_name, label, area, rsf, binding_energy):
+    """Area, normalized area and relative area of a peak, corrected for RSF, ECF and angle."""
     kinetic_energy = window.photons - binding_energy
 
     if window.library_type == "Scofield":
@@ -240,7 +295,7 @@ def _calculate_peak_areas(window, peak_params, row):
     # Angular correction
     angular_correction = 1.0
     if window.use_angular_correction:
-        orbital_type = peak_params['name'][-1].lower()  # Get orbital type from name
+        orbital_type = label[-1].lower()  # Get orbital type from name
         angular_correction = AtomicConcentrations.calculate_angular_correction(
             window,
             peak_name,
@@ -253,6 +308,44 @@ def _calculate_peak_areas(window, peak_params, row):
 
     return round(area, 2), round(normalized_area, 2), round(rel_area, 2)
 
+def quantification_divisor(window, peak_name, binding_energy, rsf):
+    """
+    Divisor turning a peak area into the normalized area summed for the atomic percentages.
+
+    Args:
+        window: The main application window (photon energy, library type, angular correction)
+        peak_name (str): Peak name of the Results grid
+        binding_energy (float): Peak position (eV)
+        rsf (float): Relative sensitivity factor
+
+    Returns:
+        float: RSF * TXFN * ECF * angular correction
+    """
+    kinetic_energy = window.photons - binding_energy
+
+    # Calculate ECF based on method selected
+    if window.library_type == "Scofield":
+        ecf = kinetic_energy ** 0.6
+    elif window.library_type == "Wagner":
+        ecf = kinetic_energy ** 1.0
+    elif window.library_type == "TPP-2M":
+        # Calculate IMFP using TPP-2M using the average matrix
+        imfp = AtomicConcentrations.calculate_imfp_tpp2m(kinetic_energy)
+
+        # 26.2 is a factor added by Avantage to match KE^0.6
+        ecf = imfp * 26.2
+    else:
+        ecf = 1.0  # Default no correction
+
+    txfn = 1.0  # Transmission function
+
+    angular_correction = 1.0
+    if window.use_angular_correction:
+        angular_correction = AtomicConcentrations.calculate_angular_correction(window, peak_name,
+                                                                               window.analysis_angle)
+    return rsf * txfn * ecf * angular_correction
+
+
 def _update_results_grid(window, row, peak_params, area, rel_area, fitting_model, peak_label):
     """Update a row in the results grid with peak data."""
     window.results_grid.SetCellValue(row, 0, f"{peak_params['name']}")  # Keep the original peak name
@@ -290,6 +383,9 @@ def _update_results_grid(window, row, peak_params, area, rel_area, fitting_model
     window.results_grid.SetCellValue(row, 18, f"{window.bg_max_energy:.2f}" if window.bg_max_energy is not None else "")
     window.results_grid.SetCellValue(row, 21, window.sheet_combobox.GetValue())
     _set_constraints(window, row, peak_params['constraints'])
+    # A new fit invalidates the confidence intervals
+    window.results_grid.SetCellValue(row, 29, "")
+    window.results_grid.SetCellValue(row, 30, "")
 
     # Force a refresh of the grid cell to ensure the checkbox is displayed correctly
     window.results_grid.RefreshAttr(row, 7)
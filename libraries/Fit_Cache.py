@@ -0,0 +1,202 @@
+# FIT CACHE ---------------------------------------------------------------
+# Content-addressed LRU store of fit results. A fit is identified by its data,
+# background, compiled parameters (starting values, bounds, constraints) and
+# optimizer settings, so the same request returns the stored result instead of
+# running the optimization again.
+# -------------------------------------------------------------------------
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Values of the lmfit result kept with the fitted parameters
+RESULT_VALUES = ['chisqr', 'redchi', 'aic', 'bic', 'nfev']
+
+
+def fit_cache_path(file_path):
+    """File the fit cache of a project is saved to, next to its .xlsx and .json files."""
+    return os.path.splitext(file_path)[0] + '.fits.json'
+
+
+class FitCache:
+    """
+    LRU cache of fit results keyed by a hash of everything a fit depends on.
+
+    Keys are built by make_key from the fitted arrays (x, y, background), the compiled parameters (names,
+    starting values, bounds, vary flags, constraint expressions, brute steps), the peak models and the
+    optimizer settings. An entry holds the fitted values and statistics, not the lmfit result, so a hit is
+    rebuilt with one model evaluation. It also holds the spectrum_key of the fitted sheet, so that a project
+    saves only the entries of its own sheets. Entries are evicted least-recently-used first once they exceed
+    max_bytes. The cache is shared with the fit worker thread, get and put are locked.
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.enabled = True
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(problem, method, max_nfev=None, jacobian_mode="Analytic", values=None):
+        """
+        Build the cache key of a fit request.
+
+        Args:
+            problem (FitProblem): Compiled problem
+            method (str): lmfit minimization method
+            max_nfev (int): Maximum number of function evaluations
+            jacobian_mode (str): Jacobian mode of the fit
+            values (array): Starting values in param_names order, default problem.values
+
+        Returns:
+            str: Hex digest identifying the request
+        """
+        values = problem.values if values is None else values
+        digest = hashlib.sha1()
+        for array in [problem.x, problem.y, problem.background, values, problem.mins, problem.maxs,
+                      problem.brute_steps, problem.skews]:
+            digest.update(np.ascontiguousarray(array, dtype=float).tobytes())
+            digest.update(b'|')
+        digest.update(np.ascontiguousarray(problem.vary, dtype=bool).tobytes())
+        settings = (tuple(problem.param_names), tuple(problem.exprs), tuple(problem.model_names),
+                    method, None if max_nfev is None else int(max_nfev), jacobian_mode)
+        digest.update(repr(settings).encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def spectrum_key(x, y):
+        """Hex digest of the whole spectrum of a sheet (B.E. and Raw Data)."""
+        digest = hashlib.sha1()
+        for array in [x, y]:
+            digest.update(np.ascontiguousarray(array, dtype=float).tobytes())
+            digest.update(b'|')
+        return digest.hexdigest()
+
+    @staticmethod
+    def _nbytes(entry):
+        # Approximate size of the entry dicts (key string, float and hash slot per value)
+        return 64 * (len(entry['Values']) + len(RESULT_VALUES))
+
+    def get(self, key):
+        """Return a copy of the cached entry ({'Values': {name: value}, 'chisqr', ...}), or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return {**entry, 'Values': dict(entry['Values'])}
+
+    def put(self, key, entry):
+        """Store an entry and evict the least recently used entries above the memory cap."""
+        entry = {**entry, 'Values': dict(entry['Values'])}
+        nbytes = self._nbytes(entry)
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._nbytes(self._entries.pop(key))
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= self._nbytes(evicted)
+                self.evictions += 1
+
+    def fit(self, fitter, method='leastsq', max_nfev=None, jacobian_mode="Analytic", params=None, iter_cb=None):
+        """
+        PeakFitter.fit through the cache.
+
+        On a hit the stored values are evaluated once and the result carries the stored statistics and
+        cached = True. On a miss the problem is fitted and stored, unless iter_cb aborted the fit.
+
+        Returns:
+            lmfit.model.ModelResult, or the result of PeakFitter.evaluate on a hit
+        """
+        if not self.enabled:
+            return fitter.fit(method=method, max_nfev=max_nfev, jacobian_mode=jacobian_mode, params=params,
+                              iter_cb=iter_cb)
+        problem = fitter.problem
+        values = None if params is None else [params[name].value for name in problem.param_names]
+        key = self.make_key(problem, method, max_nfev, jacobian_mode, values)
+        entry = self.get(key)
+        if entry is not None:
+            result = fitter.evaluate(problem.parameters(entry['Values']))
+            for name in RESULT_VALUES:
+                setattr(result, name, entry[name])
+            result.cached = True
+            return result
+
+        result = fitter.fit(method=method, max_nfev=max_nfev, jacobian_mode=jacobian_mode, params=params,
+                            iter_cb=iter_cb)
+        if not getattr(result, 'aborted', False):
+            self.put(key, self.entry(problem, result))
+        return result
+
+    @staticmethod
+    def entry(problem, result):
+        """
+        Cache entry of a fit result: the fitted values of the free parameters, the fit statistics and the
+        spectrum_key of the fitted sheet.
+        """
+        values = {name: float(result.params[name].value)
+                  for name, expr in zip(problem.param_names, problem.exprs) if expr is None}
+        entry = {'Values': values, 'nfev': int(result.nfev),
+                 'Spectrum': FitCache.spectrum_key(problem.x_all, problem.y_all)}
+        for name in ['chisqr', 'redchi', 'aic', 'bic']:
+            entry[name] = float(getattr(result, name, np.nan))
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def reset_counters(self):
+        self.hits = self.misses = self.evictions = 0
+
+    def save(self, path, spectra=None):
+        """
+        Write the entries (oldest first) to a JSON file.
+
+        Args:
+            path (str): JSON file
+            spectra (set): spectrum_key of the sheets whose entries are written, default every entry
+        """
+        with self._lock:
+            entries = [(key, entry) for key, entry in self._entries.items()
+                       if spectra is None or entry.get('Spectrum') in spectra]
+        with open(path, 'w') as json_file:
+            json.dump(entries, json_file)
+
+    def load(self, path):
+        """Add the entries of a file written by save, the most recently used last."""
+        with open(path, 'r') as json_file:
+            entries = json.load(json_file)
+        for key, entry in entries:
+            self.put(key, entry)
+
+    def stats(self):
+        """Counters shown in the cache statistics window."""
+        lookups = self.hits + self.misses
+        return {
+            'Entries': len(self._entries),
+            'Memory (MB)': self.current_bytes / 1024 ** 2,
+            'Memory cap (MB)': self.max_bytes / 1024 ** 2,
+            'Hits': self.hits,
+            'Misses': self.misses,
+            'Hit rate (%)': 100 * self.hits / lookups if lookups else 0.0,
+            'Evictions': self.evictions,
+        }
+
+
+# Shared by the Fit button, fit_peaks and the repeated fits of the Fitting window
+fit_cache = FitCache()
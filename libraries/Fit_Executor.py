@@ -0,0 +1,272 @@
+# FIT EXECUTOR --------------------------------------------------------------
+# Runs the fits of a core level in a worker thread on a snapshot of its peaks.
+# Progress (nfev, chi², best parameters) and the outcome are handed to callbacks
+# through a post function (wx.CallAfter in the GUI); nothing is written to
+# window.Data by the worker.
+# -------------------------------------------------------------------------
+import copy
+import threading
+import time
+
+import numpy as np
+
+from libraries.Fit_Cache import fit_cache
+from libraries.Fit_Problem import compile_fit_problem, PeakFitter, peak_results
+
+# Stop tolerances offered for repeated fits, "Off" runs the fixed number of fits
+FIT_TOLERANCES = ["Off", "1e-2", "1e-3", "1e-4", "1e-5", "1e-6"]
+
+
+class FitProgress:
+    """Snapshot of a running fit passed to the progress callback."""
+
+    def __init__(self, fit_index, num_fits, nfev, chisqr, best_chisqr, best_values, redchi, elapsed):
+        self.fit_index = fit_index      # 1-based index of the current fit of the run
+        self.num_fits = num_fits
+        self.nfev = nfev                # function evaluations of the current fit
+        self.chisqr = chisqr            # chi² of the last evaluation
+        self.best_chisqr = best_chisqr  # lowest chi² of the current fit
+        self.best_values = best_values  # {parameter: value} at best_chisqr
+        self.redchi = redchi            # reduced chi² at best_chisqr
+        self.elapsed = elapsed          # seconds since the start of the run
+
+
+class FitOutcome:
+    """
+    Result of a run passed to the done callback.
+
+    status is 'completed', 'converged' (stopped early by the tolerance), 'budget' (stopped by the time budget,
+    result holds the best parameters reached), 'cancelled' (result is None) or 'error' (error holds the message).
+    time_saved estimates the time the fits skipped after convergence would have taken. cached is True when
+    every fit of the run was returned by the fit cache.
+    """
+
+    def __init__(self, status, problem=None, result=None, fits_done=0, elapsed=0.0, error=None, time_saved=0.0,
+                 cached=False):
+        self.status = status
+        self.problem = problem
+        self.result = result
+        self.fits_done = fits_done
+        self.elapsed = elapsed
+        self.error = error
+        self.time_saved = time_saved
+        self.cached = cached
+
+
+def snapshot_core_level(data, sheet_name):
+    """
+    Copy of the parts of window.Data a fit reads, safe to use from another thread.
+
+    The spectrum and background arrays are shared, the peaks (which the fits update between iterations) are copied.
+    """
+    core_level_data = data['Core levels'][sheet_name]
+    fitting = core_level_data.get('Fitting', {})
+    snapshot = dict(core_level_data)
+    snapshot['Background'] = dict(core_level_data['Background'])
+    snapshot['Fitting'] = {**fitting, 'Peaks': copy.deepcopy(fitting.get('Peaks', {}))}
+    return {'Core levels': {sheet_name: snapshot}}
+
+
+def problem_matches(data, problem):
+    """True when the sheet of the problem still has the same peaks (labels and models), in the same order."""
+    peaks = data['Core levels'].get(problem.sheet_name, {}).get('Fitting', {}).get('Peaks', {})
+    return (list(peaks) == problem.labels and
+            [peak.get('Fitting Model') for peak in peaks.values()] == problem.model_names)
+
+
+def fit_change(previous, result, names):
+    """
+    Largest relative change between two fits, of chi² or of one of the parameters names.
+
+    Args:
+        previous, result: Fit results with chisqr and params
+        names (list): Names of the varying parameters
+
+    Returns:
+        float
+    """
+    changes = [abs(result.chisqr - previous.chisqr) / max(abs(previous.chisqr), np.finfo(float).tiny)]
+    for name in names:
+        old, new = previous.params[name].value, result.params[name].value
+        changes.append(abs(new - old) / max(abs(old), np.finfo(float).eps))
+    return max(changes)
+
+
+class FitExecutor:
+    """
+    Fit a core level one or several times in a worker thread.
+
+    Without a tolerance, every fit starts from the rounded results of the previous one, like fitting several
+    times in a row from the peak table. With a tolerance, the problem is compiled once, every fit starts from
+    the parameters of the previous one and the run stops once the relative changes of chi² and of every
+    varying parameter between two fits are below the tolerance (at most iterations fits).
+    The run can be cancelled, and stops at the end of a wall-clock budget with the best parameters reached so
+    far. Callbacks are called through post (e.g. wx.CallAfter), on_progress at most every progress_interval
+    seconds and on_done once.
+    Fits go through the fit cache: a fit already done from the same data, parameters and settings is returned
+    without running the optimizer, and the result of a finished run is also stored for a refit from its own
+    rounded results, so fitting again without changes is immediate.
+    """
+
+    def __init__(self, data, sheet_name, iterations=1, method='leastsq', max_nfev=None, jacobian_mode="Analytic",
+                 time_budget=None, post=None, on_progress=None, on_done=None, progress_interval=0.1,
+                 tolerance=None):
+        self.data = snapshot_core_level(data, sheet_name)
+        self.sheet_name = sheet_name
+        self.iterations = max(1, int(iterations))
+        self.method = method
+        self.max_nfev = max_nfev
+        self.jacobian_mode = jacobian_mode
+        self.time_budget = time_budget if time_budget else None
+        self.post = post or (lambda func, *args: func(*args))
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.progress_interval = progress_interval
+        self.tolerance = tolerance if tolerance else None
+
+        self._cancel = threading.Event()
+        self._thread = None
+        self._start_time = None
+        self._last_post = 0.0
+        self._budget_reached = False
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._start_time = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name=f"fit {self.sheet_name}", daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        """Stop at the next function evaluation, the outcome is 'cancelled'."""
+        self._cancel.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _elapsed(self):
+        return time.perf_counter() - self._start_time
+
+    def _run(self):
+        if self.tolerance is not None:
+            self._run_until_converged()
+            return
+        problem, result, fits_done, cached = None, None, 0, True
+        try:
+            for fit_index in range(1, self.iterations + 1):
+                problem = compile_fit_problem(self.data, self.sheet_name)
+                if problem is None:
+                    raise ValueError("Sheets with Unfitted or D-parameter peaks are not fitted")
+                result = self._fit_once(problem, fit_index)
+                if self._cancel.is_set():
+                    self.post(self._done, FitOutcome('cancelled', problem, None, fits_done, self._elapsed()))
+                    return
+                fits_done += 1
+                cached = cached and getattr(result, 'cached', False)
+                if self._budget_reached:
+                    break
+                # The next fit starts from the rounded results, as from the peak table
+                self._store_peaks(problem, result)
+            if not self._budget_reached:
+                self._remember_refit(problem, result)
+        except Exception as e:
+            self.post(self._done, FitOutcome('error', problem, None, fits_done, self._elapsed(), str(e)))
+            return
+        status = 'budget' if self._budget_reached else 'completed'
+        self.post(self._done, FitOutcome(status, problem, result, fits_done, self._elapsed(), cached=cached))
+
+    def _run_until_converged(self):
+        """Refit one compiled problem from its own results until chi² and the parameters stop changing."""
+        problem, result, fits_done, converged, cached = None, None, 0, False, True
+        try:
+            problem = compile_fit_problem(self.data, self.sheet_name)
+            if problem is None:
+                raise ValueError("Sheets with Unfitted or D-parameter peaks are not fitted")
+            fitter = PeakFitter(problem)
+            free = [name for name, vary, expr in zip(problem.param_names, problem.vary, problem.exprs)
+                    if vary and expr is None]
+            params = problem.parameters()
+            for fit_index in range(1, self.iterations + 1):
+                previous = result
+                result = self._fit_once(problem, fit_index, fitter, params)
+                if self._cancel.is_set():
+                    self.post(self._done, FitOutcome('cancelled', problem, None, fits_done, self._elapsed()))
+                    return
+                fits_done += 1
+                cached = cached and getattr(result, 'cached', False)
+                if self._budget_reached:
+                    break
+                if previous is not None and fit_change(previous, result, free) < self.tolerance:
+                    converged = True
+                    break
+                params = result.params
+            if not self._budget_reached:
+                self._store_peaks(problem, result)
+                self._remember_refit(problem, result)
+        except Exception as e:
+            self.post(self._done, FitOutcome('error', problem, None, fits_done, self._elapsed(), str(e)))
+            return
+        elapsed = self._elapsed()
+        status = 'budget' if self._budget_reached else 'converged' if converged else 'completed'
+        time_saved = (self.iterations - fits_done) * elapsed / fits_done if converged else 0.0
+        self.post(self._done, FitOutcome(status, problem, result, fits_done, elapsed, time_saved=time_saved,
+                                         cached=cached))
+
+    def _store_peaks(self, problem, result):
+        """Write the rounded results to the peaks of the snapshot, as they are written to the peak table."""
+        peaks = self.data['Core levels'][self.sheet_name]['Fitting']['Peaks']
+        for label, peak in zip(problem.labels, peak_results(problem, result.params)):
+            peak.pop('y_values', None)
+            peaks[label].update(peak)
+
+    def _remember_refit(self, problem, result):
+        """Store the result of the run for a fit started from its rounded results (the next Fit click)."""
+        refit = compile_fit_problem(self.data, self.sheet_name)
+        if refit is not None and fit_cache.enabled:
+            fit_cache.put(fit_cache.make_key(refit, self.method, self.max_nfev, self.jacobian_mode),
+                          fit_cache.entry(problem, result))
+
+    def _fit_once(self, problem, fit_index, fitter=None, params=None):
+        """One fit with an iteration callback that reports progress and aborts on cancel or at the budget."""
+        fitter = fitter or PeakFitter(problem)
+        best = {'chisqr': np.inf, 'values': None, 'stopped': False}
+        nvarys = sum(1 for vary, expr in zip(problem.vary, problem.exprs) if vary and expr is None)
+        dof = max(len(problem.x) - nvarys, 1)
+
+        def iteration(params, nfev, residual, *args, **kws):
+            chisqr = float(np.sum(np.square(residual)))
+            if chisqr < best['chisqr']:
+                best['chisqr'] = chisqr
+                best['values'] = {name: par.value for name, par in params.items()}
+            now = time.perf_counter()
+            if (self.on_progress is not None and best['values'] is not None and
+                    now - self._last_post >= self.progress_interval):
+                self._last_post = now
+                self.post(self._progress, FitProgress(fit_index, self.iterations, nfev, chisqr, best['chisqr'],
+                                                      dict(best['values']), best['chisqr'] / dof, self._elapsed()))
+            if self.time_budget is not None and self._elapsed() > self.time_budget:
+                self._budget_reached = True
+            # Ask once: lmfit evaluates the residual again after an abort and must not be stopped there
+            stop = (self._cancel.is_set() or self._budget_reached) and not best['stopped']
+            best['stopped'] |= stop
+            return stop
+
+        result = fit_cache.fit(fitter, method=self.method, max_nfev=self.max_nfev, jacobian_mode=self.jacobian_mode,
+                               params=params, iter_cb=iteration)
+        if getattr(result, 'aborted', False) and best['values'] is not None and not self._cancel.is_set():
+            # Stopped by the budget: keep the best parameters evaluated so far
+            nfev = result.nfev
+            result = fitter.evaluate(problem.parameters(best['values']))
+            result.nfev = nfev
+        return result
+
+    def _progress(self, progress):
+        if not self._cancel.is_set() and self.on_progress is not None:
+            self.on_progress(progress)
+
+    def _done(self, outcome):
+        if self.on_done is not None:
+            self.on_done(outcome)
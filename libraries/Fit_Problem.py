@@ -0,0 +1,807 @@
+# FIT PROBLEM ---------------------------------------------------------------
+# Compiles the peaks of a core level (window.Data['Core levels'][sheet]['Fitting']
+# ['Peaks']) into typed arrays once, and fits them without the wx grid. fit_peaks
+# compiles, fits and writes the converted results back to the grid and the data.
+# -------------------------------------------------------------------------
+import copy
+import functools
+import re
+
+import lmfit
+import numpy as np
+
+from libraries.Constraint_Graph import constraint_graph
+from libraries.Peak_Functions import PeakFunctions
+from libraries.Peak_Evaluator import BroadcastPeakModel
+from libraries.Peak_Jacobians import (CompositeJacobian, check_jacobian, expression_variables, has_analytic_derivatives,
+                                      LOCAL_SHAPES)
+from libraries.Voigt_Conversions import voigt_area_to_height, voigt_fwhm, pseudo_voigt_area_to_height, pseudo_voigt_fwhm
+
+# Peak models that can be fitted, the model code of a peak is its index in this list
+PEAK_MODELS = [
+    "GL (Height)",
+    "SGL (Height)",
+    "GL (Area)",
+    "SGL (Area)",
+    "Voigt (Area, L/G, σ)",
+    "Voigt (Area, L/G, σ, skew)",
+    "Voigt (Area, σ, γ)",
+    "ExpGauss.(Area, σ, γ)",
+    "Pseudo-Voigt (Area)",
+    "LA (Area, σ, γ)",
+    "LA (Area, σ/γ, γ)",
+    "LA*G (Area, σ/γ, γ)",
+]
+MODEL_CODES = {name: code for code, name in enumerate(PEAK_MODELS)}
+
+# A sheet containing one of these peaks is not fitted
+SKIPPED_MODELS = ["Unfitted", "D-parameter"]
+
+# Models whose Sigma and Gamma columns are shown in the peak table (Skew / fwhm_g as well for LA*G)
+SIGMA_GAMMA_MODELS = ["Voigt (Area, L/G, σ)", "Voigt (Area, σ, γ)", "ExpGauss.(Area, σ, γ)",
+                      "LA (Area, σ, γ)", "LA (Area, σ/γ, γ)", "LA*G (Area, σ/γ, γ)"]
+
+# Peak letter references (A+1.5) look up these keys of the referenced peak
+PEAK_VALUE_KEYS = {'center': 'Position', 'height': 'Height', 'fwhm': 'FWHM', 'lg_ratio': 'L/G', 'area': 'Area',
+                   'sigma': 'Sigma', 'gamma': 'Gamma', 'fwhm_g': 'Skew'}
+
+# Table columns that are a model parameter, {model: {column: (parameter, scale)}} with column value = scale·parameter.
+# Links between peaks on these columns become constraint expressions, other links stay min/max bands.
+TABLE_PARAMETERS = {
+    "GL (Height)": {'Position': ('center', 1), 'Height': ('amplitude', 1), 'FWHM': ('fwhm', 1),
+                    'L/G': ('fraction', 1)},
+    "SGL (Height)": {'Position': ('center', 1), 'Height': ('amplitude', 1), 'FWHM': ('fwhm', 1),
+                     'L/G': ('fraction', 1)},
+    "GL (Area)": {'Position': ('center', 1), 'Area': ('area', 1), 'FWHM': ('fwhm', 1), 'L/G': ('fraction', 1)},
+    "SGL (Area)": {'Position': ('center', 1), 'Area': ('area', 1), 'FWHM': ('fwhm', 1), 'L/G': ('fraction', 1)},
+    "Voigt (Area, L/G, σ)": {'Position': ('center', 1), 'Area': ('area', 1), 'Sigma': ('sigma', 2.355)},
+    "Voigt (Area, L/G, σ, skew)": {'Position': ('center', 1), 'Area': ('area', 1), 'Sigma': ('sigma', 2.355),
+                                   'Skew': ('skew', 1)},
+    "Voigt (Area, σ, γ)": {'Position': ('center', 1), 'Area': ('area', 1), 'Sigma': ('sigma', 2.355),
+                           'Gamma': ('gamma', 2)},
+    "ExpGauss.(Area, σ, γ)": {'Position': ('center', 1), 'Area': ('amplitude', 1), 'Sigma': ('sigma', 1),
+                              'Gamma': ('gamma', 1)},
+    "Pseudo-Voigt (Area)": {'Position': ('center', 1), 'Area': ('area', 1), 'FWHM': ('sigma', 2),
+                            'L/G': ('fraction', 100)},
+    "LA (Area, σ, γ)": {'Position': ('center', 1), 'Area': ('amplitude', 1), 'FWHM': ('fwhm', 1),
+                        'Sigma': ('sigma', 1), 'Gamma': ('gamma', 1)},
+    "LA (Area, σ/γ, γ)": {'Position': ('center', 1), 'Area': ('amplitude', 1), 'FWHM': ('fwhm', 1),
+                          'L/G': ('fraction', 1), 'Gamma': ('gamma', 1)},
+    "LA*G (Area, σ/γ, γ)": {'Position': ('center', 1), 'Area': ('amplitude', 1), 'FWHM': ('fwhm', 1),
+                            'L/G': ('fraction', 1), 'Gamma': ('gamma', 1), 'Skew': ('fwhm_g', 1)},
+}
+
+_MODEL_FACTORIES = {
+    "GL (Height)": lambda prefix: lmfit.Model(PeakFunctions.gauss_lorentz, prefix=prefix),
+    "SGL (Height)": lambda prefix: lmfit.Model(PeakFunctions.S_gauss_lorentz, prefix=prefix),
+    "GL (Area)": lambda prefix: lmfit.Model(PeakFunctions.gauss_lorentz_Area, prefix=prefix),
+    "SGL (Area)": lambda prefix: lmfit.Model(PeakFunctions.S_gauss_lorentz_Area, prefix=prefix),
+    "Voigt (Area, L/G, σ)": lambda prefix: lmfit.models.VoigtModel(prefix=prefix),
+    "Voigt (Area, L/G, σ, skew)": lambda prefix: lmfit.models.SkewedVoigtModel(prefix=prefix),
+    "Voigt (Area, σ, γ)": lambda prefix: lmfit.models.VoigtModel(prefix=prefix),
+    "ExpGauss.(Area, σ, γ)": lambda prefix: lmfit.models.ExponentialGaussianModel(prefix=prefix),
+    "Pseudo-Voigt (Area)": lambda prefix: lmfit.models.PseudoVoigtModel(prefix=prefix),
+    "LA (Area, σ, γ)": lambda prefix: lmfit.Model(PeakFunctions.LA, prefix=prefix),
+    "LA (Area, σ/γ, γ)": lambda prefix: lmfit.Model(PeakFunctions.LA, prefix=prefix),
+    "LA*G (Area, σ/γ, γ)": lambda prefix: lmfit.Model(PeakFunctions.LAxG, prefix=prefix),
+}
+
+
+def _number(value, default=None):
+    """float(value), or default when the value is missing or not a number (e.g. an empty cell)."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        if default is None:
+            raise
+        return default
+
+
+# FIT PROBLEM --------------------------------------------------------------
+
+class FitProblem:
+    """
+    A core level fit as plain arrays, independent of wx and cheap to copy or pickle.
+
+    Peaks (index i, prefix peak{i}_):
+        labels, model_names, model_codes (index in PEAK_MODELS), prefixes, skews (Skew / fwhm_g column)
+    lmfit parameters (in the order they are added):
+        param_names, values, mins, maxs, vary, exprs (None for free parameters), brute_steps (nan for none),
+        param_peaks (index of the peak a parameter belongs to)
+    Data:
+        x_all, y_all (whole spectrum), mask (background range), x, y, background and y_subtracted in the range
+    """
+
+    def __init__(self, sheet_name, x_all, y_all, mask, background, labels, model_names, skews, specs):
+        self.sheet_name = sheet_name
+        self.x_all = x_all
+        self.y_all = y_all
+        self.mask = mask
+        self.x = x_all[mask]
+        self.y = y_all[mask]
+        self.background = background
+        self.y_subtracted = self.y - background
+
+        self.labels = list(labels)
+        self.model_names = list(model_names)
+        self.model_codes = np.array([MODEL_CODES[name] for name in model_names], dtype=int)
+        self.prefixes = [f'peak{i}_' for i in range(len(labels))]
+        self.skews = np.array(skews, dtype=float)
+
+        self.param_names = [spec[1] for spec in specs]
+        self.param_peaks = np.array([spec[0] for spec in specs], dtype=int)
+        self.values = np.array([np.nan if spec[2] is None else spec[2] for spec in specs], dtype=float)
+        self.mins = np.array([-np.inf if spec[3] is None else spec[3] for spec in specs], dtype=float)
+        self.maxs = np.array([np.inf if spec[4] is None else spec[4] for spec in specs], dtype=float)
+        self.vary = np.array([bool(spec[5]) for spec in specs], dtype=bool)
+        self.exprs = [spec[6] for spec in specs]
+        self.brute_steps = np.array([np.nan if spec[7] is None else spec[7] for spec in specs], dtype=float)
+
+    @property
+    def num_peaks(self):
+        return len(self.labels)
+
+    def with_spectrum(self, sheet_name, x_all, y_all, mask, background):
+        """
+        The same peaks, parameters and constraints fitted to another spectrum (e.g. the next sheet of a series).
+
+        The parameter arrays are shared with this problem, the data arrays are replaced.
+        """
+        problem = copy.copy(self)
+        problem.sheet_name = sheet_name
+        problem.x_all = x_all
+        problem.y_all = y_all
+        problem.mask = mask
+        problem.x = x_all[mask]
+        problem.y = y_all[mask]
+        problem.background = background
+        problem.y_subtracted = problem.y - background
+        return problem
+
+    def parameters(self, values=None):
+        """
+        Fresh lmfit.Parameters of the problem.
+
+        Args:
+            values (array or dict): Optional starting values replacing self.values, as an array in
+                param_names order or as {name: value}
+
+        Returns:
+            lmfit.Parameters
+        """
+        if values is None:
+            values = self.values
+        elif isinstance(values, dict):
+            values = [values.get(name, value) for name, value in zip(self.param_names, self.values)]
+        params = lmfit.Parameters()
+        for name, value, low, high, vary, expr, step in zip(self.param_names, values, self.mins, self.maxs,
+                                                            self.vary, self.exprs, self.brute_steps):
+            if expr is not None:
+                params.add(name, expr=expr)
+            else:
+                params.add(name, value=value, min=low, max=high, vary=bool(vary),
+                           brute_step=None if np.isnan(step) else step)
+        return params
+
+
+def _peak_parameters(index, peak, peaks, graph):
+    """
+    Parameter specs of one peak, (peak index, name, value, min, max, vary, expr, brute_step) tuples.
+
+    Values and constraints are read from the peak dictionary the way the peak table shows them
+    (Sigma as 2.355·sigma and Gamma as 2·gamma for the Voigt models), bounds from the ConstraintGraph.
+    """
+    model_name = peak.get('Fitting Model')
+    prefix = f'peak{index}_'
+    letters = {chr(65 + i): peak_data for i, peak_data in enumerate(peaks)}
+
+    def peak_value(letter, param_name):
+        key = PEAK_VALUE_KEYS.get(param_name)
+        if letter not in letters or key is None:
+            return None
+        try:
+            return float(letters[letter].get(key))
+        except (TypeError, ValueError):
+            return None
+
+    def bounds(key, value, parse_name, value_name):
+        return graph.constraint(index, key).bounds(value, parse_name, value_name, peak_value)
+
+    specs = []
+
+    def add(name, value=None, min=None, max=None, vary=True, expr=None, brute_step=None):
+        specs.append((index, prefix + name, value, min, max, vary, expr, brute_step))
+
+    center = _number(peak.get('Position'))
+    height = _number(peak.get('Height'))
+    fwhm = _number(peak.get('FWHM'))
+    lg_ratio = _number(peak.get('L/G'))
+    area = _number(peak.get('Area'), 0)
+
+    center_min, center_max, center_vary = bounds('Position', center, "Position", 'center')
+    height_min, height_max, height_vary = bounds('Height', height, "Height", 'height')
+    fwhm_min, fwhm_max, fwhm_vary = bounds('FWHM', fwhm, "FWHM", 'fwhm')
+    lg_ratio_min, lg_ratio_max, lg_ratio_vary = bounds('L/G', lg_ratio, "L/G", 'lg_ratio')
+    area_min, area_max, area_vary = bounds('Area', area, "area", 'area')
+    if area_min == area_max:
+        area_max += 1e-6
+
+    def calc_gamma(f, s):
+        return (f * 2.355 * s) / (200 - 2 * f)
+
+    if model_name in ["Voigt (Area, L/G, σ)", "Voigt (Area, L/G, σ, skew)"]:
+        try:
+            sigma = _number(peak.get('Sigma')) / 2.355
+            fraction = lg_ratio
+            skew = _number(peak.get('Skew')) if model_name == "Voigt (Area, L/G, σ, skew)" else 0.0
+        except (TypeError, ValueError):
+            sigma = fwhm / (2 * np.sqrt(2 * np.log(2)))
+            fraction = lg_ratio
+            skew = 0.0
+
+        sigma_min, sigma_max, sigma_vary = bounds('Sigma', sigma, "Sigma", 'sigma')
+        fraction_min, fraction_max, fraction_vary = bounds('L/G', fraction, "lg_ratio", 'lg_ratio')
+
+        GAMMA_TOLERANCE = 1e-6  # Small tolerance value
+        gamma = calc_gamma(fraction, sigma)
+        gamma_min = calc_gamma(fraction_min, sigma)
+        gamma_max = calc_gamma(fraction_max, sigma)
+        # Ensure gamma_min and gamma_max are different and gamma is within the range
+        if abs(gamma_max - gamma_min) < GAMMA_TOLERANCE:
+            gamma_min = max(0, gamma - GAMMA_TOLERANCE)
+            gamma_max = gamma + GAMMA_TOLERANCE
+        gamma = max(gamma_min, min(gamma, gamma_max))
+
+        add('area', area, area_min, area_max, area_vary, brute_step=area * 0.01)
+        add('center', center, center_min, center_max, center_vary, brute_step=0.1)
+        add('sigma', sigma, sigma_min / 2.355, sigma_max / 2.355, sigma_vary, brute_step=sigma * 0.01)
+        add('gamma', gamma, gamma_min, gamma_max, fraction_vary, brute_step=gamma * 0.01)
+        if model_name == "Voigt (Area, L/G, σ, skew)":
+            skew_min, skew_max, skew_vary = bounds('Skew', skew, "Skew", 'skew')
+            add('skew', skew, skew_min, skew_max, skew_vary, brute_step=skew * 0.01)
+        add('amplitude', expr=f'{prefix}area')
+
+    elif model_name == "Voigt (Area, σ, γ)":
+        try:
+            sigma = _number(peak.get('Sigma')) / 2.355
+            gamma = _number(peak.get('Gamma')) / 2
+        except (TypeError, ValueError):
+            sigma = fwhm / (2 * np.sqrt(2 * np.log(2)))
+            gamma = lg_ratio / 100 * sigma
+
+        sigma_min, sigma_max, sigma_vary = bounds('Sigma', sigma, "Sigma", 'sigma')
+        gamma_min, gamma_max, gamma_vary = bounds('Gamma', gamma, "Gamma", 'gamma')
+
+        add('area', area, area_min, area_max, area_vary, brute_step=area * 0.01)
+        add('center', center, center_min, center_max, center_vary, brute_step=0.1)
+        add('sigma', sigma, sigma_min / 2.355, sigma_max / 2.355, sigma_vary, brute_step=sigma * 0.01)
+        add('gamma', gamma, gamma_min / 2, gamma_max / 2, gamma_vary, brute_step=gamma * 0.01)
+        add('amplitude', expr=f'{prefix}area')
+
+    elif model_name == "ExpGauss.(Area, σ, γ)":
+        try:
+            sigma = _number(peak.get('Sigma'))
+            gamma = _number(peak.get('Gamma'))
+        except (TypeError, ValueError):
+            sigma = fwhm / (2 * np.sqrt(2 * np.log(2)))
+            gamma = lg_ratio / 100 * sigma
+
+        sigma_min, sigma_max, sigma_vary = bounds('Sigma', sigma, "Sigma", 'sigma')
+        gamma_min, gamma_max, gamma_vary = bounds('Gamma', gamma, "Gamma", 'gamma')
+
+        add('amplitude', area, area_min, area_max, area_vary, brute_step=area * 0.01)
+        add('center', center, center_min, center_max, center_vary, brute_step=0.1)
+        add('sigma', sigma, sigma_min, sigma_max, sigma_vary, brute_step=sigma * 0.01)
+        add('gamma', gamma, gamma_min, gamma_max, gamma_vary, brute_step=gamma * 0.01)
+
+    elif model_name == "Pseudo-Voigt (Area)":
+        sigma = fwhm / 2.
+        add('center', center, center_min, center_max, center_vary, brute_step=0.1)
+        add('area', area, area_min, area_max, area_vary, brute_step=area * 0.01)
+        add('sigma', sigma, fwhm_min / 2. if fwhm_min else None, fwhm_max / 2. if fwhm_max else None, fwhm_vary,
+            brute_step=sigma * 0.01)
+        add('fraction', lg_ratio / 100, lg_ratio_min / 100, lg_ratio_max / 100, lg_ratio_vary, brute_step=0.01)
+        add('amplitude', expr=f'{prefix}area')
+
+    elif model_name == "LA (Area, σ, γ)":
+        sigma = _number(peak.get('Sigma'))
+        gamma = _number(peak.get('Gamma'))
+        sigma_min, sigma_max, sigma_vary = bounds('Sigma', sigma, "Sigma", 'sigma')
+        gamma_min, gamma_max, gamma_vary = bounds('Gamma', gamma, "Gamma", 'gamma')
+
+        add('amplitude', _number(peak.get('Area')), area_min, area_max, area_vary)
+        add('center', center, center_min, center_max, center_vary)
+        add('fwhm', fwhm, fwhm_min, fwhm_max, fwhm_vary)
+        add('gamma', gamma, gamma_min, gamma_max, gamma_vary)
+        add('sigma', sigma, sigma_min, sigma_max, sigma_vary)
+
+    elif model_name in ["LA (Area, σ/γ, γ)", "LA*G (Area, σ/γ, γ)"]:
+        gamma = _number(peak.get('Gamma'))
+        gamma_min, gamma_max, gamma_vary = bounds('Gamma', gamma, "Gamma", 'gamma')
+
+        add('amplitude', _number(peak.get('Area')), area_min, area_max, area_vary)
+        add('center', center, center_min, center_max, center_vary)
+        add('fwhm', fwhm, fwhm_min, fwhm_max, fwhm_vary)
+        add('gamma', gamma, gamma_min, gamma_max, gamma_vary)
+        add('fraction', lg_ratio, lg_ratio_min, lg_ratio_max, lg_ratio_vary)
+        if model_name == "LA*G (Area, σ/γ, γ)":
+            fwhm_g = _number(peak.get('Skew'))
+            fwhm_g_min, fwhm_g_max, fwhm_g_vary = bounds('Skew', fwhm_g, "fwhm_g", 'fwhm_g')
+            add('fwhm_g', fwhm_g, fwhm_g_min, fwhm_g_max, True)
+        # sigma from the L/G ratio and gamma
+        add('sigma', expr=f'({prefix}fraction / 100) * {prefix}gamma / (1 -{prefix}fraction / 100)')
+
+    elif model_name in ["GL (Area)", "SGL (Area)"]:
+        add('area', area, area_min, area_max, area_vary)
+        add('center', center, center_min, center_max, center_vary)
+        add('fwhm', fwhm, fwhm_min, fwhm_max, fwhm_vary)
+        add('fraction', lg_ratio, lg_ratio_min, lg_ratio_max, lg_ratio_vary)
+
+    elif model_name in ["GL (Height)", "SGL (Height)"]:
+        add('amplitude', height, height_min, height_max, height_vary)
+        add('center', center, center_min, center_max, center_vary)
+        add('fwhm', fwhm, fwhm_min, fwhm_max, fwhm_vary)
+        add('fraction', lg_ratio, lg_ratio_min, lg_ratio_max, lg_ratio_vary)
+
+    else:
+        raise ValueError(f"Unknown fitting model: {model_name} for peak {index}")
+
+    return _link_parameters(index, peak, peaks, graph, specs)
+
+
+def _scaled(name, scale):
+    return name if scale == 1 else f'{scale!r} * {name}'
+
+
+def _link_parameters(index, peak, peaks, graph, specs):
+    """
+    Replace the bands of linked columns by constraint expressions on the referenced peak.
+
+    A+1.5 or A*0.5 make the parameter an expression of the same column of peak A. With a tolerance
+    (A+1.5#0.2) the offset (or ratio) becomes its own parameter bounded to 1.3..1.7, started from the current
+    values of both peaks. Links to columns that are not a parameter of both models keep their bands.
+    """
+    columns = TABLE_PARAMETERS[peak.get('Fitting Model')]
+    positions = {spec[1]: i for i, spec in enumerate(specs)}
+    for key, (suffix, scale) in columns.items():
+        link = graph.link(index, key)
+        if link is None:
+            continue
+        reference = peaks[link.reference]
+        if key not in TABLE_PARAMETERS.get(reference.get('Fitting Model'), {}):
+            continue
+        ref_suffix, ref_scale = TABLE_PARAMETERS[reference.get('Fitting Model')][key]
+        ref_name = _scaled(f'peak{link.reference}_{ref_suffix}', ref_scale)
+        name = f'peak{index}_{suffix}'
+        if name not in positions or specs[positions[name]][6] is not None:
+            continue
+
+        if link.tolerance is None:
+            offset = repr(link.value)
+        else:
+            offset = f'{name}_link'
+            low, high = link.value - link.tolerance, link.value + link.tolerance
+            current, ref_value = _number(peak.get(key), np.nan), _number(reference.get(key), np.nan)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                start = {'+': current - ref_value, '-': ref_value - current,
+                         '*': current / ref_value, '/': ref_value / current}[link.operator]
+            start = link.value if not np.isfinite(start) else min(max(start, low), high)
+            specs.append((index, offset, start, low, high, True, None, None))
+        expr = f'({ref_name} {link.operator} {offset})'
+        if scale != 1:
+            expr = f'{expr} / {scale!r}'
+        specs[positions[name]] = specs[positions[name]][:6] + (expr, None)
+    return specs
+
+
+def _dependency_order(specs):
+    """Free parameters first, then the expressions, each after the parameters it uses (lmfit needs that order)."""
+    expressions = {spec[1]: spec for spec in specs if spec[6] is not None}
+    ordered = [spec for spec in specs if spec[6] is None]
+    done = set()
+
+    def visit(name):
+        if name in done:
+            return
+        done.add(name)
+        for token in re.findall(r'[A-Za-z_][A-Za-z0-9_]*', expressions[name][6]):
+            if token in expressions:
+                visit(token)
+        ordered.append(expressions[name])
+
+    for name in expressions:
+        visit(name)
+    return ordered
+
+
+def compile_fit_problem(data, sheet_name):
+    """
+    Compile the peaks and the background range of a core level into a FitProblem.
+
+    Args:
+        data (dict): window.Data
+        sheet_name (str): Core level to fit
+
+    Returns:
+        FitProblem: The problem, or None when a peak is Unfitted or a D-parameter (such sheets are not fitted)
+
+    Raises:
+        ValueError: On an invalid background range, an empty range or an unknown peak model
+        ConstraintCycleError: When linked peaks reference each other in a loop
+    """
+    core_level_data = data['Core levels'][sheet_name]
+    peaks = list(core_level_data.get('Fitting', {}).get('Peaks', {}).items())
+
+    if any(peak.get('Fitting Model') in SKIPPED_MODELS for _, peak in peaks):
+        return None
+
+    x_values, y_values, mask, background = core_level_spectrum(data, sheet_name)
+
+    peak_dicts = [peak for _, peak in peaks]
+    graph = constraint_graph(peak_dicts)
+    specs = []
+    for i, peak in enumerate(peak_dicts):
+        specs.extend(_peak_parameters(i, peak, peak_dicts, graph))
+    specs = _dependency_order(specs)
+
+    return FitProblem(sheet_name, x_values, y_values, mask, background,
+                      [label for label, _ in peaks], [peak.get('Fitting Model') for peak in peak_dicts],
+                      [_number(peak.get('Skew'), 0.0) for peak in peak_dicts], specs)
+
+
+def core_level_spectrum(data, sheet_name):
+    """
+    The spectrum of a core level and its background over the background range.
+
+    Returns:
+        tuple: (x_all, y_all, mask of the background range, background in the range)
+
+    Raises:
+        ValueError: On an invalid background range or an empty range
+    """
+    core_level_data = data['Core levels'][sheet_name]
+    x_values = np.array(core_level_data['B.E.'], dtype=float)
+    y_values = np.array(core_level_data['Raw Data'], dtype=float)
+    background = np.array(core_level_data['Background']['Bkg Y'], dtype=float)
+
+    try:
+        bg_min_energy = float(core_level_data['Background'].get('Bkg Low'))
+        bg_max_energy = float(core_level_data['Background'].get('Bkg High'))
+    except (ValueError, TypeError):
+        bg_min_energy = min(x_values)
+        bg_max_energy = max(x_values)
+    if not bg_min_energy <= bg_max_energy:
+        raise ValueError("Invalid background energy range")
+
+    mask = (x_values >= bg_min_energy) & (x_values <= bg_max_energy)
+    if not np.any(mask):
+        raise ValueError("No data points found in the specified energy range for background subtraction")
+    return x_values, y_values, mask, background[mask]
+
+
+# FITTER -------------------------------------------------------------------
+
+@functools.lru_cache(maxsize=32)
+def peak_models(model_names):
+    """
+    The lmfit models of a sequence of peak models, built once per combination.
+
+    Args:
+        model_names (tuple): Peak model name of every peak, peak i gets the prefix peak{i}_
+
+    Returns:
+        tuple: (composite of the peak models, BroadcastPeakModel evaluating it)
+    """
+    model = None
+    for i, name in enumerate(model_names):
+        peak_model = _MODEL_FACTORIES[name](f'peak{i}_')
+        model = peak_model if model is None else model + peak_model
+    return model, BroadcastPeakModel(model)
+
+
+# Sparse Jacobian: only used from this many peaks on, and while the Jacobian stays this sparse
+SPARSE_MIN_PEAKS = 12
+SPARSE_MAX_DENSITY = 0.5
+# Half-width of the support window of a peak, in FWHM
+SUPPORT_FWHMS = 10.0
+# lmfit parameters a peak width grows with
+WIDTH_PARAMETERS = ('fwhm', 'sigma', 'gamma')
+
+
+def _local_fwhm(func, prefix, params):
+    """FWHM of a LOCAL_SHAPES peak straight from its lmfit parameters."""
+    if func is lmfit.lineshapes.pvoigt:
+        return pseudo_voigt_fwhm(params[f'{prefix}sigma'].value)
+    if func is lmfit.lineshapes.voigt:
+        return voigt_fwhm(params[f'{prefix}sigma'].value, params[f'{prefix}gamma'].value)
+    return params[f'{prefix}fwhm'].value
+
+
+def peak_supports(problem, params, support_fwhms=SUPPORT_FWHMS):
+    """
+    Points of problem.x each peak can reach during a fit.
+
+    The window of a peak spans ±support_fwhms·FWHM around every position the peak can move to: its current
+    position ± support_fwhms·FWHM, limited by the bounds of its center. The FWHM is the widest the peak can
+    get, with its width parameters at their upper bounds (or the current FWHM when they are unbounded).
+    Positions and FWHM are read from the parameters, no profile is evaluated. Peaks whose shape is not in
+    LOCAL_SHAPES get the whole range.
+
+    Args:
+        problem (FitProblem): Compiled problem
+        params (lmfit.Parameters): Current parameters
+        support_fwhms (float): Half-width of the windows in FWHM
+
+    Returns:
+        list: One slice of problem.x per peak, None when a position or FWHM is not finite
+    """
+    widest = params.copy()
+    for name, peak in zip(problem.param_names, problem.param_peaks):
+        par = widest[name]
+        if (name[len(problem.prefixes[peak]):] in WIDTH_PARAMETERS and par.vary and not par.expr and
+                np.isfinite(par.max)):
+            par.value = par.max
+    widest.update_constraints()
+
+    supports = []
+    for i, component in enumerate(peak_models(tuple(problem.model_names))[0].components):
+        if component.func not in LOCAL_SHAPES:
+            supports.append(slice(0, len(problem.x)))
+            continue
+        prefix = problem.prefixes[i]
+        center = params[f'{prefix}center'].value
+        fwhm = max(_local_fwhm(component.func, prefix, params), _local_fwhm(component.func, prefix, widest))
+        if not (np.isfinite(center) and np.isfinite(fwhm) and fwhm > 0):
+            return None
+        j = problem.param_names.index(f'{prefix}center')
+        reach = support_fwhms * fwhm
+        low = max(center - reach, problem.mins[j]) - reach
+        high = min(center + reach, problem.maxs[j]) + reach
+        # x is sorted (usually descending binding energies), the window is one run of points
+        inside = np.flatnonzero((problem.x >= low) & (problem.x <= high))
+        supports.append(slice(inside[0], inside[-1] + 1) if len(inside) else slice(0, 0))
+    return supports
+
+
+def jacobian_density(problem, params, supports):
+    """
+    Fraction of the entries of the Jacobian of a fit that can be non-zero.
+
+    A variable can only change the model within the supports of the peaks that depend on it, directly or
+    through constraint expressions (e.g. the FWHM of a doublet partner). Peaks whose shape is normalized over
+    the whole range (LA) reach every point. The column of a variable has as many non-zero entries as the union
+    of these supports has points.
+
+    Args:
+        problem (FitProblem): Compiled problem
+        params (lmfit.Parameters): Starting parameters of the fit
+        supports (list): peak_supports of the problem
+
+    Returns:
+        float: Non-zero fraction of the (len(problem.x), number of varying parameters) Jacobian, 1 without
+            varying parameters
+    """
+    components = peak_models(tuple(problem.model_names))[0].components
+    var_names = [name for name, par in params.items() if par.vary and not par.expr]
+    if not var_names or not len(problem.x):
+        return 1.0
+    variables = expression_variables(params, problem.param_names)
+    windows = {name: [] for name in var_names}
+    for name, peak in zip(problem.param_names, problem.param_peaks):
+        rows = supports[peak] if components[peak].func in LOCAL_SHAPES else slice(0, len(problem.x))
+        for var in variables[name]:
+            windows[var].append((rows.start, rows.stop))
+
+    # Length of the union of the windows of every column
+    nonzero = 0
+    for intervals in windows.values():
+        end = 0
+        for start, stop in sorted(intervals):
+            nonzero += max(stop - max(start, end), 0)
+            end = max(end, stop)
+    return nonzero / (len(problem.x) * len(var_names))
+
+
+class FitEvaluation:
+    """
+    Result of PeakFitter.evaluate: the model at given parameters, with the statistics of an lmfit ModelResult.
+
+    The statistics count the varying parameters (not the constrained ones) like lmfit does.
+    """
+
+    def __init__(self, params, best_fit, y):
+        self.params = params
+        self.best_fit = best_fit
+        self.residual = y - best_fit
+        self.ndata = len(y)
+        self.nvarys = sum(1 for par in params.values() if par.vary and not par.expr)
+        self.nfree = max(self.ndata - self.nvarys, 1)
+        self.chisqr = float(np.sum(self.residual ** 2))
+        self.redchi = self.chisqr / self.nfree
+        # Same definitions as lmfit, with chi² floored to avoid log(0)
+        neg2_log_likelihood = self.ndata * np.log(max(self.chisqr, 1e-250 * self.ndata) / self.ndata)
+        self.aic = neg2_log_likelihood + 2 * self.nvarys
+        self.bic = neg2_log_likelihood + np.log(self.ndata) * self.nvarys
+        self.nfev = 1
+        self.success = True
+        self.aborted = False
+        self.cached = False
+        self.jacobian_check = None
+
+
+class PeakFitter:
+    """
+    Fits a FitProblem without the GUI. The models are shared by every fitter of the same peak models,
+    so a fitter can be rebuilt for every fit (new values, new constraints) at the cost of compiling the problem.
+    """
+
+    def __init__(self, problem):
+        self.problem = problem
+        self.model, self.fit_model = peak_models(tuple(problem.model_names))
+
+    def evaluate(self, params=None):
+        """Evaluate the model at the current (or given) parameters, with a result object like fit()."""
+        problem = self.problem
+        params = problem.parameters() if params is None else params
+        return FitEvaluation(params, self.fit_model.eval(params, x=problem.x), problem.y_subtracted)
+
+    def fit(self, method='leastsq', max_nfev=None, jacobian_mode="Analytic", params=None, iter_cb=None):
+        """
+        Fit the peaks to the background-subtracted data.
+
+        Args:
+            method (str): lmfit minimization method
+            max_nfev (int): Maximum number of function evaluations
+            jacobian_mode (str): One of Peak_Jacobians.JACOBIAN_MODES (used by leastsq / least_squares)
+            params (lmfit.Parameters): Starting parameters, default problem.parameters()
+            iter_cb (callable): lmfit iteration callback, iter_cb(params, nfev, residual, ...) -> True to abort
+
+        Returns:
+            lmfit.model.ModelResult, with jacobian_check holding the check_jacobian report in Cross-Check mode
+            (None otherwise)
+        """
+        problem = self.problem
+        params = problem.parameters() if params is None else params
+
+        # Define fit_kws only for methods that support it ('nelder', 'powell' or 'cobyla' don't)
+        fit_kws = {'ftol': 1e-10, 'xtol': 1e-10} if method in ['leastsq', 'least_squares'] else None
+
+        # Analytic Jacobian instead of one finite-difference model evaluation per varying parameter. Models with
+        # a component without analytic derivatives (LA*G, skewed Voigt, exponential Gaussian) are left to the
+        # finite differences of the optimizer, which are faster than differencing that component in Dfun.
+        analytic = fit_kws is not None and jacobian_mode != "Finite Differences" and \
+            has_analytic_derivatives(self.model)
+
+        # Sparse: the analytic derivatives of every peak are only evaluated within its support window.
+        # Few peaks, or peaks overlapping too much for it to pay off, fall back to the dense Analytic Jacobian.
+        if analytic and jacobian_mode == "Sparse":
+            supports = peak_supports(problem, params) if problem.num_peaks >= SPARSE_MIN_PEAKS else None
+            if supports is not None and jacobian_density(problem, params, supports) <= SPARSE_MAX_DENSITY:
+                fit_kws['Dfun'] = CompositeJacobian(self.model, supports)
+        if analytic and 'Dfun' not in fit_kws:
+            fit_kws['Dfun'] = CompositeJacobian(self.model)
+
+        report = check_jacobian(self.model, params, problem.x) if analytic and jacobian_mode == "Cross-Check" else None
+
+        result = self.fit_model.fit(
+            problem.y_subtracted,
+            params,
+            x=problem.x,
+            max_nfev=max_nfev,
+            method=method,
+            weights=np.ones(len(problem.y)),
+            scale_covar=True,
+            nan_policy='omit',
+            verbose=True,
+            iter_cb=iter_cb,
+            **({'fit_kws': fit_kws} if fit_kws else {})
+        )
+        result.jacobian_check = report
+        return result
+
+
+# RESULTS ------------------------------------------------------------------
+
+def peak_results(problem, params):
+    """
+    Convert fitted parameters back to the values shown in the peak table.
+
+    Args:
+        problem (FitProblem): The fitted problem
+        params (lmfit.Parameters): Fitted parameters (result.params)
+
+    Returns:
+        list: One dict per peak with 'Position', 'Height', 'FWHM', 'L/G', 'Area', 'fwhm_g', 'Skew', 'Fitting Model'
+            and, for the models that have them, 'Sigma' and 'Gamma' (rounded like the table), plus 'y_values'
+            (profile on x_all) for the LA models
+    """
+    x_values = problem.x_all
+    results = []
+    for i, model_name in enumerate(problem.model_names):
+        prefix = problem.prefixes[i]
+        value = {name[len(prefix):]: params[name].value for name in problem.param_names if name.startswith(prefix)}
+        peak = {}
+        center = value['center']
+        fwhm_g = None
+        sigma = value.get('sigma', 0)
+        gamma = value.get('gamma', 0)
+
+        if model_name in ["Voigt (Area, L/G, σ)", "Voigt (Area, L/G, σ, skew)",
+                          "Voigt (Area, σ, γ)"]:
+            amplitude = value['area']
+            height = voigt_area_to_height(amplitude, sigma, gamma)
+            fwhm = voigt_fwhm(sigma, gamma)
+            fraction = (2 * gamma) / (sigma * 2.355 + 2 * gamma) * 100
+            area = amplitude
+        elif model_name == "Pseudo-Voigt (Area)":
+            area = value['area']
+            fraction = value['fraction'] * 100
+            fwhm = pseudo_voigt_fwhm(sigma)
+            height = pseudo_voigt_area_to_height(area, sigma, fraction)
+        elif model_name == "ExpGauss.(Area, σ, γ)":
+            area = value['amplitude']
+            # Height and FWHM numerically
+            y_values = lmfit.lineshapes.expgaussian(x_values, area, center, sigma, gamma)
+            height = np.max(y_values)
+            indices = np.where(y_values >= height / 2)[0]
+            fwhm = abs(x_values[indices[-1]] - x_values[indices[0]]) if len(indices) >= 2 else 0.0
+            fraction = gamma / (sigma + gamma) * 100
+        elif model_name in ["LA (Area, σ, γ)", "LA (Area, σ/γ, γ)",
+                            "LA*G (Area, σ/γ, γ)"]:
+            area = value['amplitude']
+            fwhm = value['fwhm']
+            if model_name == "LA (Area, σ, γ)":
+                # No direct equivalent to 'fraction' for LA model
+                fraction = sigma / (sigma + gamma)
+            else:
+                fraction = value['fraction'] / 100
+            if model_name == "LA*G (Area, σ/γ, γ)":
+                fwhm_g = value['fwhm_g']
+                y_values = PeakFunctions.LAxG(x_values, center, area, fwhm, sigma, gamma, fwhm_g)
+            else:
+                y_values = PeakFunctions.LA(x_values, center, area, fwhm, sigma, gamma)
+            height = np.max(y_values)
+            peak['y_values'] = y_values  # for the RSD
+        elif model_name in ["GL (Height)", "SGL (Height)"]:
+            height = value['amplitude']
+            fwhm = value['fwhm']
+            fraction = value['fraction']
+            area = height * fwhm * np.sqrt(np.pi / (4 * np.log(2)))
+        else:
+            area = value['area']
+            fwhm = value['fwhm']
+            fraction = value['fraction']
+            height = area / (fwhm * np.sqrt(np.pi / (4 * np.log(2))))
+
+        if model_name in ["ExpGauss.(Area, σ, γ)", "LA (Area, σ, γ)", "LA (Area, σ/γ, γ)",
+                          "LA*G (Area, σ/γ, γ)"]:
+            sigma = round(float(sigma), 2)
+            gamma = round(float(gamma), 2)
+            fraction = round(fraction * 100, 2)
+        else:
+            # Voigt widths are shown as 2.355·sigma and 2·gamma
+            sigma = round(float(sigma * 2.355), 2)
+            gamma = round(float(gamma * 2), 2)
+            fraction = round(float(fraction), 2)
+        if 'skew' in value:
+            fwhm_g = value['skew']
+        elif fwhm_g is None:
+            fwhm_g = problem.skews[i]
+
+        peak.update({
+            'Position': round(float(center), 2),
+            'Height': round(float(height), 2),
+            'FWHM': round(float(fwhm), 2),
+            'L/G': fraction,
+            'Area': round(float(area), 2),
+            'fwhm_g': round(float(fwhm_g), 2),
+            'Skew': round(float(fwhm_g), 2),
+            'Fitting Model': model_name
+        })
+        # Models without a sigma or gamma parameter keep the values of the peak
+        if 'sigma' in value:
+            peak['Sigma'] = sigma
+        if 'gamma' in value:
+            peak['Gamma'] = gamma
+        results.append(peak)
+    return results
@@ -1,16 +1,18 @@
 
 import re
 import wx
-from Functions import fit_peaks, remove_peak
+from Functions import remove_peak, apply_fit_result
 import numpy as np
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg as FigureCanvas
 import matplotlib.pyplot as plt
 import lmfit
-from libraries.Peak_Functions import BackgroundCalculations
+from libraries.Peak_Functions import BackgroundCalculations, TougaardFitModel
 from libraries.Save import save_state
 from libraries.Plot_Operations import PlotManager
 from libraries.Open import load_library_data
+from libraries.Fit_Executor import FitExecutor, problem_matches, FIT_TOLERANCES
+from libraries.Multi_Start_Screen import MultiStartWindow
 
 class FittingWindow(wx.Frame):
     def __init__(self, parent, *args, **kw):
@@ -19,9 +21,12 @@ class FittingWindow(wx.Frame):
 
 
         self.SetTitle("Peak Fitting")
-        self.SetSize((305, 520))  # Increased height to accommodate new elements
-        self.SetMinSize((305, 520))
-        self.SetMaxSize((305, 520))
+        self.SetSize((305, 630))  # Increased height to accommodate new elements
+        self.SetMinSize((305, 630))
+        self.SetMaxSize((305, 630))
+
+        self.fit_executor = None
+        self.multi_start_window = None
 
         #305 480
 
@@ -71,8 +76,8 @@ class FittingWindow(wx.Frame):
         background_sizer = wx.GridBagSizer(hgap=0, vgap=0)
 
         method_label = wx.StaticText(self.background_panel, label="Method:")
-        self.method_combobox = wx.ComboBox(self.background_panel, choices=["Multi-Regions Smart", "Smart", "Shirley",
-                                            "Linear", '1x U4-Tougaard', "2x U4-Tougaard", "3x U4-Tougaard"],
+        self.method_combobox = wx.ComboBox(self.background_panel, choices=["Multi-Regions Smart", "Smart", "Smart2",
+                                            "Shirley", "Linear", '1x U4-Tougaard', "2x U4-Tougaard", "3x U4-Tougaard"],
                                            style=wx.CB_READONLY)
         method_index = self.method_combobox.FindString(self.parent.background_method)
         self.method_combobox.SetSelection(method_index)
@@ -151,6 +156,10 @@ class FittingWindow(wx.Frame):
         clear_background_only_button.SetMinSize((125, 40))
         clear_background_only_button.Bind(wx.EVT_BUTTON, self.on_clear_background_only)
 
+        apply_regions_button = wx.Button(self.background_panel, label="Apply Regions\nto Sheets")
+        apply_regions_button.SetMinSize((125, 40))
+        apply_regions_button.Bind(wx.EVT_BUTTON, self.on_apply_regions)
+
         self.tougaard_fit_btn = wx.Button(self.background_panel, label="Create Tougaard\n Model")
         self.tougaard_fit_btn.SetMinSize((125, 40))
         self.tougaard_fit_btn.Bind(wx.EVT_BUTTON, lambda evt: TougaardFitWindow(self).Show())
@@ -174,6 +183,7 @@ class FittingWindow(wx.Frame):
 
 
         background_sizer.Add(reset_vlines_button, pos=(8, 1), flag=wx.ALL | wx.EXPAND, border=5)
+        background_sizer.Add(apply_regions_button, pos=(9, 0), flag=wx.ALL | wx.EXPAND, border=5)
         background_sizer.Add(clear_between_vlines_button, pos=(9, 1), flag=wx.ALL | wx.EXPAND, border=5)
         background_sizer.Add(self.tougaard_fit_btn, pos=(10, 0), flag=wx.ALL | wx.EXPAND, border=5)
         background_sizer.Add(clear_background_only_button, pos=(10, 1), flag=wx.ALL | wx.EXPAND, border=5)
@@ -251,7 +261,8 @@ class FittingWindow(wx.Frame):
             # "slsqp",
             # "tnc",
             # "trust-krylov",
-            "trust-constr"
+            "trust-constr",
+            "multi-start (global)"
             # "dogleg",
             # "shgo",
             # "dual_annealing"
@@ -299,13 +310,27 @@ class FittingWindow(wx.Frame):
         export_button.SetMinSize((125, 40))
         export_button.Bind(wx.EVT_BUTTON, self.on_export_results)
 
-        fit_button = wx.Button(self.fitting_panel, label="Fit \nOne Time")
-        fit_button.SetMinSize((125, 40))
-        fit_button.Bind(wx.EVT_BUTTON, self.on_fit_peaks)
+        self.fit_button = wx.Button(self.fitting_panel, label="Fit \nOne Time")
+        self.fit_button.SetMinSize((125, 40))
+        self.fit_button.Bind(wx.EVT_BUTTON, self.on_fit_peaks)
+
+        self.fit_multi_button = wx.Button(self.fitting_panel, label="Fit \nMultiple Times")
+        self.fit_multi_button.SetMinSize((125, 40))
+        self.fit_multi_button.Bind(wx.EVT_BUTTON, self.on_fit_multi)
+
+        # Wall-clock budget of a fit run in seconds, 0 for no limit
+        self.time_budget_spin = wx.SpinCtrl(self.fitting_panel, value=str(self.parent.fit_time_budget),
+                                            min=0, max=3600)
+
+        # Fit Multiple Times stops when chi² and the parameters change less than this between two fits
+        self.tolerance_combobox = wx.ComboBox(self.fitting_panel, choices=FIT_TOLERANCES, style=wx.CB_READONLY)
+        self.tolerance_combobox.SetValue(next((tolerance for tolerance in FIT_TOLERANCES[1:]
+                                               if float(tolerance) == self.parent.fit_tolerance), "Off"))
 
-        fit_multi_button = wx.Button(self.fitting_panel, label="Fit \nMultiple Times")
-        fit_multi_button.SetMinSize((125, 40))
-        fit_multi_button.Bind(wx.EVT_BUTTON, self.on_fit_multi)
+        self.cancel_fit_button = wx.Button(self.fitting_panel, label="Cancel Fit")
+        self.cancel_fit_button.SetMinSize((125, 30))
+        self.cancel_fit_button.Bind(wx.EVT_BUTTON, self.on_cancel_fit)
+        self.cancel_fit_button.Disable()
 
         fitting_sizer.Add(wx.StaticText(self.fitting_panel, label="Fitting Model:"), pos=(0, 0),
                           flag=wx.ALL | wx.ALIGN_CENTER_VERTICAL, border=5)
@@ -341,8 +366,16 @@ class FittingWindow(wx.Frame):
         fitting_sizer.Add(remove_peak_button, pos=(11, 0), flag=wx.ALL | wx.EXPAND, border=5)
         fitting_sizer.Add(export_button, pos=(11, 1), flag=wx.ALL | wx.EXPAND, border=5)
 
-        fitting_sizer.Add(fit_button, pos=(12, 0), flag=wx.ALL | wx.EXPAND, border=5)
-        fitting_sizer.Add(fit_multi_button, pos=(12, 1), flag=wx.ALL | wx.EXPAND, border=5)
+        fitting_sizer.Add(self.fit_button, pos=(12, 0), flag=wx.ALL | wx.EXPAND, border=5)
+        fitting_sizer.Add(self.fit_multi_button, pos=(12, 1), flag=wx.ALL | wx.EXPAND, border=5)
+
+        fitting_sizer.Add(wx.StaticText(self.fitting_panel, label="Time Budget (s):"), pos=(13, 0),
+                          flag=wx.ALL | wx.ALIGN_CENTER_VERTICAL, border=5)
+        fitting_sizer.Add(self.time_budget_spin, pos=(13, 1), flag=wx.ALL | wx.EXPAND, border=5)
+        fitting_sizer.Add(wx.StaticText(self.fitting_panel, label="Stop Tolerance:"), pos=(14, 0),
+                          flag=wx.ALL | wx.ALIGN_CENTER_VERTICAL, border=5)
+        fitting_sizer.Add(self.tolerance_combobox, pos=(14, 1), flag=wx.ALL | wx.EXPAND, border=5)
+        fitting_sizer.Add(self.cancel_fit_button, pos=(15, 0), span=(1, 2), flag=wx.ALL | wx.EXPAND, border=5)
 
         self.fitting_panel.SetSizer(fitting_sizer)
         notebook.AddPage(self.fitting_panel, "Peak Fitting")
@@ -409,6 +442,23 @@ class FittingWindow(wx.Frame):
     def on_clear_background_only(self, event):
         self.parent.plot_manager.clear_background_only(self.parent)
 
+    def on_apply_regions(self, event):
+        sheet_name = self.parent.sheet_combobox.GetValue()
+        regions = self.parent.Data['Core levels'][sheet_name].get('Background', {}).get('Regions', [])
+        if not regions:
+            wx.MessageBox("No background regions to apply on this sheet.", "Information", wx.OK | wx.ICON_INFORMATION)
+            return
+
+        other_sheets = [name for name in self.parent.Data['Core levels'] if name != sheet_name]
+        dialog = wx.MultiChoiceDialog(self, f"Apply the {len(regions)} background region(s) of {sheet_name} to:",
+                                      "Apply Background Regions", other_sheets)
+        if dialog.ShowModal() == wx.ID_OK:
+            selected_sheets = [other_sheets[i] for i in dialog.GetSelections()]
+            if selected_sheets:
+                self.parent.plot_manager.apply_background_regions(self.parent, regions, selected_sheets)
+                save_state(self.parent)
+        dialog.Destroy()
+
     def on_averaging_points_change(self, event):
         try:
             self.parent.averaging_points = int(self.averaging_points_text.GetValue())
@@ -429,31 +479,104 @@ class FittingWindow(wx.Frame):
         remove_peak(self.parent)
 
     def on_fit_multi(self, event):
+        tolerance = self.tolerance_combobox.GetValue()
+        self.parent.fit_tolerance = 0 if tolerance == "Off" else float(tolerance)
+        self.start_fit(self.fit_iterations_spin.GetValue(), self.parent.fit_tolerance)
+
+    def on_fit_peaks(self, event):
+        self.start_fit(1)
+
+    def start_fit(self, iterations, tolerance=None):
+        """
+        Fit the current sheet iterations times in a worker thread, the results are applied when it finishes.
+
+        With a tolerance, the fits stop as soon as chi² and the parameters change less than it.
+        The multi-start method opens the multi-start search instead.
+        """
+        if self.get_optimization_method() == "multi-start":
+            self.open_multi_start()
+            return
+        if self.fit_executor is not None and self.fit_executor.running:
+            return
         if self.parent.peak_params_grid.GetNumberRows() == 0:
             wx.MessageBox("No peaks to fit. Add at least one peak first.", "Error", wx.OK | wx.ICON_ERROR)
             return
-        save_state(self.parent)
-        iterations = self.fit_iterations_spin.GetValue()
-        for i in range(1, iterations + 1):
-            self.current_fit_text.SetValue(f"{i}/{iterations}")
-            result = fit_peaks(self.parent, self.parent.peak_params_grid)
-            if result:
-                r_squared, rsd, red_chi_square = result
-                self.update_fit_indicators(r_squared, rsd, red_chi_square)
-                self.actual_iter_text.SetValue(str(self.parent.fit_results['nfev']))
-            self.parent.clear_and_replot()
-            wx.Yield()
-        self.current_fit_text.SetValue("Complete")
-        save_state(self.parent)
+        sheet_name = self.parent.sheet_combobox.GetValue()
+        if sheet_name not in self.parent.Data['Core levels']:
+            wx.MessageBox(f"No data available for sheet: {sheet_name}", "Error", wx.OK | wx.ICON_ERROR)
+            return
+        if sheet_name not in self.parent.plot_config.plot_limits:
+            self.parent.plot_config.update_plot_limits(self.parent, sheet_name)
 
-    def on_fit_peaks(self, event):
         save_state(self.parent)
-        result = fit_peaks(self.parent, self.parent.peak_params_grid)
-        if result:
-            r_squared, rsd, red_chi_squared = result
-            self.update_fit_indicators(r_squared, rsd, red_chi_squared)
+        self.parent.fit_time_budget = self.time_budget_spin.GetValue()
+        self.fit_executor = FitExecutor(self.parent.Data, sheet_name, iterations=iterations,
+                                        method=self.get_optimization_method(),
+                                        max_nfev=self.parent.max_iterations,
+                                        jacobian_mode=getattr(self.parent, 'jacobian_mode', "Analytic"),
+                                        time_budget=self.parent.fit_time_budget,
+                                        post=wx.CallAfter, on_progress=self.on_fit_progress,
+                                        on_done=self.on_fit_done, tolerance=tolerance)
+        self.set_fit_running(True)
+        self.current_fit_text.SetValue(f"1/{iterations}")
+        self.fit_executor.start()
+
+    def open_multi_start(self):
+        if self.multi_start_window is None or not self.multi_start_window:
+            self.multi_start_window = MultiStartWindow(self.parent)
+        self.multi_start_window.Show()
+        self.multi_start_window.Raise()
+
+    def set_fit_running(self, running):
+        self.fit_button.Enable(not running)
+        self.fit_multi_button.Enable(not running)
+        self.cancel_fit_button.Enable(running)
+
+    def on_cancel_fit(self, event):
+        if self.fit_executor is not None:
+            self.fit_executor.cancel()
+            self.current_fit_text.SetValue("Cancelling...")
+
+    def on_fit_progress(self, progress):
+        if not self:  # window closed while fitting
+            return
+        self.current_fit_text.SetValue(f"{progress.fit_index}/{progress.num_fits}")
+        self.actual_iter_text.SetValue(str(progress.nfev))
+        self.red_chi_squared_text.SetValue(f"{progress.redchi:.2f}")
+
+    def on_fit_done(self, outcome):
+        if not self:
+            return
+        self.set_fit_running(False)
+        if outcome.status == 'cancelled':
+            self.current_fit_text.SetValue("Cancelled")
+            return
+        if outcome.status == 'error':
+            self.current_fit_text.SetValue("Failed")
+            wx.MessageBox(f"Fitting failed: {outcome.error}", "Error", wx.OK | wx.ICON_ERROR)
+            return
+        # Peaks added, removed or moved to another sheet during the fit: the result no longer fits the table
+        if (self.parent.sheet_combobox.GetValue() != outcome.problem.sheet_name or
+                not problem_matches(self.parent.Data, outcome.problem)):
+            self.current_fit_text.SetValue("Discarded")
+            wx.MessageBox("The peaks changed while fitting, the fit result was discarded.", "Information",
+                          wx.OK | wx.ICON_INFORMATION)
+            return
+
+        r_squared, rsd, red_chi_square = apply_fit_result(self.parent, self.parent.peak_params_grid,
+                                                          outcome.problem, outcome.result)
+        self.update_fit_indicators(r_squared, rsd, red_chi_square)
+        self.actual_iter_text.SetValue(str(self.parent.fit_results['nfev']))
+        if outcome.status == 'converged':
+            self.current_fit_text.SetValue(f"Converged {outcome.fits_done}/{self.fit_executor.iterations}, "
+                                           f"saved {outcome.time_saved:.1f} s")
+        elif outcome.status == 'budget':
+            self.current_fit_text.SetValue(f"Time budget ({outcome.fits_done}/{self.fit_executor.iterations})")
+        elif outcome.cached:
+            self.current_fit_text.SetValue("Complete (stored fit)")
         else:
-            print("Fitting failed or was cancelled.")
+            self.current_fit_text.SetValue("Complete")
+        save_state(self.parent)
 
     def update_fit_indicators(self, r_squared, rsd, red_chi_squared):
         self.r_squared_text.SetValue(f"{r_squared:.5f}")
@@ -683,6 +806,9 @@ class FittingWindow(wx.Frame):
                      "when the intensity is going up and a linear background when the intensity is "
                      "going down. If the calculated background is above the data then the "
                      "background is set equal to the data.",
+            "Smart2": "Derivative based background. It follows the data in flat regions, follows the "
+                      "data down where the intensity is going down and applies a Shirley background "
+                      "where the intensity is going up.",
             "Shirley": "Iterative background calculation. Reliable for on positive background when "
             "the data contains symmetrical peak.",
             "Linear": "Simple linear background. Usually used on negative background"
@@ -767,6 +893,8 @@ class FittingWindow(wx.Frame):
         event.Skip()
 
     def on_close(self, event):
+        if self.fit_executor is not None and self.fit_executor.running:
+            self.fit_executor.cancel()
         self.parent.background_tab_selected = False
         self.parent.peak_fitting_tab_selected = False
         self.parent.show_hide_vlines()
@@ -834,6 +962,11 @@ class FittingWindow(wx.Frame):
                     mask = (x_values >= min(bg_low, bg_high)) & (x_values <= max(bg_low, bg_high))
                     background[mask] = raw_data[mask]
 
+                    # Drop, trim or split the regions between the lines
+                    regions = core_level_data['Background'].get('Regions', [])
+                    core_level_data['Background']['Regions'] = BackgroundCalculations.clear_background_regions(
+                        x_values, regions, bg_low, bg_high)
+
                     core_level_data['Background']['Bkg Y'] = background.tolist()
                     self.parent.background = background
                     self.parent.clear_and_replot()
@@ -916,6 +1049,10 @@ class TougaardFitWindow(wx.Frame):
         button_sizer.Add(self.fit_button, 1, wx.ALL, 5)
         button_sizer.Add(self.copy_button, 1, wx.ALL, 5)
 
+        # Analytic Jacobian, untick to compare with the finite-difference estimate of least_squares
+        self.analytic_jac_checkbox = wx.CheckBox(control_panel, label="Analytic Jacobian")
+        self.analytic_jac_checkbox.SetValue(True)
+
 
         # Initialize vertical lines as None
         self.vline_min = None
@@ -947,6 +1084,7 @@ class TougaardFitWindow(wx.Frame):
         control_sizer.Add(range_sizer, 0, wx.EXPAND | wx.ALL, 5)
         control_sizer.Add(bg_sizer, 0, wx.EXPAND | wx.ALL, 5)
         control_sizer.Add(self.param_scroll, 1, wx.EXPAND | wx.ALL, 5)
+        control_sizer.Add(self.analytic_jac_checkbox, 0, wx.LEFT | wx.RIGHT, 10)
         control_sizer.Add(button_sizer, 0, wx.EXPAND|wx.ALL, 5)
         control_panel.SetSizer(control_sizer)
 
@@ -1082,36 +1220,19 @@ class TougaardFitWindow(wx.Frame):
             print("Error: No data points in fitting range")
             return
 
-        def tougaard_model(params, x_full, y_full, x_fit, y_fit):
-            baseline = y_full[-1]
-            y_shifted = y_full - baseline
-            dx = np.mean(np.diff(x_full))
-            background_full = np.zeros_like(y_full)
-
-            for i in range(len(x_full)):
-                E = x_full[i:] - x_full[i]
-                K_total = 0
-                for j in range(len(self.tougaard_params)):
-                    B = params[f'B{j + 1}'].value
-                    C = params[f'C{j + 1}'].value
-                    D = params[f'D{j + 1}'].value
-                    K_total += B * E / ((C - E ** 2) ** 2 + D * E ** 2)
-                background_full[i] = np.trapz(K_total * y_shifted[i:], dx=dx)
-
-            background_full += baseline
-            fit_indices = np.where(fit_mask)[0]
-            background_fit = background_full[fit_indices]
-            return y_fit - background_fit
-
-        result = lmfit.minimize(tougaard_model,
+        # Energy-loss basis is built once per data range, B/C/D changes are evaluated with FFTs
+        tougaard_model = TougaardFitModel(x_full, y_full, fit_mask, len(self.tougaard_params))
+
+        fit_kws = {'jac': tougaard_model.jacobian} if self.analytic_jac_checkbox.GetValue() else {}
+        result = lmfit.minimize(tougaard_model.residual,
                                 params,
-                                args=(x_full, y_full, x_fit, y_fit),
                                 method='least_squares',
                                 ftol=1e-10,
                                 xtol=1e-10,
                                 max_nfev=100,
                                 scale_covar=True,
-                                verbose=True)
+                                verbose=True,
+                                **fit_kws)
 
         print("\nFit Results:")
         print(result.message)
@@ -1155,17 +1276,10 @@ class TougaardFitWindow(wx.Frame):
         # Plot each Tougaard background
         colors = plt.cm.tab10(np.linspace(0, 1, len(self.tougaard_params)))
         for j, color in enumerate(colors):
-            background = np.zeros_like(y_bg) + baseline
-            y_shifted = y_bg - baseline
-            dx = np.mean(np.diff(x_bg))
-
-            for i in range(len(x_bg)):
-                E = x_bg[i:] - x_bg[i]
-                B = fitted_params[f'B{j + 1}'].value
-                C = fitted_params[f'C{j + 1}'].value
-                D = fitted_params[f'D{j + 1}'].value
-                K = B * E / ((C - E ** 2) ** 2 + D * E ** 2)
-                background[i] += np.trapz(K * y_shifted[i:], dx=dx)
+            B = fitted_params[f'B{j + 1}'].value
+            C = fitted_params[f'C{j + 1}'].value
+            D = fitted_params[f'D{j + 1}'].value
+            background = BackgroundCalculations.calculate_multi_tougaard_background(x_bg, y_bg, [(B, C, D, 0)])
 
             # background += baseline
             total_background += (background - baseline)
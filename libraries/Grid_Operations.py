@@ -2,6 +2,8 @@
 
 import wx
 
+from libraries.Uncertainty import format_interval
+
 def populate_results_grid(window):
     if 'Results' in window.Data and 'Peak' in window.Data['Results']:
         results = window.Data['Results']['Peak']
@@ -11,7 +13,7 @@ def populate_results_grid(window):
 
         # Resize the grid if necessary
         num_rows = len(results)
-        num_cols = 26  # Based on your Export.py structure
+        num_cols = 31  # Based on your Export.py structure
         if window.results_grid.GetNumberRows() < num_rows:
             window.results_grid.AppendRows(num_rows - window.results_grid.GetNumberRows())
         if window.results_grid.GetNumberCols() < num_cols:
@@ -61,6 +63,8 @@ def populate_results_grid(window):
             window.results_grid.SetCellValue(row, 26, peak_data['Area Constraint'])
             window.results_grid.SetCellValue(row, 27, peak_data['Sigma Constraint'])
             window.results_grid.SetCellValue(row, 28, peak_data['Gamma Constraint'])
+            window.results_grid.SetCellValue(row, 29, format_interval(peak_data.get('Area CI')))
+            window.results_grid.SetCellValue(row, 30, format_interval(peak_data.get('at. % CI')))
 
         # Bind events
         # window.results_grid.Bind(wx.grid.EVT_GRID_CELL_LEFT_CLICK, window.on_checkbox_update)
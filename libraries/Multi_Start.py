@@ -0,0 +1,147 @@
+# MULTI-START SEARCH -------------------------------------------------------
+# Global search for overlapped envelopes: starting points are sampled within
+# the compiled parameter bounds (Sobol or Latin hypercube, seeded), every start
+# is fitted locally in a process pool, and the converged solutions are
+# deduplicated and ranked by chi².
+# -------------------------------------------------------------------------
+import numpy as np
+from scipy.stats import qmc
+
+from libraries.Fit_Problem import PeakFitter
+from libraries.Process_Pipeline import ProcessPipeline
+
+SAMPLERS = ["Sobol", "Latin hypercube"]
+
+
+def free_parameters(problem):
+    """Indices (in problem.param_names) of the parameters varied by the fit."""
+    return [i for i, (vary, expr) in enumerate(zip(problem.vary, problem.exprs)) if vary and expr is None]
+
+
+def sample_starts(problem, num_starts, seed=0, sampler="Sobol"):
+    """
+    Starting values sampled within the bounds of the free parameters.
+
+    The first start is the current values of the problem. Parameters with an infinite bound are sampled
+    within ±50% of their current value (clipped to the finite bound), positive ranges spanning more than two
+    decades (heights, areas) on a log scale.
+
+    Args:
+        problem (FitProblem): Compiled problem
+        num_starts (int): Number of starts, including the current values
+        seed (int): Seed of the sampler, the same seed gives the same starts
+        sampler (str): "Sobol" or "Latin hypercube"
+
+    Returns:
+        np.ndarray: (num_starts, number of parameters) values in param_names order
+    """
+    free = free_parameters(problem)
+    starts = np.tile(problem.values, (max(num_starts, 1), 1))
+    if num_starts < 2 or not free:
+        return starts
+
+    values = problem.values[free]
+    spread = np.maximum(np.abs(values) * 0.5, 1e-6)
+    lows = np.where(np.isfinite(problem.mins[free]), problem.mins[free], values - spread)
+    highs = np.where(np.isfinite(problem.maxs[free]), problem.maxs[free], values + spread)
+    highs = np.maximum(highs, lows + 1e-12)
+
+    if sampler == "Sobol":
+        engine = qmc.Sobol(d=len(free), scramble=True, seed=seed)
+        # Sobol points are balanced in powers of two
+        points = engine.random_base2(int(np.ceil(np.log2(num_starts - 1))))[:num_starts - 1]
+    else:
+        points = qmc.LatinHypercube(d=len(free), seed=seed).random(num_starts - 1)
+    log_scale = (lows > 0) & (highs / np.where(lows > 0, lows, 1) > 100)
+    lows = np.where(log_scale, np.log(np.where(log_scale, lows, 1)), lows)
+    highs = np.where(log_scale, np.log(np.where(log_scale, highs, 1)), highs)
+    samples = qmc.scale(points, lows, highs)
+    starts[1:, free] = np.where(log_scale, np.exp(samples), samples)
+    return starts
+
+
+def fit_start(task):
+    """
+    Worker: fit the problem from one starting point.
+
+    Returns:
+        dict: 'Start' (index), 'Values' ({parameter: value}), 'Chi2', 'Red. Chi2', 'AIC', 'BIC' and 'Nfev'
+    """
+    problem = task['Problem']
+    result = PeakFitter(problem).fit(method=task['Method'], max_nfev=task['Max Nfev'],
+                                     jacobian_mode=task['Jacobian'], params=problem.parameters(task['Values']))
+    return {
+        'Start': task['Start'],
+        'Values': {name: par.value for name, par in result.params.items()},
+        'Chi2': float(result.chisqr),
+        'Red. Chi2': float(result.redchi),
+        'AIC': float(result.aic),
+        'BIC': float(result.bic),
+        'Nfev': int(result.nfev),
+    }
+
+
+def _canonical_point(problem, values, index):
+    """
+    Free parameter values of a solution with the peaks ordered by position, so that solutions that only
+    swap peaks of the same model compare equal. Returns (models in that order, values, scales of the values).
+    """
+    order = sorted(range(problem.num_peaks),
+                   key=lambda peak: values.get(f"{problem.prefixes[peak]}center", 0.0))
+    point, scales = [], []
+    for peak in order:
+        for i in index:
+            if problem.param_peaks[i] == peak:
+                point.append(values[problem.param_names[i]])
+                scales.append(problem.maxs[i] - problem.mins[i])
+    return [problem.model_names[peak] for peak in order], np.array(point), np.array(scales)
+
+
+def distinct_solutions(problem, solutions, tolerance=1e-3):
+    """
+    Solutions sorted by chi², keeping only the best of those that converged to the same point.
+
+    Two solutions are the same when, with the peaks ordered by position, every free parameter differs by
+    less than tolerance times its bound range (or its magnitude when a bound is infinite). The number of
+    starts that reached each kept solution is stored in its 'Hits'.
+    """
+    index = free_parameters(problem)
+    kept, points = [], []
+    # Ties are broken by start index, so the ranking does not depend on the order the workers finished in
+    for solution in sorted(solutions, key=lambda solution: (solution['Chi2'], solution['Start'])):
+        models, point, scales = _canonical_point(problem, solution['Values'], index)
+        for other, (other_models, other_point) in zip(kept, points):
+            scale = np.where(np.isfinite(scales), scales, np.maximum(np.abs(other_point), 1.0))
+            if models == other_models and np.all(np.abs(point - other_point) <= tolerance * scale):
+                other['Hits'] += 1
+                break
+        else:
+            kept.append({**solution, 'Hits': 1})
+            points.append((models, point))
+    return kept
+
+
+class MultiStartSearch(ProcessPipeline):
+    """
+    Fit a problem from sampled starting points in a process pool.
+
+    Call start(), then poll() repeatedly until finished is True, or cancel(). results and errors are keyed by
+    start index, best(k) returns the k best distinct solutions of the finished starts.
+    """
+
+    def __init__(self, problem, num_starts=32, seed=0, sampler="Sobol", method='least_squares', max_nfev=None,
+                 jacobian_mode="Analytic", max_workers=None):
+        self.problem = problem
+        self.starts = sample_starts(problem, num_starts, seed, sampler)
+        tasks = [{'Start': i, 'Problem': problem, 'Values': dict(zip(problem.param_names, values)),
+                  'Method': method, 'Max Nfev': max_nfev, 'Jacobian': jacobian_mode}
+                 for i, values in enumerate(self.starts)]
+        super().__init__(fit_start, tasks, max_workers)
+
+    @staticmethod
+    def task_key(task):
+        return task['Start']
+
+    def best(self, k=5):
+        """The k best distinct solutions, by chi²."""
+        return distinct_solutions(self.problem, self.results.values())[:k]
@@ -0,0 +1,168 @@
+import wx
+
+from Functions import apply_fit_result
+from libraries.Constraint_Graph import ConstraintCycleError
+from libraries.Fit_Executor import problem_matches
+from libraries.Fit_Problem import compile_fit_problem, PeakFitter
+from libraries.Multi_Start import SAMPLERS, MultiStartSearch
+from libraries.Save import save_state
+
+
+class MultiStartWindow(wx.Frame):
+    """
+    Multi-start search of the current sheet: local least_squares fits from starting points sampled within
+    the constraints, run in a process pool. Lists the best distinct solutions with their chi², AIC and BIC;
+    the selected one is applied to the peak table.
+    """
+
+    COLUMNS = [("Rank", 45), ("Chi²", 90), ("Red. Chi²", 75), ("AIC", 80), ("BIC", 80), ("Iterations", 65),
+               ("Starts", 50)]
+
+    def __init__(self, parent):
+        super().__init__(parent, title="Multi-Start Search", size=(520, 420),
+                         style=wx.DEFAULT_FRAME_STYLE | wx.STAY_ON_TOP)
+        self.parent = parent
+        self.search = None
+        self.solutions = []
+
+        panel = wx.Panel(self)
+        main_sizer = wx.BoxSizer(wx.VERTICAL)
+
+        settings_sizer = wx.FlexGridSizer(2, 4, 5, 5)
+        self.starts_spin = wx.SpinCtrl(panel, value=str(parent.multi_start_count), min=2, max=1024)
+        self.seed_spin = wx.SpinCtrl(panel, value=str(parent.multi_start_seed), min=0, max=2 ** 31 - 1)
+        self.sampler_combobox = wx.ComboBox(panel, choices=SAMPLERS, value=parent.multi_start_sampler,
+                                            style=wx.CB_READONLY)
+        self.best_spin = wx.SpinCtrl(panel, value=str(parent.multi_start_best), min=1, max=50)
+        for label, control in [("Starts:", self.starts_spin), ("Seed:", self.seed_spin),
+                               ("Sampler:", self.sampler_combobox), ("Best:", self.best_spin)]:
+            settings_sizer.Add(wx.StaticText(panel, label=label), 0, wx.ALIGN_CENTER_VERTICAL)
+            settings_sizer.Add(control, 0, wx.EXPAND)
+        main_sizer.Add(settings_sizer, 0, wx.ALL, 5)
+
+        self.gauge = wx.Gauge(panel, range=1)
+        main_sizer.Add(self.gauge, 0, wx.EXPAND | wx.ALL, 5)
+
+        self.solution_list = wx.ListCtrl(panel, style=wx.LC_REPORT | wx.LC_SINGLE_SEL)
+        for col, (label, width) in enumerate(self.COLUMNS):
+            self.solution_list.InsertColumn(col, label, width=width)
+        main_sizer.Add(self.solution_list, 1, wx.EXPAND | wx.ALL, 5)
+
+        button_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        self.run_button = wx.Button(panel, label="Run")
+        self.run_button.Bind(wx.EVT_BUTTON, self.on_run)
+        self.cancel_button = wx.Button(panel, label="Cancel")
+        self.cancel_button.Bind(wx.EVT_BUTTON, self.on_cancel)
+        self.cancel_button.Disable()
+        self.apply_button = wx.Button(panel, label="Apply Selected")
+        self.apply_button.Bind(wx.EVT_BUTTON, self.on_apply)
+        for button in [self.run_button, self.cancel_button, self.apply_button]:
+            button_sizer.Add(button, 0, wx.ALL, 2)
+        main_sizer.Add(button_sizer, 0, wx.ALIGN_CENTER)
+
+        panel.SetSizer(main_sizer)
+
+        # Collect the finished starts without blocking the GUI
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, lambda event: self.poll(), self.timer)
+        self.Bind(wx.EVT_CLOSE, self.on_close)
+
+    def on_run(self, event):
+        if self.search is not None and not self.search.finished:
+            return
+        sheet_name = self.parent.sheet_combobox.GetValue()
+        if not self.parent.Data['Core levels'].get(sheet_name, {}).get('Fitting', {}).get('Peaks'):
+            wx.MessageBox("No peaks to fit. Add at least one peak first.", "Error", wx.OK | wx.ICON_ERROR)
+            return
+        try:
+            problem = compile_fit_problem(self.parent.Data, sheet_name)
+        except ConstraintCycleError as e:
+            wx.MessageBox(str(e), "Constraint Error", wx.OK | wx.ICON_ERROR)
+            return
+        except ValueError as e:
+            wx.MessageBox(str(e), "Error", wx.OK | wx.ICON_ERROR)
+            return
+        if problem is None:
+            wx.MessageBox("Sheets with Unfitted or D-parameter peaks are not fitted.", "Error",
+                          wx.OK | wx.ICON_ERROR)
+            return
+
+        self.parent.multi_start_count = self.starts_spin.GetValue()
+        self.parent.multi_start_seed = self.seed_spin.GetValue()
+        self.parent.multi_start_sampler = self.sampler_combobox.GetValue()
+        self.parent.multi_start_best = self.best_spin.GetValue()
+
+        self.search = MultiStartSearch(problem, self.parent.multi_start_count, self.parent.multi_start_seed,
+                                       self.parent.multi_start_sampler, 'least_squares',
+                                       self.parent.max_iterations,
+                                       getattr(self.parent, 'jacobian_mode', "Analytic"))
+        self.solutions = []
+        self.solution_list.DeleteAllItems()
+        self.gauge.SetRange(len(self.search.tasks))
+        self.gauge.SetValue(0)
+        self.run_button.Disable()
+        self.cancel_button.Enable()
+        self.search.start()
+        self.timer.Start(200)
+
+    def poll(self):
+        if self.search is None:
+            return
+        self.search.poll(0)
+        self.gauge.SetValue(self.search.completed)
+        if self.search.finished:
+            self.timer.Stop()
+            self.run_button.Enable()
+            self.cancel_button.Disable()
+            if self.search.cancelled:
+                return
+            self.show_solutions()
+            if self.search.errors:
+                wx.MessageBox(f"{len(self.search.errors)} of {len(self.search.tasks)} starts failed, e.g.:\n"
+                              f"{next(iter(self.search.errors.values()))}", "Multi-Start Search",
+                              wx.OK | wx.ICON_WARNING)
+
+    def show_solutions(self):
+        self.solutions = self.search.best(self.parent.multi_start_best)
+        self.solution_list.DeleteAllItems()
+        for row, solution in enumerate(self.solutions):
+            self.solution_list.InsertItem(row, str(row + 1))
+            self.solution_list.SetItem(row, 1, f"{solution['Chi2']:.2f}")
+            self.solution_list.SetItem(row, 2, f"{solution['Red. Chi2']:.2f}")
+            self.solution_list.SetItem(row, 3, f"{solution['AIC']:.2f}")
+            self.solution_list.SetItem(row, 4, f"{solution['BIC']:.2f}")
+            self.solution_list.SetItem(row, 5, str(solution['Nfev']))
+            self.solution_list.SetItem(row, 6, str(solution['Hits']))
+        if self.solutions:
+            self.solution_list.Select(0)
+
+    def on_cancel(self, event):
+        if self.search is not None:
+            self.search.cancel()
+            self.poll()
+
+    def on_apply(self, event):
+        row = self.solution_list.GetFirstSelected()
+        if row < 0 or row >= len(self.solutions):
+            return
+        problem = self.search.problem
+        # Peaks added, removed or moved to another sheet since the search: the solution no longer fits the table
+        if (self.parent.sheet_combobox.GetValue() != problem.sheet_name or
+                not problem_matches(self.parent.Data, problem)):
+            wx.MessageBox("The peaks changed since the search, run it again.", "Information",
+                          wx.OK | wx.ICON_INFORMATION)
+            return
+        solution = self.solutions[row]
+        result = PeakFitter(problem).evaluate(problem.parameters(solution['Values']))
+        result.nfev = solution['Nfev']
+        r_squared, rsd, red_chi_square = apply_fit_result(self.parent, self.parent.peak_params_grid, problem, result)
+        if self.parent.fitting_window:
+            self.parent.fitting_window.update_fit_indicators(r_squared, rsd, red_chi_square)
+            self.parent.fitting_window.actual_iter_text.SetValue(str(solution['Nfev']))
+        save_state(self.parent)
+
+    def on_close(self, event):
+        self.timer.Stop()
+        if self.search is not None:
+            self.search.cancel()
+        self.Destroy()
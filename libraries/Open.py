@@ -21,6 +21,7 @@ from libraries.ConfigFile import Init_Measurement_Data, add_core_level_Data
 from libraries.Save import update_undo_redo_state, save_state
 from libraries.Sheet_Operations import on_sheet_selected
 from libraries.Grid_Operations import populate_results_grid
+from libraries.Fit_Cache import fit_cache, fit_cache_path
 
 
 class ExcelDropTarget(wx.FileDropTarget):
@@ -688,6 +689,11 @@ def open_xlsx_file(window, file_path=None):
 
             # Populate the results grid
             populate_results_grid(window)
+
+            # Stored fits of the project, reused when the same fits are requested again
+            fit_cache_file = fit_cache_path(file_path)
+            if getattr(window, 'persist_fit_cache', False) and os.path.exists(fit_cache_file):
+                fit_cache.load(fit_cache_file)
         else:
             print("No corresponding .json file found. Initializing new data.")
             # Initialize the measurement data
@@ -0,0 +1,153 @@
+# BROADCAST PEAK EVALUATOR ------------------------------------------------
+# Evaluates the sum of many peaks by grouping them by line shape and computing
+# each group as one (n_peaks x n_points) NumPy broadcast, instead of one lmfit
+# component evaluation (with its own parameter handling) per peak.
+# -------------------------------------------------------------------------
+import inspect
+
+import lmfit
+import numpy as np
+from lmfit import lineshapes
+from scipy.special import wofz
+
+from libraries.Peak_Functions import PeakFunctions
+
+SQRT2 = np.sqrt(2)
+SQRT2PI = np.sqrt(2 * np.pi)
+
+
+# Group evaluators: called with x of shape (1, n_points) and every argument as an (n_peaks, 1) column,
+# return an (n_peaks, n_points) array, or None to evaluate the peaks one by one.
+
+def _elementwise(func):
+    """PeakFunctions shapes built only from NumPy ufuncs broadcast as they are."""
+    return lambda x, **args: func(x, **args)
+
+
+def pseudo_voigt_group(x, amplitude, center, sigma, fraction):
+    """lmfit's pvoigt for columns of parameters."""
+    sigma_g = sigma / np.sqrt(2 * np.log(2))
+    gauss = np.exp(-(x - center) ** 2 / (2 * sigma_g ** 2)) / (SQRT2PI * sigma_g)
+    lorentz = 1 / (1 + ((x - center) / sigma) ** 2) / (np.pi * sigma)
+    return amplitude * ((1 - fraction) * gauss + fraction * lorentz)
+
+
+def voigt_group(x, amplitude, center, sigma, gamma=None):
+    """lmfit's voigt for columns of parameters."""
+    if gamma is None:
+        gamma = sigma
+    z = (x - center + 1j * gamma) / (sigma * SQRT2)
+    return amplitude * wofz(z).real / (sigma * SQRT2PI)
+
+
+def la_group(x, center, amplitude, fwhm, sigma, gamma):
+    """PeakFunctions.LA for columns of parameters, the unit areas are computed peak by peak."""
+    if PeakFunctions.LA_AREA_MODE == "trapz":
+        return None
+    F = 2 * fwhm / (np.sqrt(2 ** (1 / sigma) - 1) + np.sqrt(2 ** (1 / gamma) - 1))
+    x_min, x_max = np.min(x), np.max(x)
+    unit_areas = np.array([PeakFunctions.la_unit_area(x_min, x_max, c, f, s, g) for c, f, s, g in
+                           zip(center.ravel(), F.ravel(), sigma.ravel(), gamma.ravel())]).reshape(-1, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        height = np.where(unit_areas != 0, amplitude / unit_areas, 0)
+    return height * (1 + 4 * ((x - center) / F) ** 2) ** -np.where(x <= center, gamma, sigma)
+
+
+GROUP_EVALUATORS = {
+    PeakFunctions.gauss_lorentz: _elementwise(PeakFunctions.gauss_lorentz),
+    PeakFunctions.S_gauss_lorentz: _elementwise(PeakFunctions.S_gauss_lorentz),
+    PeakFunctions.gauss_lorentz_Area: _elementwise(PeakFunctions.gauss_lorentz_Area),
+    PeakFunctions.S_gauss_lorentz_Area: _elementwise(PeakFunctions.S_gauss_lorentz_Area),
+    PeakFunctions.LA: la_group,
+    lineshapes.pvoigt: pseudo_voigt_group,
+    lineshapes.voigt: voigt_group,
+}
+
+
+class PeakGroup:
+    """Peaks sharing one line shape: the function and, per argument, the parameter name of every peak."""
+
+    def __init__(self, func):
+        self.func = func
+        self.arg_names = [name for name in inspect.signature(func).parameters][1:]
+        self.param_names = {name: [] for name in self.arg_names}
+        self.defaults = {name: param.default for name, param in inspect.signature(func).parameters.items()
+                         if param.default is not inspect.Parameter.empty}
+        self.prefixes = []
+
+    def add(self, prefix):
+        self.prefixes.append(prefix)
+        for name in self.arg_names:
+            self.param_names[name].append(prefix + name)
+
+    def peak_args(self, values):
+        """{argument: array over the peaks}, arguments without a parameter take the function default."""
+        args = {}
+        for name, names in self.param_names.items():
+            peak_values = [values.get(full, self.defaults.get(name)) for full in names]
+            if all(value is None for value in peak_values):
+                continue  # optional argument (e.g. voigt gamma=None) left to the function
+            args[name] = np.array(peak_values, dtype=float)
+        return args
+
+    def evaluate(self, x, values):
+        """Profiles of all peaks of the group, shape (n_peaks, len(x))."""
+        args = self.peak_args(values)
+        evaluator = GROUP_EVALUATORS.get(self.func)
+        if evaluator is not None:
+            profiles = evaluator(x[np.newaxis, :], **{name: value[:, np.newaxis] for name, value in args.items()})
+            if profiles is not None:
+                return np.broadcast_to(profiles, (len(self.prefixes), len(x)))
+        return np.array([self.func(x, **{name: value[i] for name, value in args.items()})
+                         for i in range(len(self.prefixes))])
+
+
+class PeakSum:
+    """
+    Model function x, peak0_center, peak0_fwhm, ... -> sum of all peaks.
+
+    The signature lists every prefixed parameter, so lmfit.Model treats them as the parameters of the function.
+    """
+
+    def __init__(self, composite):
+        self.groups = {}
+        arguments = [inspect.Parameter('x', inspect.Parameter.POSITIONAL_OR_KEYWORD)]
+        for component in composite.components:
+            group = self.groups.setdefault(component.func, PeakGroup(component.func))
+            group.add(component.prefix)
+            # Every argument, including the optional ones that are not in param_names (e.g. voigt gamma)
+            arguments += [inspect.Parameter(component.prefix + name, inspect.Parameter.KEYWORD_ONLY,
+                                            default=group.defaults.get(name, inspect.Parameter.empty))
+                          for name in group.arg_names]
+        self.__name__ = 'peak_sum'
+        self.__signature__ = inspect.Signature(arguments)
+
+    def __call__(self, x, **values):
+        x = np.asarray(x, dtype=float)
+        total = np.zeros(len(x))
+        for group in self.groups.values():
+            total += np.sum(group.evaluate(x, values), axis=0)
+        return total
+
+
+class BroadcastPeakModel(lmfit.Model):
+    """
+    Drop-in replacement for a sum of peak models (model = peak0 + peak1 + ...).
+
+    Keeps the prefixed parameter names of the components, so the same lmfit.Parameters, constraint expressions
+    and result.params lookups work unchanged. Peaks are grouped by line shape and every group is evaluated as
+    one broadcast. The original composite is kept in .composite (e.g. for CompositeJacobian).
+    """
+
+    def __init__(self, composite, **kws):
+        self.composite = composite
+        super().__init__(PeakSum(composite), independent_vars=['x'], **kws)
+
+    def eval_peaks(self, params, x):
+        """Profiles of the individual peaks, {prefix: array}, like CompositeModel.eval_components."""
+        x = np.asarray(x, dtype=float)
+        values = {name: par.value for name, par in params.items()}
+        peaks = {}
+        for group in self.func.groups.values():
+            peaks.update(zip(group.prefixes, group.evaluate(x, values)))
+        return peaks
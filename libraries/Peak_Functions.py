@@ -1,18 +1,27 @@
 
 import numpy as np
-# from numba import jit, prange
-import lmfit
-from lmfit.models import VoigtModel
-from scipy.optimize import minimize_scalar, brentq
-from scipy.signal import convolve
+from libraries import Compiled_Kernels
+from scipy.signal import convolve, fftconvolve
+from scipy.fft import next_fast_len, rfft, irfft
+from functools import lru_cache
+from scipy.special import beta, betainc, hyp2f1
 from scipy.interpolate import interp1d
 from scipy.ndimage import gaussian_filter
+from libraries.Voigt_Conversions import (voigt_area_to_height, voigt_height_to_area,
+                                         pseudo_voigt_area_to_height)
 
 import numpy as np
 
 
 class PeakFunctions:
 
+    # Area normalization of the LA line shape: "finite" integrates the shape analytically over the data range,
+    # "infinite" uses the full Beta-function area, "trapz" keeps the original sampled trapz over x
+    LA_AREA_MODE = "finite"
+
+    # Grid points per data point of the LA*G convolution, see laxg_oversampling_check
+    LAXG_OVERSAMPLING = 4
+
     @staticmethod
     def gaussian_other(x, E, F, m):
         return np.exp(-4 * np.log(2) * ((x - E) / F)**2) * (1 - m / 100)
@@ -33,12 +42,16 @@ class PeakFunctions:
 
     @staticmethod
     def S_gauss_lorentz(x, center, fwhm, fraction, amplitude):
+        if Compiled_Kernels.use_compiled(x):
+            return Compiled_Kernels.s_gauss_lorentz(x, center, fwhm, fraction, amplitude)
         return amplitude * (
             (1-fraction/100) * PeakFunctions.gaussian(x, center, fwhm, 0) +
             fraction/100 * PeakFunctions.lorentzian(x, center, fwhm, 100))
 
     @staticmethod
     def gauss_lorentz(x, center , fwhm, fraction, amplitude):
+        if Compiled_Kernels.use_compiled(x):
+            return Compiled_Kernels.gauss_lorentz(x, center, fwhm, fraction, amplitude)
         peak = amplitude * (
                 PeakFunctions.gaussian(x, center, fwhm, fraction * 1) *
                 PeakFunctions.lorentzian(x, center, fwhm, fraction * 1))
@@ -105,6 +118,8 @@ class PeakFunctions:
         Returns:
         array : The y values of the Pseudo-Voigt function
         """
+        if Compiled_Kernels.use_compiled(x):
+            return Compiled_Kernels.pseudo_voigt(x, center, amplitude, sigma, fraction)
         sigma2 = sigma ** 2
         gamma = sigma * np.sqrt(2 * np.log(2))
 
@@ -236,68 +251,60 @@ class PeakFunctions:
     @staticmethod
     def get_voigt_height(amplitude, sigma, gamma):
         """
-        Calculate the height of a Voigt profile directly using the lmfit model.
+        Calculate the height of a Voigt profile from its area (lmfit amplitude), see Voigt_Conversions.
         """
-        model = lmfit.models.VoigtModel()
-        params = model.make_params(amplitude=amplitude, center=0, sigma=sigma, gamma=gamma)
-        return model.eval(params, x=0)
+        return voigt_area_to_height(amplitude, sigma, gamma)
 
     @staticmethod
     def voigt_height_to_area(height, sigma, gamma):
-        voigt = VoigtModel()
-        x = np.linspace(-10 * sigma, 10 * sigma, 1000)
-        params = voigt.make_params(center=0, sigma=sigma, gamma=gamma, amplitude=1)
-        y = voigt.eval(params, x=x)
-        max_y = np.max(y)
-        amplitude = height / max_y
-        return amplitude  # For distribution models, amplitude is equivalent to area
-
+        return voigt_height_to_area(height, sigma, gamma)  # For distribution models, amplitude is the area
 
     @staticmethod
     def get_pseudo_voigt_height(amplitude, sigma, fraction):
         """
-        Calculate the height of a Pseudo-Voigt profile directly using the lmfit model.
+        Calculate the height of a Pseudo-Voigt profile from its area (lmfit amplitude), fraction in percent.
         """
-        model = lmfit.models.PseudoVoigtModel()
-        params = model.make_params(amplitude=amplitude, center=0, sigma=sigma, fraction=fraction/100)
-        return model.eval(params, x=0)
+        return pseudo_voigt_area_to_height(amplitude, sigma, fraction)
 
     @staticmethod
-    def find_lorentzian_fwhm(true_fwhm, center, amplitude, sigma, gamma, max_iterations=50):
-        def objective(lorentzian_fwhm):
-            return abs(PeakFunctions.calculate_true_fwhm(center, amplitude, lorentzian_fwhm, sigma, gamma) - true_fwhm)
-
-        if not PeakFunctions.is_valid_scalar(true_fwhm):
-            raise ValueError(f"Invalid true_fwhm: {true_fwhm}")
+    def la_width_factor(sigma, gamma):
+        """
+        True FWHM of the LA shape per unit Lorentzian width.
 
-        try:
-            result = minimize_scalar(objective, bounds=(true_fwhm * 0.1, true_fwhm * 10), method='bounded',
-                                     options={'maxiter': max_iterations})
-            return result.x
-        except Exception as e:
-            print(f"Error in minimize_scalar: {e}")
-            return true_fwhm  # Return the input FWHM as a fallback
+        The half maximum of 1 / (1 + 4 (t / F)²)^m is reached at t = F/2 · √(2^(1/m) - 1), so the true FWHM
+        is F · (√(2^(1/σ) - 1) + √(2^(1/γ) - 1)) / 2 for any (sigma, gamma). Accepts arrays.
+        """
+        sigma, gamma = np.asarray(sigma, dtype=float), np.asarray(gamma, dtype=float)
+        return (np.sqrt(2 ** (1 / sigma) - 1) + np.sqrt(2 ** (1 / gamma) - 1)) / 2
 
     @staticmethod
-    def calculate_true_fwhm(center, amplitude, fwhm, sigma, gamma, tolerance=1e-6, max_iterations=50):
-        def la_function(x):
-            return PeakFunctions.LA(x, center, amplitude, fwhm, sigma, gamma)
+    def la_lorentzian_width(true_fwhm, sigma, gamma):
+        """Lorentzian width F of the LA shape with the given true FWHM (vectorized)."""
+        return np.asarray(true_fwhm, dtype=float) / PeakFunctions.la_width_factor(sigma, gamma)
 
-        half_max = la_function(center) / 2
+    @staticmethod
+    def la_true_fwhm(lorentzian_width, sigma, gamma):
+        """True FWHM of the LA shape with Lorentzian width F (vectorized)."""
+        return np.asarray(lorentzian_width, dtype=float) * PeakFunctions.la_width_factor(sigma, gamma)
 
-        def find_half_max(x):
-            return la_function(x) - half_max
+    @staticmethod
+    def find_lorentzian_fwhm(true_fwhm, center, amplitude, sigma, gamma, max_iterations=50):
+        """FWHM parameter of PeakFunctions.LA giving the requested true FWHM (LA takes the true FWHM)."""
+        if not PeakFunctions.is_valid_scalar(true_fwhm):
+            raise ValueError(f"Invalid true_fwhm: {true_fwhm}")
+        return PeakFunctions.calculate_true_fwhm(center, amplitude, true_fwhm, sigma, gamma)
 
-        try:
-            left_x = brentq(find_half_max, center - 10 * fwhm, center, maxiter=max_iterations, xtol=tolerance)
-            right_x = brentq(find_half_max, center, center + 10 * fwhm, maxiter=max_iterations, xtol=tolerance)
-            return right_x - left_x
-        except ValueError as e:
-            print(f"Error in calculate_true_fwhm: {e}")
-            return fwhm  # Return the input FWHM as a fallback
+    @staticmethod
+    def calculate_true_fwhm(center, amplitude, fwhm, sigma, gamma, tolerance=1e-6, max_iterations=50):
+        """Distance between the half-maximum points of PeakFunctions.LA, from their closed-form positions."""
+        F = 2 * fwhm / (np.sqrt(2 ** (1 / sigma) - 1) + np.sqrt(2 ** (1 / gamma) - 1))
+        return PeakFunctions.la_true_fwhm(F, sigma, gamma)
 
     @staticmethod
     def LA_OTHER(x, center, amplitude, true_fwhm, sigma, gamma):
+        """
+        LA shape of height amplitude parametrized by its true FWHM, cheap enough to be fitted.
+        """
         true_fwhm = min(true_fwhm, 20)  # Limit true_fwhm to a maximum of 20
 
         if not PeakFunctions.is_valid_scalar(true_fwhm):
@@ -311,40 +318,16 @@ class PeakFunctions:
         if not PeakFunctions.is_valid_scalar(gamma):
             raise ValueError(f"Invalid gamma value: {gamma}")
 
-        try:
-            lorentzian_fwhm = PeakFunctions.estimate_lorentzian_fwhm(true_fwhm, sigma, gamma)
-        except Exception as e:
-            print(f"Error in estimate_lorentzian_fwhm: {e}")
-            lorentzian_fwhm = true_fwhm  # Fallback to true_fwhm if estimation fails
+        lorentzian_fwhm = PeakFunctions.la_lorentzian_width(true_fwhm, sigma, gamma)
 
-        return amplitude * np.where(
-            x <= center,
-            1 / (1 + 4 * ((x - center) / lorentzian_fwhm) ** 2) ** gamma,
-            1 / (1 + 4 * ((x - center) / lorentzian_fwhm) ** 2) ** sigma
-        )
+        return amplitude * (1 + 4 * ((x - center) / lorentzian_fwhm) ** 2) ** -np.where(x <= center, gamma, sigma)
 
     @staticmethod
     def estimate_lorentzian_fwhm(true_fwhm, sigma, gamma, tolerance=1e-6, max_iterations=50):
-        def peak_function(x, fwhm):
-            return 1 / (1 + 4 * (x / fwhm) ** 2) ** ((sigma + gamma) / 2)
-
-        def find_half_max(fwhm):
-            half_max = peak_function(0, fwhm) / 2
-            try:
-                x_half = brentq(lambda x: peak_function(x, fwhm) - half_max, 0, fwhm * 10,
-                                xtol=tolerance, maxiter=max_iterations)
-                return 2 * x_half - true_fwhm
-            except ValueError:
-                return fwhm - true_fwhm  # Return a value that won't be zero to continue the search
-
-        try:
-            print("FWHM = "+str(true_fwhm))
-            lorentzian_fwhm = brentq(find_half_max, true_fwhm * 0.1, true_fwhm * 10,
-                                     xtol=tolerance, maxiter=max_iterations)
-            return lorentzian_fwhm
-        except ValueError:
-            print(f"Failed to estimate Lorentzian FWHM. Using true FWHM: {true_fwhm}")
-            return true_fwhm
+        """
+        Lorentzian width of the symmetric shape 1 / (1 + 4 (x / F)²)^((σ + γ) / 2) with the given true FWHM.
+        """
+        return true_fwhm / np.sqrt(2 ** (2 / (sigma + gamma)) - 1)
 
     @staticmethod
     def is_valid_scalar(value):
@@ -390,10 +373,75 @@ class PeakFunctions:
             1 / (1 + 4 * ((x - center) / F) ** 2) ** sigma
         )
 
+    @staticmethod
+    def la_side_integral(u, F, exponent):
+        """
+        Integral of the LA side shape 1 / (1 + 4 t² / F²)^exponent for t from 0 to u (u >= 0).
+
+        For exponent > 1/2 this is (F/4) · B(1/2, exponent - 1/2) · I_w(1/2, exponent - 1/2) with
+        w = 4u² / (F² + 4u²), the full Beta function when u is infinite. Otherwise the Pfaff-transformed
+        u · (1 + z)^-1/2 · 2F1(1/2, 3/2 - exponent; 3/2; z / (1 + z)), z = 4u²/F², whose argument stays in
+        [0, 1). The direct u · 2F1(1/2, exponent; 3/2; -z) overflows for large z when exponent is within
+        rounding of a half-integer.
+        """
+        if exponent > 0.5:
+            w = 1.0 if np.isinf(u) else 4 * u ** 2 / (F ** 2 + 4 * u ** 2)
+            return F / 4 * beta(0.5, exponent - 0.5) * betainc(0.5, exponent - 0.5, w)
+        if np.isinf(u):
+            return np.inf
+        z = 4 * (u / F) ** 2
+        return u / np.sqrt(1 + z) * hyp2f1(0.5, 1.5 - exponent, 1.5, z / (1 + z))
+
+    @staticmethod
+    def la_unit_area(x_min, x_max, center, F, sigma, gamma, mode=None):
+        """
+        Area of the unit-height LA shape, used to turn the LA amplitude into an area.
+
+        Args:
+            x_min (float): Low end of the x range
+            x_max (float): High end of the x range
+            center (float): Peak center
+            F (float): Lorentzian width
+            sigma (float): High binding energy side exponent
+            gamma (float): Low binding energy side exponent
+            mode (str): "finite" integrates over x_min..x_max, "infinite" over the whole axis (falls back to
+                "finite" for exponents <= 1/2, whose tails do not converge), None uses PeakFunctions.LA_AREA_MODE
+
+        Returns:
+            float: Area of the unit-height shape
+        """
+        mode = mode or PeakFunctions.LA_AREA_MODE
+        if mode == "infinite" and sigma > 0.5 and gamma > 0.5:
+            return (PeakFunctions.la_side_integral(np.inf, F, gamma) +
+                    PeakFunctions.la_side_integral(np.inf, F, sigma))
+
+        integral = PeakFunctions.la_side_integral
+        left = integral(max(center - x_min, 0), F, gamma) - integral(max(center - x_max, 0), F, gamma)
+        right = integral(max(x_max - center, 0), F, sigma) - integral(max(x_min - center, 0), F, sigma)
+        return left + right
+
     @staticmethod
     # @jit(nopython=True, parallel=True)
     def LA(x, center, amplitude, fwhm, sigma, gamma):
         #amplitude here is the area
+        if PeakFunctions.LA_AREA_MODE == "trapz":
+            return PeakFunctions.LA_trapz(x, center, amplitude, fwhm, sigma, gamma)
+
+        # Calculate lorentzian width from the input FWHM
+        F = 2 * fwhm / (np.sqrt(2 ** (1 / sigma) - 1) + np.sqrt(2 ** (1 / gamma) - 1))
+
+        # Normalize the unit shape to the requested area without sampling it
+        unit_area = PeakFunctions.la_unit_area(np.min(x), np.max(x), center, F, sigma, gamma)
+        height = amplitude / unit_area if unit_area != 0 else 0
+
+        if Compiled_Kernels.use_compiled(x):
+            return height * Compiled_Kernels.la_shape(x, center, F, sigma, gamma)
+        return height * (1 + 4 * ((x - center) / F) ** 2) ** -np.where(x <= center, gamma, sigma)
+
+    @staticmethod
+    # @jit(nopython=True, parallel=True)
+    def LA_trapz(x, center, amplitude, fwhm, sigma, gamma):
+        #amplitude here is the area
 
         # Calculate lorentzian width from the input FWHM
         F = 2 * fwhm / (np.sqrt(2 ** (1 / sigma) - 1) + np.sqrt(2 ** (1 / gamma) - 1))
@@ -419,8 +467,98 @@ class PeakFunctions:
         return height * peak_shape
 
     @staticmethod
-    # @jit(nopython=True, parallel=True)
+    @lru_cache(maxsize=32)
+    def laxg_grid(num_points, x_range, oversampling):
+        """
+        High resolution grid of the LA*G convolution, centered on the peak, and its FFT length.
+
+        Cached so that every evaluation on the same data range (every iteration of a fit) reuses it. The
+        number of points is made odd so that the peak center is on the grid and the 'same' part of the
+        convolution is not shifted by half a step.
+        """
+        grid = np.linspace(-x_range / 2, x_range / 2, num_points * oversampling | 1)
+        grid.setflags(write=False)
+        return grid, next_fast_len(2 * len(grid) - 1)
+
+    @staticmethod
+    @lru_cache(maxsize=128)
+    def laxg_gaussian_kernel(fwhm_g, num_points, x_range, oversampling):
+        """Spectrum of the unit-sum Gaussian kernel on the LA*G grid, cached by fwhm_g and grid."""
+        grid, nfft = PeakFunctions.laxg_grid(num_points, x_range, oversampling)
+        gauss = np.exp(-4 * np.log(2) * (grid / fwhm_g) ** 2)
+        kernel = rfft(gauss / np.sum(gauss), nfft)
+        kernel.setflags(write=False)
+        return kernel
+
+    @staticmethod
     def LAxG(x, center, amplitude, fwhm, sigma, gamma, fwhm_g):
+        """
+        LA line shape convolved with a Gaussian of FWHM fwhm_g, normalized to an area of amplitude.
+
+        Same grid, convolution and normalization as LAxG_OLD, but the grid and the Gaussian kernel spectrum
+        are cached and the convolution is done by FFT on an odd-sized grid. The grid has PeakFunctions.LAXG_OVERSAMPLING points
+        per data point, see laxg_oversampling_check.
+        """
+        return PeakFunctions.laxg_profile(x, center, amplitude, fwhm, sigma, gamma, fwhm_g,
+                                          PeakFunctions.LAXG_OVERSAMPLING)
+
+    @staticmethod
+    def laxg_profile(x, center, amplitude, fwhm, sigma, gamma, fwhm_g, oversampling):
+        """LAxG with an explicit oversampling factor."""
+        x = np.asarray(x, dtype=float)
+
+        # Calculate lorentzian width from the input FWHM
+        F = 2 * fwhm / (np.sqrt(2 ** (1 / sigma) - 1) + np.sqrt(2 ** (1 / gamma) - 1))
+
+        x_range = float(max(x.max() - x.min(), 4 * fwhm))
+        grid, nfft = PeakFunctions.laxg_grid(len(x), x_range, oversampling)
+        kernel = PeakFunctions.laxg_gaussian_kernel(float(fwhm_g), len(x), x_range, oversampling)
+
+        if Compiled_Kernels.use_compiled(grid):
+            la = Compiled_Kernels.la_shape(grid, 0.0, F, sigma, gamma)
+        else:
+            la = (1 + 4 * (grid / F) ** 2) ** -np.where(grid <= 0, gamma, sigma)
+        full = irfft(rfft(la, nfft) * kernel, nfft)
+        start = (len(grid) - 1) // 2  # 'same' part of the full convolution
+        convolved = full[start:start + len(grid)]
+
+        peak_shape = np.interp(x - center, grid, convolved)
+
+        # Calculate the area of unit amplitude peak, sorting only when x is not monotonic
+        dx = np.diff(x)
+        if np.all(dx > 0) or np.all(dx < 0):
+            unit_area = abs(np.trapz(peak_shape, x))
+        else:
+            sort_idx = np.argsort(x)
+            unit_area = abs(np.trapz(peak_shape[sort_idx], x[sort_idx]))
+
+        # Calculate required amplitude to achieve desired area
+        height = amplitude / unit_area if unit_area != 0 else 0
+
+        return height * peak_shape
+
+    @staticmethod
+    def laxg_oversampling_check(x, center, amplitude, fwhm, sigma, gamma, fwhm_g, factors=(2, 4, 8, 16, 32)):
+        """
+        Check that the LA*G oversampling factor is sufficient.
+
+        Args:
+            x (array): X-axis values
+            center, amplitude, fwhm, sigma, gamma, fwhm_g: LAxG parameters
+            factors (tuple): Oversampling factors to compare, the last one is the reference
+
+        Returns:
+            dict: Maximum deviation from the reference, relative to the peak height, for each factor
+        """
+        reference = PeakFunctions.laxg_profile(x, center, amplitude, fwhm, sigma, gamma, fwhm_g, factors[-1])
+        scale = np.max(np.abs(reference))
+        return {factor: np.max(np.abs(PeakFunctions.laxg_profile(x, center, amplitude, fwhm, sigma, gamma, fwhm_g,
+                                                                  factor) - reference)) / scale
+                for factor in factors[:-1]}
+
+    @staticmethod
+    # @jit(nopython=True, parallel=True)
+    def LAxG_OLD(x, center, amplitude, fwhm, sigma, gamma, fwhm_g):
         # Define the LA function
         # gaussian_fwhm =0.64 # now done through the grid
 
@@ -477,10 +615,68 @@ class PeakFunctions:
 
 
 from scipy.signal import savgol_filter
+from libraries.Background_Cache import background_cache
 
 
 class BackgroundCalculations:
 
+    TOUGAARD_METHODS = {"1x U4-Tougaard": 1, "2x U4-Tougaard": 2, "3x U4-Tougaard": 3}
+    # Region method of the Multi-Regions Smart background, which picks Shirley or Linear per region
+    AUTO_REGION_TYPE = "Multi-Regions Smart"
+    # Regions kept per sheet, the oldest are forgotten beyond this
+    MAX_BACKGROUND_REGIONS = 32
+
+    @staticmethod
+    def calculate_background(method, x, y, offset_h=0, offset_l=0, num_points=5, cross_sections=None,
+                             initial_background=None):
+        """
+        Calculate a background by method name through the shared background cache.
+
+        Args:
+            method (str): "Shirley", "Linear", "Smart", "Smart2" or "1x/2x/3x U4-Tougaard", anything else uses
+                Smart
+            x (array): X-axis values of the background range
+            y (array): Y-axis values of the background range
+            offset_h (float): High offset
+            offset_l (float): Low offset
+            num_points (int): Number of points to average for endpoints
+            cross_sections (list): Tougaard (B, C, D, T0) tuples for the U4-Tougaard methods
+            initial_background (array): Optional warm start for the Shirley iteration (Shirley and Smart only)
+
+        Returns:
+            array: Background over x
+        """
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        if method not in BackgroundCalculations.TOUGAARD_METHODS:
+            cross_sections = None
+        key = BackgroundCalculations.background_cache_key(method, x, y, offset_h, offset_l, num_points,
+                                                          cross_sections)
+
+        def compute():
+            if method == "Shirley":
+                return BackgroundCalculations.calculate_shirley_background(x, y, offset_h, offset_l,
+                                                                           num_points=num_points,
+                                                                           initial_background=initial_background)
+            elif method == "Linear":
+                return BackgroundCalculations.calculate_linear_background(x, y, offset_h, offset_l, num_points)
+            elif method in BackgroundCalculations.TOUGAARD_METHODS:
+                return BackgroundCalculations.calculate_multi_tougaard_background(x, y, cross_sections)
+            elif method == "Smart2":
+                return BackgroundCalculations.calculate_smart2_background(x, y)
+            else:
+                return BackgroundCalculations.calculate_smart_background(x, y, offset_h, offset_l, num_points,
+                                                                         initial_background)
+
+        return background_cache.get_or_compute(key, compute)
+
+    @staticmethod
+    def background_cache_key(method, x, y, offset_h=0, offset_l=0, num_points=5, cross_sections=None):
+        """Key of a calculate_background request in the shared background cache."""
+        if method not in BackgroundCalculations.TOUGAARD_METHODS:
+            cross_sections = None
+        return background_cache.make_key(x, y, method, np.min(x), np.max(x), offset_h, offset_l, num_points,
+                                         cross_sections)
+
     @staticmethod
     def calculate_endpoint_average(x_values, y_values, point, num_points):
         # Find index closest to the specified point
@@ -515,7 +711,7 @@ class BackgroundCalculations:
 
 
     @staticmethod
-    def calculate_smart_background(x, y, offset_h, offset_l, num_points=5):
+    def calculate_smart_background(x, y, offset_h, offset_l, num_points=5, initial_background=None):
         """
         Calculate a 'smart' background by choosing between Shirley and linear backgrounds.
 
@@ -524,11 +720,14 @@ class BackgroundCalculations:
             y (array): Y-axis values
             offset_h (float): High offset
             offset_l (float): Low offset
+            initial_background (array): Optional warm start for the Shirley iteration
 
         Returns:
             array: Smart background
         """
-        shirley_bg = BackgroundCalculations.calculate_shirley_background(x, y, offset_h, offset_l,num_points)
+        shirley_bg = BackgroundCalculations.calculate_shirley_background(x, y, offset_h, offset_l,
+                                                                     num_points=num_points,
+                                                                     initial_background=initial_background)
         linear_bg = BackgroundCalculations.calculate_linear_background(x, y, offset_h, offset_l,num_points)
 
         # Choose background type based on first and last y-values
@@ -538,7 +737,84 @@ class BackgroundCalculations:
         return np.minimum(background, y)
 
     @staticmethod
-    def calculate_smart2_background(x, y, threshold=0.01):
+    def calculate_smart2_background(x, y, threshold=None, window_length=None, polyorder=3, max_iter=100, tol=1e-12):
+        """
+        Calculate an improved 'smart' background using derivative analysis.
+
+        Flat regions of the smoothed derivative keep the raw data. Where the data goes down the background
+        follows it from the last point before the run, where it goes up it gets the Shirley value from the area
+        below the point (above the updated background) and the area after it (above the initial background).
+        The down runs are updated as masked segments and the areas come from cumulative sums, repeated until
+        the background stops changing, which gives the result of the per-point calculate_smart2_background_OLD.
+
+        Args:
+            x (array): X-axis values
+            y (array): Y-axis values
+            threshold (float): Derivative below which a point is flat, None for 0.1% of the data range
+            window_length (int): Savitzky-Golay window of the derivative, None for about 3% of the number of
+                points (odd)
+            polyorder (int): Savitzky-Golay polynomial order
+            max_iter (int): Maximum number of iterations
+            tol (float): Convergence tolerance, relative to the data range
+
+        Returns:
+            array: Smart2 background
+        """
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        n = len(y)
+        data_range = np.max(y) - np.min(y)
+        dy = np.gradient(y, x)
+        if threshold is None:
+            threshold = 0.001 * data_range
+
+        # Smooth the derivative, by default with an odd window adapted to the number of points
+        if window_length is None:
+            window_length = min(max(polyorder + 2, int(round(0.03 * n))), n)
+            if window_length % 2 == 0:
+                window_length -= 1
+        window_length = min(window_length, n)
+        dy_smooth = savgol_filter(dy, window_length=window_length, polyorder=polyorder) \
+            if window_length > polyorder else dy
+
+        # Set background to raw data in flat regions
+        flat_mask = np.abs(dy_smooth) < threshold
+        background = np.where(flat_mask, y, 0.0)
+
+        # For non-flat regions, decide between following the data and Shirley (the first point is never updated)
+        non_flat = ~flat_mask
+        non_flat[0] = False
+        down_mask = np.zeros(n, dtype=bool)
+        down_mask[1:] = y[1:] < y[:-1]
+        down_mask &= non_flat
+        up_index = np.flatnonzero(non_flat & ~down_mask)
+
+        # Each down run adds the cumulative sum of the data differences to the last point before the run,
+        # which telescopes to y - y[anchor]
+        anchor = np.maximum.accumulate(np.where(down_mask, 0, np.arange(n)))[down_mask]
+        down_offset = y[down_mask] - y[anchor]
+
+        # Area after every up point, above the initial background
+        dx = np.diff(x)
+        signal = y - background
+        after = np.concatenate([np.cumsum((0.5 * (signal[1:] + signal[:-1]) * dx)[::-1])[::-1], [0.0]])
+        B = after[up_index]
+
+        for _ in range(max_iter):
+            previous = background.copy()
+            # Area from the first point to every up point, the up point itself still at a zero background
+            signal = y - background
+            before = np.concatenate([[0.0], np.cumsum(0.5 * (signal[1:] + signal[:-1]) * dx)])
+            A = before[up_index - 1] + 0.5 * (signal[up_index - 1] + y[up_index]) * dx[up_index - 1]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                background[up_index] = y[-1] + (y[0] - y[-1]) * B / (A + B)
+            background[down_mask] = background[anchor] + down_offset
+            if np.max(np.abs(background - previous), initial=0.0) <= tol * data_range:
+                break
+
+        return background
+
+    @staticmethod
+    def calculate_smart2_background_OLD(x, y, threshold=0.01):
         """
         Calculate an improved 'smart' background using derivative analysis.
 
@@ -575,7 +851,8 @@ class BackgroundCalculations:
         return background
 
     @staticmethod
-    def calculate_adaptive_smart_background(x, y, x_range, previous_background, offset_h, offset_l, num_points=5):
+    def calculate_adaptive_smart_background(x, y, x_range, previous_background, offset_h, offset_l, num_points=5,
+                                            initial_background=None):
         """
         Calculate an Multi-Regions Smart background for a selected range.
 
@@ -586,6 +863,7 @@ class BackgroundCalculations:
             previous_background (array): Previous background calculation
             offset_h (float): High offset
             offset_l (float): Low offset
+            initial_background (array): Optional full-length warm start for the Shirley iteration
 
         Returns:
             array: Multi-Regions Smart background
@@ -596,18 +874,283 @@ class BackgroundCalculations:
         x_selected, y_selected = x[mask], y[mask]
 
         # Determine background type for selected range
-        if y_selected[0] > y_selected[-1]:
-            new_background[mask] = BackgroundCalculations.calculate_shirley_background(x_selected, y_selected, offset_h,
-                                                                                       offset_l, num_points)
-        else:
-            new_background[mask] = BackgroundCalculations.calculate_linear_background(x_selected, y_selected, offset_h,
-                                                                                      offset_l, num_points)
+        method = "Shirley" if y_selected[0] > y_selected[-1] else "Linear"
+        if initial_background is not None:
+            initial_background = np.asarray(initial_background)[mask]
+        new_background[mask] = BackgroundCalculations.calculate_background(method, x_selected, y_selected, offset_h,
+                                                                           offset_l, num_points,
+                                                                           initial_background=initial_background)
 
         return new_background
 
+    @staticmethod
+    def make_background_region(method, low, high, offset_h=0, offset_l=0, num_points=5, cross_sections=None):
+        """
+        Create a background region as stored in Data['Core levels'][sheet]['Background']['Regions'].
+
+        Args:
+            method (str): Background method of the region, "Auto" picks Shirley or Linear from the data
+                like Multi-Regions Smart
+            low (float): Low end of the region
+            high (float): High end of the region
+            offset_h (float): High offset
+            offset_l (float): Low offset
+            num_points (int): Number of points to average for endpoints
+            cross_sections (list): Tougaard (B, C, D, T0) tuples for the U4-Tougaard methods
+
+        Returns:
+            dict: Region settings with an empty cached result, marked dirty
+        """
+        return {
+            'Method': method,
+            'Low': float(min(low, high)),
+            'High': float(max(low, high)),
+            'Offset High': float(offset_h),
+            'Offset Low': float(offset_l),
+            'Averaging Points': int(num_points),
+            'Cross Sections': None if cross_sections is None else [list(map(float, cs)) for cs in cross_sections],
+            'Bkg Y': [],
+            'Dirty': True
+        }
+
+    @staticmethod
+    def same_region_settings(region, other):
+        """True if two regions would give the same background (cached result and dirty flag ignored)."""
+        return all(region.get(key) == other.get(key) for key in
+                   ('Method', 'Low', 'High', 'Offset High', 'Offset Low', 'Averaging Points', 'Cross Sections'))
+
+    @staticmethod
+    def find_background_region(regions, low, high, tolerance=0.0):
+        """Index of the region spanning low..high within tolerance, or None."""
+        low, high = min(low, high), max(low, high)
+        for index, region in enumerate(regions):
+            if abs(region['Low'] - low) <= tolerance and abs(region['High'] - high) <= tolerance:
+                return index
+        return None
+
+    @staticmethod
+    def region_method(bkg_type):
+        """Region method of a 'Bkg Type', "Auto" for Multi-Regions Smart."""
+        return "Auto" if bkg_type == BackgroundCalculations.AUTO_REGION_TYPE else bkg_type
+
+    @staticmethod
+    def region_bkg_type(method):
+        """'Bkg Type' of a region method, the reverse of region_method."""
+        return BackgroundCalculations.AUTO_REGION_TYPE if method == "Auto" else method
+
+    @staticmethod
+    def prune_background_regions(x, regions, max_regions=None):
+        """
+        Drop the regions that no longer show in the composite background, in place.
+
+        A region is hidden once the regions after it cover all of its points, since later regions overwrite
+        earlier ones. Beyond max_regions the oldest regions are dropped as well; their points keep their
+        current background until a rebuild from the raw data.
+
+        Args:
+            x (array): X-axis values of the whole spectrum
+            regions (list): Regions created by make_background_region
+            max_regions (int): Maximum number of regions kept, default MAX_BACKGROUND_REGIONS
+
+        Returns:
+            list: The pruned region list
+        """
+        x = np.asarray(x, dtype=float)
+        max_regions = BackgroundCalculations.MAX_BACKGROUND_REGIONS if max_regions is None else max_regions
+        covered = np.zeros(len(x), dtype=bool)
+        kept = []
+        for region in reversed(regions):
+            mask = (x >= region['Low']) & (x <= region['High'])
+            if np.any(mask & ~covered):
+                kept.append(region)
+            covered |= mask
+        regions[:] = kept[:max_regions][::-1]
+        return regions
+
+    @staticmethod
+    def clear_background_regions(x, regions, low, high):
+        """
+        Remove the range low..high from a list of regions.
+
+        Regions inside the range are dropped, regions overlapping one end are trimmed and regions spanning
+        the whole range are split in two. A trimmed piece keeps its cached result on the points it still
+        covers, so the background outside the cleared range is unchanged.
+
+        Args:
+            x (array): X-axis values of the whole spectrum
+            regions (list): Regions created by make_background_region
+            low (float): Low end of the cleared range
+            high (float): High end of the cleared range
+
+        Returns:
+            list: New list of regions
+        """
+        x = np.asarray(x, dtype=float)
+        low, high = min(low, high), max(low, high)
+        cleared = []
+        for region in regions:
+            mask = (x >= region['Low']) & (x <= region['High'])
+            if region['High'] < low or region['Low'] > high:
+                cleared.append(region)
+                continue
+            cached = len(region.get('Bkg Y', [])) == np.count_nonzero(mask) and not region.get('Dirty', True)
+            for side in (mask & (x < low), mask & (x > high)):
+                if np.count_nonzero(side) < 2:
+                    continue
+                piece = dict(region, Low=float(np.min(x[side])), High=float(np.max(x[side])))
+                if cached:
+                    piece['Bkg Y'] = np.asarray(region['Bkg Y'])[side[mask]].tolist()
+                else:
+                    piece['Bkg Y'], piece['Dirty'] = [], True
+                cleared.append(piece)
+        return cleared
+
+    @staticmethod
+    def resolve_region_method(region, y_selected):
+        """Background method used for a region, choosing Shirley or Linear for "Auto" regions."""
+        if region['Method'] == "Auto":
+            return "Shirley" if y_selected[0] > y_selected[-1] else "Linear"
+        return region['Method']
+
+    @staticmethod
+    def calculate_region_background(x, y, region, initial_background=None):
+        """
+        Calculate the background of one region and store it in the region as its cached result.
+
+        Args:
+            x (array): X-axis values of the whole spectrum
+            y (array): Y-axis values of the whole spectrum
+            region (dict): Region created by make_background_region
+            initial_background (array): Optional full-length warm start for the Shirley iteration
+
+        Returns:
+            array: Boolean mask of the points covered by the region
+        """
+        mask = (x >= region['Low']) & (x <= region['High'])
+        region['Dirty'] = False
+        if np.count_nonzero(mask) < 2:
+            region['Bkg Y'] = []
+            return mask
+
+        x_selected, y_selected = x[mask], y[mask]
+        method = BackgroundCalculations.resolve_region_method(region, y_selected)
+        if initial_background is not None:
+            initial_background = np.asarray(initial_background)[mask]
+        background = BackgroundCalculations.calculate_background(
+            method, x_selected, y_selected, region['Offset High'], region['Offset Low'],
+            region['Averaging Points'], region['Cross Sections'], initial_background)
+        region['Bkg Y'] = background.tolist()
+        return mask
+
+    @staticmethod
+    def update_region_backgrounds(x, y, regions, background=None, initial_background=None):
+        """
+        Recalculate the dirty regions and rebuild the composite background where they lie.
+
+        Regions are laid over the raw data in list order, a later region overwriting an earlier one where
+        they overlap. Only the dirty regions (or those whose cached result no longer matches the data) are
+        recalculated, and only the points they cover are rebuilt, from the cached results of every region
+        overlapping them. With background=None the whole composite is rebuilt from the raw data, which
+        replays a saved region list on any spectrum.
+
+        Args:
+            x (array): X-axis values of the whole spectrum
+            y (array): Y-axis values of the whole spectrum
+            regions (list): Regions created by make_background_region, updated in place
+            background (array): Current composite background, None to rebuild it entirely
+            initial_background (array): Optional full-length warm start for the Shirley iteration
+
+        Returns:
+            array: Composite background
+        """
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        if background is None or len(background) != len(y):
+            background = y.copy()
+            changed = np.ones(len(y), dtype=bool)
+        else:
+            background = np.array(background, dtype=float)
+            changed = np.zeros(len(y), dtype=bool)
+
+        masks = []
+        for region in regions:
+            mask = (x >= region['Low']) & (x <= region['High'])
+            if region.get('Dirty', True) or len(region.get('Bkg Y', [])) != np.count_nonzero(mask):
+                BackgroundCalculations.calculate_region_background(x, y, region, initial_background)
+                changed |= mask
+            masks.append(mask)
+
+        # Rebuild the changed points, blending the boundaries with the overlapping regions
+        background[changed] = y[changed]
+        for region, mask in zip(regions, masks):
+            overlap = mask & changed
+            if np.any(overlap) and len(region['Bkg Y']) == np.count_nonzero(mask):
+                background[overlap] = np.asarray(region['Bkg Y'])[overlap[mask]]
+        return background
+
     @staticmethod
     def calculate_shirley_background(x, y, start_offset, end_offset, max_iter=100, tol=1e-6, padding_factor=0.01,
-                                     num_points=5):
+                                     num_points=5, initial_background=None):
+        """
+        Calculate the Shirley background using cumulative integrals.
+
+        Same padding, endpoint averaging and partial areas as calculate_shirley_background_OLD, but the
+        areas on each side of every point come from one cumulative trapezoid pass per iteration, so the
+        cost is O(N) per iteration instead of O(N²).
+
+        Args:
+            x (array): X-axis values
+            y (array): Y-axis values
+            start_offset (float): Offset to add to the start point
+            end_offset (float): Offset to add to the end point
+            max_iter (int): Maximum number of iterations
+            tol (float): Tolerance for convergence
+            padding_factor (float): Factor for padding the data
+            num_points (int): Number of points to average for endpoints
+            initial_background (array): Optional starting background (e.g. the previous result while dragging
+                an offset), ignored if its length does not match y
+
+        Returns:
+            array: Shirley background
+        """
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+
+        # Add padding to the data
+        x_min, x_max = x[0], x[-1]
+        padding_width = padding_factor * (x_max - x_min)
+        x_padded = np.concatenate([[x_min - padding_width], x, [x_max + padding_width]])
+
+        # Calculate averaged endpoint values
+        y_start = BackgroundCalculations.calculate_endpoint_average(x, y, x[0], num_points) + start_offset
+        y_end = BackgroundCalculations.calculate_endpoint_average(x, y, x[-1], num_points) + end_offset
+        y_padded = np.concatenate([[y_start], y, [y_end]])
+
+        background = np.zeros_like(y_padded)
+        if initial_background is not None and len(initial_background) == len(y):
+            background[1:-1] = initial_background
+        I0, Iend = y_padded[0], y_padded[-1]
+        dx = np.diff(x_padded)
+
+        if Compiled_Kernels.use_compiled(background):
+            return Compiled_Kernels.shirley_iterations(y_padded, dx, background, max_iter, tol)[1:-1]
+
+        for _ in range(max_iter):
+            signal = y_padded - background
+            # cumulative[k] is the trapezoid area of signal[:k + 1]
+            cumulative = np.concatenate([[0.0], np.cumsum(0.5 * (signal[1:] + signal[:-1]) * dx)])
+            A1 = cumulative[:-2]  # area of signal[:i] for i = 1 .. n
+            A2 = cumulative[-1] - cumulative[1:-1]  # area of signal[i:] for i = 1 .. n
+            with np.errstate(divide='ignore', invalid='ignore'):
+                new_inner = Iend + (I0 - Iend) * A2 / (A1 + A2)
+            converged = np.all(np.abs(new_inner - background[1:-1]) < tol)
+            background[1:-1] = new_inner
+            if converged:
+                break
+
+        return background[1:-1]  # Remove padding before returning
+
+    @staticmethod
+    def calculate_shirley_background_OLD(x, y, start_offset, end_offset, max_iter=100, tol=1e-6, padding_factor=0.01,
+                                         num_points=5):
         """
         Calculate the Shirley background.
 
@@ -652,98 +1195,149 @@ class BackgroundCalculations:
 
         return background[1:-1]  # Remove padding before returning
 
-    def calculate_tougaard_background(x, y, sheet_name, window):
-        bg_data = window.Data['Core levels'][sheet_name]['Background']
-        B = bg_data.get('Tougaard_B', 2866)
-        C = bg_data.get('Tougaard_C', 1643)
-        D = bg_data.get('Tougaard_D', 1)
-        T0 = bg_data.get('Tougaard_T0', 0)
+    @staticmethod
+    def u4_tougaard_kernel(E, B, C, D):
+        """U4 Tougaard inelastic cross-section B*E / ((C - E²)² + D*E²)."""
+        return B * E / ((C - E ** 2) ** 2 + D * E ** 2)
 
-        # Get the baseline value (lowest BE intensity)
-        baseline = y[-1]  # Assuming x is in BE, so highest KE/lowest BE is at the end
+    @staticmethod
+    def get_tougaard_cross_sections(bg_data, count):
+        """
+        Read the (B, C, D, T0) cross-sections stored in a Background entry.
 
-        # Shift data to zero baseline
-        y_shifted = y  - baseline
+        Args:
+            bg_data (dict): window.Data['Core levels'][sheet_name]['Background']
+            count (int): Number of cross-sections (1, 2 or 3)
 
-        dx = np.mean(np.diff(x))
-        background = np.zeros_like(y)
-        for i in range(len(x)):
-            E = x[i:] - x[i]
-            K = B * E / ((C - E ** 2) ** 2 + D * E ** 2)
-            background[i] = np.trapz(K * y_shifted[i:], dx=dx) + T0
+        Returns:
+            list: [(B, C, D, T0), ...] using keys Tougaard_B, Tougaard_B2, Tougaard_B3, ...
+        """
+        cross_sections = []
+        for index in range(count):
+            suffix = '' if index == 0 else str(index + 1)
+            cross_sections.append((bg_data.get(f'Tougaard_B{suffix}', 2866),
+                                   bg_data.get(f'Tougaard_C{suffix}', 1643),
+                                   bg_data.get(f'Tougaard_D{suffix}', 1),
+                                   bg_data.get(f'Tougaard_T0{suffix}', 0)))
+        return cross_sections
 
-        background = background + baseline
-        return background
+    @staticmethod
+    def calculate_loss_integral(x, y, kernel, uniform_rtol=1e-3):
+        """
+        Integrate an energy-loss kernel against the spectrum for every point in O(N log N).
 
-    def calculate_double_tougaard_background(x, y, sheet_name, window):
-        bg_data = window.Data['Core levels'][sheet_name]['Background']
+        For each index i this returns trapz(kernel(x[i:] - x[i]) * y[i:], dx=mean(diff(x))), which is what the
+        Tougaard loops compute one point at a time. On a uniform grid x[j] - x[i] = (j - i) * dx, so the whole
+        array is a one-sided correlation of y with a fixed kernel and is evaluated with a single FFT convolution.
+
+        Non-uniform grids (any step deviating from the mean step by more than uniform_rtol) are resampled
+        linearly onto a uniform grid with the same end points and number of points, integrated, and
+        interpolated back. The extra error is bounded by the linear interpolation error of the spectrum,
+        h²/8 * max|y''| (h the largest step), multiplied by the integral of |kernel| over the energy range,
+        plus the same bound again for interpolating the smooth result back onto x.
+
+        Args:
+            x (array): Energy axis, monotonic
+            y (array): Intensity values
+            kernel (callable): Function of the energy-loss array E returning K(E)
+            uniform_rtol (float): Relative step tolerance below which the grid is treated as uniform
+
+        Returns:
+            array: Loss integral for every point of x
+        """
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        n = len(x)
+        if n < 2:
+            return np.zeros_like(y)
+
+        steps = np.diff(x)
+        dx = np.mean(steps)
+        uniform = np.max(np.abs(steps - dx)) <= uniform_rtol * abs(dx)
+        if uniform:
+            y_grid = y
+        else:
+            x_grid = np.linspace(x[0], x[-1], n)
+            order = np.argsort(x)
+            y_grid = np.interp(x_grid, x[order], y[order])
+
+        K = kernel(np.arange(n) * dx)
+        # S[i] = sum_{k >= 0} K[k] * y[i + k]
+        S = fftconvolve(y_grid, K[::-1])[n - 1:]
+        # Trapezoid end corrections: half weight on the first (E = 0) and last point of each integral
+        S -= 0.5 * (K[0] * y_grid + K[::-1] * y_grid[-1])
+        integral = S * dx
+
+        if not uniform:
+            order = np.argsort(x_grid)
+            integral = np.interp(x, x_grid[order], integral[order])
+        return integral
+
+    @staticmethod
+    def calculate_multi_tougaard_background(x, y, cross_sections):
+        """
+        Calculate a Tougaard background made of several U4 cross-sections in one FFT pass.
 
-        # First Tougaard parameters
-        B1 = bg_data.get('Tougaard_B', 2866)
-        C1 = bg_data.get('Tougaard_C', 1643)
-        D1 = bg_data.get('Tougaard_D', 1)
-        T01 = bg_data.get('Tougaard_T0', 0)
+        Args:
+            x (array): Binding energy values
+            y (array): Intensity values
+            cross_sections (list): [(B, C, D, T0), ...]
 
-        # Second Tougaard parameters
-        B2 = bg_data.get('Tougaard_B2', 2866)
-        C2 = bg_data.get('Tougaard_C2', 1643)
-        D2 = bg_data.get('Tougaard_D2', 1)
-        T02 = bg_data.get('Tougaard_T02', 0)
+        Returns:
+            array: Sum of the Tougaard backgrounds plus the baseline
+        """
+        y = np.asarray(y, dtype=float)
 
-        baseline = y[-1]
+        # Get the baseline value (lowest BE intensity)
+        baseline = y[-1]  # Assuming x is in BE, so highest KE/lowest BE is at the end
         y_shifted = y - baseline
 
-        dx = np.mean(np.diff(x))
-        background1 = np.zeros_like(y)
-        background2 = np.zeros_like(y)
+        def kernel(E):
+            if Compiled_Kernels.use_compiled(E):
+                return Compiled_Kernels.u4_kernel_sum(E, cross_sections)
+            return sum(BackgroundCalculations.u4_tougaard_kernel(E, B, C, D) for B, C, D, _ in cross_sections)
 
-        for i in range(len(x)):
-            E = x[i:] - x[i]
-            K1 = B1 * E / ((C1 - E ** 2) ** 2 + D1 * E ** 2)
-            K2 = B2 * E / ((C2 - E ** 2) ** 2 + D2 * E ** 2)
-            background1[i] = np.trapz(K1 * y_shifted[i:], dx=dx) + T01
-            background2[i] = np.trapz(K2 * y_shifted[i:], dx=dx) + T02
+        T0_total = sum(T0 for _, _, _, T0 in cross_sections)
+        return BackgroundCalculations.calculate_loss_integral(x, y_shifted, kernel) + T0_total + baseline
 
-        background = background1 + background2 + baseline
-        return background
+    @staticmethod
+    def calculate_tougaard_background(x, y, sheet_name, window):
+        bg_data = window.Data['Core levels'][sheet_name]['Background']
+        cross_sections = BackgroundCalculations.get_tougaard_cross_sections(bg_data, 1)
+        return BackgroundCalculations.calculate_multi_tougaard_background(x, y, cross_sections)
 
-    def calculate_triple_tougaard_background(x, y, sheet_name, window):
+    @staticmethod
+    def calculate_double_tougaard_background(x, y, sheet_name, window):
         bg_data = window.Data['Core levels'][sheet_name]['Background']
+        cross_sections = BackgroundCalculations.get_tougaard_cross_sections(bg_data, 2)
+        return BackgroundCalculations.calculate_multi_tougaard_background(x, y, cross_sections)
 
-        # Parameters for all three Tougaard backgrounds
-        B1 = bg_data.get('Tougaard_B', 2866)
-        C1 = bg_data.get('Tougaard_C', 1643)
-        D1 = bg_data.get('Tougaard_D', 1)
-        T01 = bg_data.get('Tougaard_T0', 0)
+    @staticmethod
+    def calculate_triple_tougaard_background(x, y, sheet_name, window):
+        bg_data = window.Data['Core levels'][sheet_name]['Background']
+        cross_sections = BackgroundCalculations.get_tougaard_cross_sections(bg_data, 3)
+        return BackgroundCalculations.calculate_multi_tougaard_background(x, y, cross_sections)
 
-        B2 = bg_data.get('Tougaard_B2', 2866)
-        C2 = bg_data.get('Tougaard_C2', 1643)
-        D2 = bg_data.get('Tougaard_D2', 1)
-        T02 = bg_data.get('Tougaard_T02', 0)
+    def calculate_tougaard_background_OLD(x, y, sheet_name, window):
+        bg_data = window.Data['Core levels'][sheet_name]['Background']
+        B = bg_data.get('Tougaard_B', 2866)
+        C = bg_data.get('Tougaard_C', 1643)
+        D = bg_data.get('Tougaard_D', 1)
+        T0 = bg_data.get('Tougaard_T0', 0)
 
-        B3 = bg_data.get('Tougaard_B3', 2866)
-        C3 = bg_data.get('Tougaard_C3', 1643)
-        D3 = bg_data.get('Tougaard_D3', 1)
-        T03 = bg_data.get('Tougaard_T03', 0)
+        # Get the baseline value (lowest BE intensity)
+        baseline = y[-1]  # Assuming x is in BE, so highest KE/lowest BE is at the end
 
-        baseline = y[-1]
-        y_shifted = y - baseline
+        # Shift data to zero baseline
+        y_shifted = y  - baseline
 
         dx = np.mean(np.diff(x))
-        background1 = np.zeros_like(y)
-        background2 = np.zeros_like(y)
-        background3 = np.zeros_like(y)
-
+        background = np.zeros_like(y)
         for i in range(len(x)):
             E = x[i:] - x[i]
-            K1 = B1 * E / ((C1 - E ** 2) ** 2 + D1 * E ** 2)
-            K2 = B2 * E / ((C2 - E ** 2) ** 2 + D2 * E ** 2)
-            K3 = B3 * E / ((C3 - E ** 2) ** 2 + D3 * E ** 2)
-            background1[i] = np.trapz(K1 * y_shifted[i:], dx=dx) + T01
-            background2[i] = np.trapz(K2 * y_shifted[i:], dx=dx) + T02
-            background3[i] = np.trapz(K3 * y_shifted[i:], dx=dx) + T03
-
-        background = background1 + background2 + background3 + baseline
+            K = B * E / ((C - E ** 2) ** 2 + D * E ** 2)
+            background[i] = np.trapz(K * y_shifted[i:], dx=dx) + T0
+
+        background = background + baseline
         return background
 
     @staticmethod
@@ -767,19 +1361,14 @@ class BackgroundCalculations:
         background : array-like
             Computed W Tougaard background.
         """
-        dx = np.mean(np.diff(x))  # Ensure uniform step size in x
-        background = np.zeros_like(y)
-
         # Adjust B based on endpoint intensities
         I1, I2 = y[0], y[-1]  # Intensities at the endpoints
         B_adjusted = B * (I1 / I2) if I2 != 0 else B
 
-        for i in range(len(x)):
-            E = x[i:] - x[i]  # Energy loss
-            K = B_adjusted * E / (C + E ** 2)  # Kernel computation
-            background[i] = np.trapz(K * y[i:], dx=dx) + T0
+        def kernel(E):
+            return B_adjusted * E / (C + E ** 2)
 
-        return background
+        return BackgroundCalculations.calculate_loss_integral(x, y, kernel) + T0
 
     @staticmethod
     def calculate_u_poly_tougaard_background(x, y, B=2866, C=1643, D=1, T0=0):
@@ -804,19 +1393,115 @@ class BackgroundCalculations:
         background : array-like
             Computed U Poly Tougaard background.
         """
-        dx = np.mean(np.diff(x))
-        background = np.zeros_like(y)
+        def kernel(E):
+            # Zero for energy below threshold
+            return np.where(E > T0, B * E / (C + D * E ** 2), 0)
 
-        for i in range(len(x)):
-            E = x[i:] - x[i]  # Energy loss
-            K = np.where(
-                E > T0,
-                B * E / (C + D * E ** 2),
-                0  # Zero for energy below threshold
-            )
-            background[i] = np.trapz(K * y[i:], dx=dx)
+        return BackgroundCalculations.calculate_loss_integral(x, y, kernel)
 
-        return background
+class TougaardFitModel:
+    """
+    Precomputed energy-loss basis for fitting U4 Tougaard cross-sections.
+
+    The energy-loss axis E_k = k*dx, the FFT of the baseline-shifted spectrum and the trapezoid end
+    corrections are built once per data range. On that grid every loss integral is a one-sided correlation
+    of the spectrum with a kernel sampled on E_k (see BackgroundCalculations.calculate_loss_integral), so
+    the background and each column of its analytic Jacobian cost one batched FFT instead of a Python loop
+    over every point and cross-section.
+    """
+
+    def __init__(self, x_full, y_full, fit_mask, num_tougaard, uniform_rtol=1e-3):
+        """
+        Args:
+            x_full (array): Energy axis from the background start to the end of the data
+            y_full (array): Intensity values on x_full
+            fit_mask (array): Boolean mask of the points of x_full that are fitted
+            num_tougaard (int): Number of cross-sections, parameters are named B1, C1, D1, B2, ...
+            uniform_rtol (float): Relative step tolerance below which the grid is treated as uniform
+        """
+        x_full = np.asarray(x_full, dtype=float)
+        y_full = np.asarray(y_full, dtype=float)
+        self.num_tougaard = num_tougaard
+        self.baseline = y_full[-1]
+        self.x_fit = x_full[fit_mask]
+        self.y_fit = y_full[fit_mask]
+
+        n = len(x_full)
+        steps = np.diff(x_full)
+        self.dx = np.mean(steps)
+        y_shifted = y_full - self.baseline
+
+        # Non-uniform grids are resampled onto a uniform one, results are interpolated back on the fit points
+        if np.max(np.abs(steps - self.dx)) <= uniform_rtol * abs(self.dx):
+            self.rows = np.where(fit_mask)[0]
+            self.x_grid = None
+        else:
+            self.x_grid = np.linspace(x_full[0], x_full[-1], n)
+            order = np.argsort(x_full)
+            y_shifted = np.interp(self.x_grid, x_full[order], y_shifted[order])
+            self.rows = None
+
+        self.n = n
+        self.nfft = next_fast_len(2 * n - 1)
+        self.y_shifted = y_shifted
+        self.y_spectrum = np.fft.rfft(y_shifted, self.nfft)
+        self.E = np.arange(n) * self.dx
+        self.E2 = self.E ** 2
+
+    def loss_integrals(self, kernels):
+        """
+        Integrate a stack of kernels sampled on the energy-loss axis against the spectrum.
+
+        Args:
+            kernels (array): Shape (m, n) kernel values on self.E
+
+        Returns:
+            array: Shape (m, number of fitted points)
+        """
+        kernels = np.atleast_2d(kernels)
+        n = self.n
+        S = np.fft.irfft(np.fft.rfft(kernels[:, ::-1], self.nfft, axis=1) * self.y_spectrum, self.nfft,
+                         axis=1)[:, n - 1:2 * n - 1]
+        S -= 0.5 * (kernels[:, :1] * self.y_shifted + kernels[:, ::-1] * self.y_shifted[-1])
+        integrals = S * self.dx
+        if self.x_grid is None:
+            return integrals[:, self.rows]
+        order = np.argsort(self.x_grid)
+        return np.array([np.interp(self.x_fit, self.x_grid[order], row[order]) for row in integrals])
+
+    def _cross_sections(self, params):
+        return [(params[f'B{k + 1}'].value, params[f'C{k + 1}'].value, params[f'D{k + 1}'].value)
+                for k in range(self.num_tougaard)]
+
+    def background(self, params):
+        """Background on the fitted points for the current parameter values."""
+        kernel = sum(BackgroundCalculations.u4_tougaard_kernel(self.E, B, C, D)
+                     for B, C, D in self._cross_sections(params))
+        return self.loss_integrals(kernel)[0] + self.baseline
+
+    def residual(self, params):
+        return self.y_fit - self.background(params)
+
+    def jacobian(self, params):
+        """
+        Analytic Jacobian of residual() with respect to the varying parameters, in lmfit var_names order.
+        """
+        kernels = []
+        for k, (B, C, D) in enumerate(self._cross_sections(params)):
+            diff = C - self.E2
+            denominator = diff ** 2 + D * self.E2
+            base = self.E / denominator
+            derivatives = {
+                f'B{k + 1}': base,
+                f'C{k + 1}': -2 * B * base * diff / denominator,
+                f'D{k + 1}': -B * base * self.E2 / denominator,
+            }
+            for name in (f'B{k + 1}', f'C{k + 1}', f'D{k + 1}'):
+                if params[name].vary:
+                    kernels.append(derivatives[name])
+        if not kernels:
+            return np.zeros((len(self.y_fit), 0))
+        return -self.loss_integrals(np.array(kernels)).T
 
 
 class AtomicConcentrations:
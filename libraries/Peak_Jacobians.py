@@ -0,0 +1,372 @@
+# ANALYTIC JACOBIANS ------------------------------------------------------
+# Partial derivatives of the peak shapes used by fit_peaks and the Jacobian of
+# a composite lmfit model, passed to leastsq / least_squares as Dfun / jac so
+# the solver no longer needs one model evaluation per varying parameter.
+# -------------------------------------------------------------------------
+import re
+
+import numpy as np
+from lmfit import lineshapes
+from scipy.special import wofz
+
+from libraries.Peak_Functions import PeakFunctions
+
+JACOBIAN_MODES = ["Analytic", "Finite Differences", "Cross-Check", "Sparse"]
+
+FOUR_LN2 = 4 * np.log(2)
+GL_AREA_FACTOR = 2 * np.sqrt(2 * np.log(2)) / np.sqrt(2 * np.pi)  # height = area * factor / fwhm
+SQRT2 = np.sqrt(2)
+SQRT2PI = np.sqrt(2 * np.pi)
+
+
+# PEAK SHAPE DERIVATIVES ---------------------------------------------------
+# Each function takes the same arguments as the model function and returns
+# {argument name: d(model)/d(argument)}, or None to fall back to finite differences.
+
+def gauss_lorentz_derivatives(x, center, fwhm, fraction, amplitude):
+    """Derivatives of PeakFunctions.gauss_lorentz (GL, height)."""
+    d = x - center
+    u = (d / fwhm) ** 2
+    m = fraction / 100
+    lorentz = 1 / (1 + 4 * m * u)
+    shape = np.exp(-FOUR_LN2 * (1 - m) * u) * lorentz
+    f = amplitude * shape
+    df_du = f * (-FOUR_LN2 * (1 - m) - 4 * m * lorentz)
+    return {'amplitude': shape,
+            'center': df_du * (-2 * d / fwhm ** 2),
+            'fwhm': df_du * (-2 * u / fwhm),
+            'fraction': f * u * (FOUR_LN2 - 4 * lorentz) / 100}
+
+
+def s_gauss_lorentz_derivatives(x, center, fwhm, fraction, amplitude):
+    """Derivatives of PeakFunctions.S_gauss_lorentz (SGL, height)."""
+    d = x - center
+    u = (d / fwhm) ** 2
+    m = fraction / 100
+    gauss = np.exp(-FOUR_LN2 * u)
+    lorentz = 1 / (1 + 4 * u)
+    df_du = amplitude * (-(1 - m) * FOUR_LN2 * gauss - 4 * m * lorentz ** 2)
+    return {'amplitude': (1 - m) * gauss + m * lorentz,
+            'center': df_du * (-2 * d / fwhm ** 2),
+            'fwhm': df_du * (-2 * u / fwhm),
+            'fraction': amplitude * (lorentz - gauss) / 100}
+
+
+def _area_from_height_derivatives(height_derivatives, x, center, area, fwhm, fraction):
+    """Derivatives of the area versions of GL/SGL, where height = area * GL_AREA_FACTOR / fwhm."""
+    height = area * GL_AREA_FACTOR / fwhm
+    derivs = height_derivatives(x, center, fwhm, fraction, height)
+    shape = derivs.pop('amplitude')
+    derivs['area'] = shape * GL_AREA_FACTOR / fwhm
+    derivs['fwhm'] = derivs['fwhm'] - height * shape / fwhm
+    return derivs
+
+
+def gauss_lorentz_area_derivatives(x, center, area, fwhm, fraction):
+    """Derivatives of PeakFunctions.gauss_lorentz_Area (GL, area)."""
+    return _area_from_height_derivatives(gauss_lorentz_derivatives, x, center, area, fwhm, fraction)
+
+
+def s_gauss_lorentz_area_derivatives(x, center, area, fwhm, fraction):
+    """Derivatives of PeakFunctions.S_gauss_lorentz_Area (SGL, area)."""
+    return _area_from_height_derivatives(s_gauss_lorentz_derivatives, x, center, area, fwhm, fraction)
+
+
+def pseudo_voigt_derivatives(x, amplitude, center, sigma, fraction):
+    """Derivatives of lmfit's pvoigt (PseudoVoigtModel), fraction between 0 and 1."""
+    d = x - center
+    sigma_g = sigma / np.sqrt(2 * np.log(2))
+    gauss = np.exp(-d ** 2 / (2 * sigma_g ** 2)) / (SQRT2PI * sigma_g)
+    lorentz = sigma / (np.pi * (sigma ** 2 + d ** 2))
+    return {'amplitude': (1 - fraction) * gauss + fraction * lorentz,
+            'center': amplitude * ((1 - fraction) * gauss * d / sigma_g ** 2 +
+                                   fraction * lorentz * 2 * d / (sigma ** 2 + d ** 2)),
+            'sigma': amplitude * ((1 - fraction) * gauss * (d ** 2 / sigma_g ** 2 - 1) / sigma +
+                                  fraction * lorentz * (d ** 2 - sigma ** 2) / (sigma * (sigma ** 2 + d ** 2))),
+            'fraction': amplitude * (lorentz - gauss)}
+
+
+def voigt_derivatives(x, amplitude, center, sigma, gamma=None):
+    """Derivatives of lmfit's voigt (VoigtModel), using w'(z) = -2z·w(z) + 2i/√π."""
+    if gamma is None:
+        return None
+    z = (x - center + 1j * gamma) / (sigma * SQRT2)
+    w = wofz(z)
+    dw = -2 * z * w + 2j / np.sqrt(np.pi)
+    scale = amplitude / (sigma * SQRT2PI)
+    f = scale * w.real
+    return {'amplitude': w.real / (sigma * SQRT2PI),
+            'center': scale * (dw * (-1 / (sigma * SQRT2))).real,
+            'sigma': scale * (dw * (-z / sigma)).real - f / sigma,
+            'gamma': scale * (dw * (1j / (sigma * SQRT2))).real}
+
+
+def la_derivatives(x, center, amplitude, fwhm, sigma, gamma):
+    """
+    Derivatives of PeakFunctions.LA.
+
+    The shape is differentiated analytically. The area normalization is a scalar function of (center, fwhm,
+    sigma, gamma), its logarithmic derivatives are taken by central differences, which costs a few special
+    function calls and no evaluation of the profile. The sampled "trapz" normalization falls back to finite differences.
+    """
+    if PeakFunctions.LA_AREA_MODE == "trapz":
+        return None
+
+    x_min, x_max = np.min(x), np.max(x)
+
+    def unit_area(c, w, s, g):
+        F = PeakFunctions.la_lorentzian_width(w, s, g)
+        return PeakFunctions.la_unit_area(x_min, x_max, c, F, s, g)
+
+    point = np.array([center, fwhm, sigma, gamma], dtype=float)
+    area = unit_area(*point)
+    if not area > 0:
+        return None
+    dlog_area = np.empty(4)
+    for i, scale in enumerate([fwhm, fwhm, sigma, gamma]):
+        h = 1e-6 * max(abs(scale), 1e-6)
+        plus, minus = point.copy(), point.copy()
+        plus[i] += h
+        minus[i] -= h
+        dlog_area[i] = (np.log(unit_area(*plus)) - np.log(unit_area(*minus))) / (2 * h)
+
+    r_sigma, r_gamma = np.sqrt(2 ** (1 / sigma) - 1), np.sqrt(2 ** (1 / gamma) - 1)
+    F = 2 * fwhm / (r_sigma + r_gamma)
+    dF_dsigma = F / (r_sigma + r_gamma) * 2 ** (1 / sigma) * np.log(2) / (2 * r_sigma * sigma ** 2)
+    dF_dgamma = F / (r_sigma + r_gamma) * 2 ** (1 / gamma) * np.log(2) / (2 * r_gamma * gamma ** 2)
+
+    v = (x - center) / F
+    q = 1 + 4 * v ** 2
+    left = x <= center
+    exponent = np.where(left, gamma, sigma)
+    shape = q ** -exponent
+    f = amplitude / area * shape
+    dlog_shape_dF = 8 * exponent * v ** 2 / (F * q)
+    log_q = np.log(q)
+
+    return {'amplitude': shape / area,
+            'center': f * (8 * exponent * v / (F * q) - dlog_area[0]),
+            'fwhm': f * (dlog_shape_dF * F / fwhm - dlog_area[1]),
+            'sigma': f * (dlog_shape_dF * dF_dsigma - np.where(left, 0, log_q) - dlog_area[2]),
+            'gamma': f * (dlog_shape_dF * dF_dgamma - np.where(left, log_q, 0) - dlog_area[3])}
+
+
+PEAK_DERIVATIVES = {
+    PeakFunctions.gauss_lorentz: gauss_lorentz_derivatives,
+    PeakFunctions.S_gauss_lorentz: s_gauss_lorentz_derivatives,
+    PeakFunctions.gauss_lorentz_Area: gauss_lorentz_area_derivatives,
+    PeakFunctions.S_gauss_lorentz_Area: s_gauss_lorentz_area_derivatives,
+    PeakFunctions.LA: la_derivatives,
+    lineshapes.pvoigt: pseudo_voigt_derivatives,
+    lineshapes.voigt: voigt_derivatives,
+}
+
+
+def has_analytic_derivatives(model):
+    """True if every component of a (composite) lmfit model has analytic derivatives in PEAK_DERIVATIVES."""
+    return all(component.func in PEAK_DERIVATIVES for component in model.components)
+
+
+def numeric_derivatives(func, x, args, names):
+    """Forward-difference derivatives of one component with respect to the arguments in names."""
+    f0 = func(x, **args)
+    derivs = {}
+    for name in names:
+        value = args[name]
+        h = np.sqrt(np.finfo(float).eps) * max(abs(value), 1e-3)
+        derivs[name] = (func(x, **{**args, name: value + h}) - f0) / h
+    return derivs
+
+
+# COMPOSITE JACOBIAN -------------------------------------------------------
+
+_NAME_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+
+def _expression_order(params, names):
+    """Constraint-expression parameters needed by names, dependencies first, with the variables they use."""
+    order, variables, seen = [], {}, set()
+
+    def visit(name):
+        if name in seen or name not in params:
+            return
+        seen.add(name)
+        par = params[name]
+        if par.expr:
+            used = set()
+            for token in _NAME_PATTERN.findall(par.expr):
+                if token in params and token != name:
+                    visit(token)
+                    used |= variables.get(token, {token} if params[token].vary and not params[token].expr
+                                           else set())
+            variables[name] = used
+            order.append(name)
+
+    for name in names:
+        visit(name)
+    return order, variables
+
+
+def expression_variables(params, names):
+    """
+    Varying parameters each parameter in names depends on: itself when it is varied, the variables of its
+    constraint expression otherwise.
+
+    Returns:
+        dict: {name: set of variable names}
+    """
+    _, variables = _expression_order(params, names)
+    return {name: variables.get(name, {name} if params[name].vary and not params[name].expr else set())
+            for name in names}
+
+
+def expression_gradients(params, names, var_names):
+    """
+    d(parameter)/d(variable) for the constraint-expression parameters in names (e.g. amplitude = area).
+
+    Expressions are scalar and cheap, so they are differentiated by central differences on the variables
+    they depend on; only the needed expressions are re-evaluated.
+
+    Returns:
+        dict: {expression parameter: {variable: derivative}}
+    """
+    order, variables = _expression_order(params, names)
+    if not order:
+        return {}
+    gradients = {name: {} for name in order}
+    for var in sorted(set().union(*variables.values()) & set(var_names)):
+        par = params[var]
+        value = par.value
+        h = 1e-7 * max(abs(value), 1e-3)
+        plus, minus = min(value + h, par.max), max(value - h, par.min)
+        results = []
+        for trial in (plus, minus):
+            par.value = trial
+            results.append({name: params[name].value for name in order})
+        par.value = value
+        for name in order:
+            if var in variables[name]:
+                gradients[name][var] = (results[0][name] - results[1][name]) / (plus - minus)
+    for name in order:  # restore the expression values in the symbol table
+        params[name].value
+    return gradients
+
+
+# Shapes whose value at a point depends only on that point, so they can be evaluated on part of x
+# (the LA shapes are normalized over the whole range)
+LOCAL_SHAPES = {
+    PeakFunctions.gauss_lorentz,
+    PeakFunctions.S_gauss_lorentz,
+    PeakFunctions.gauss_lorentz_Area,
+    PeakFunctions.S_gauss_lorentz_Area,
+    lineshapes.pvoigt,
+    lineshapes.voigt,
+}
+
+
+class CompositeJacobian:
+    """
+    Jacobian of the residual (data - model) * weights of a composite lmfit model.
+
+    Pass an instance as fit_kws={'Dfun': ...}: lmfit calls it with the current parameters and maps the
+    columns back to its internal variables. Components without analytic derivatives (LA*G, skewed Voigt,
+    exponential Gaussian) are differentiated by forward differences on that component alone.
+    With supports (one slice of x per component), the components with a LOCAL_SHAPES function are only
+    differentiated within their slice and their derivatives are taken as zero outside it.
+    """
+
+    def __init__(self, model, supports=None):
+        self.components = model.components
+        self.supports = supports
+
+    def model_jacobian(self, params, x):
+        """d(model)/d(variable) as an array of shape (len(x), number of varying parameters)."""
+        var_names = [name for name, par in params.items() if par.vary and not par.expr]
+        columns = {name: i for i, name in enumerate(var_names)}
+        jacobian = np.zeros((len(x), len(var_names)))
+
+        component_args = []
+        needed = set()
+        for component in self.components:
+            args = component.make_funcargs(params, {'x': x})
+            args.pop('x')
+            component_args.append(args)
+            needed |= {component.prefix + name for name in args}
+        gradients = expression_gradients(params, needed, var_names)
+
+        for i, (component, args) in enumerate(zip(self.components, component_args)):
+            free = [name for name in args if component.prefix + name in columns or
+                    gradients.get(component.prefix + name)]
+            if not free:
+                continue
+            rows = slice(None)
+            if self.supports is not None and component.func in LOCAL_SHAPES:
+                rows = self.supports[i]
+            x_rows = x[rows]
+            derivative_func = PEAK_DERIVATIVES.get(component.func)
+            derivs = derivative_func(x_rows, **args) if derivative_func else None
+            if derivs is None:
+                derivs = numeric_derivatives(component.func, x_rows, args, free)
+            for name in free:
+                full_name = component.prefix + name
+                if full_name in columns:
+                    jacobian[rows, columns[full_name]] += derivs[name]
+                else:
+                    for var, gradient in gradients[full_name].items():
+                        jacobian[rows, columns[var]] += derivs[name] * gradient
+        return jacobian
+
+    def __call__(self, params, data, weights=None, x=None, **kwargs):
+        jacobian = -self.model_jacobian(params, np.asarray(x, dtype=float))
+        if weights is not None:
+            jacobian *= np.asarray(weights, dtype=float)[:, np.newaxis]
+        return jacobian
+
+
+def check_jacobian(model, params, x, rel_step=1e-7):
+    """
+    Compare the analytic model Jacobian with central differences of the full model.
+
+    Args:
+        model: lmfit (composite) model
+        params (lmfit.Parameters): Parameters at which to compare
+        x (array): Independent variable
+        rel_step (float): Relative step of the finite differences
+
+    Returns:
+        dict: {variable: max |analytic - numeric| / max |numeric|}
+    """
+    x = np.asarray(x, dtype=float)
+    params = params.copy()
+    params.update_constraints()
+    analytic = CompositeJacobian(model).model_jacobian(params, x)
+    var_names = [name for name, par in params.items() if par.vary and not par.expr]
+
+    report = {}
+    for i, name in enumerate(var_names):
+        par = params[name]
+        value = par.value
+        h = rel_step * max(abs(value), 1e-3)
+        plus, minus = min(value + h, par.max), max(value - h, par.min)
+        evaluations = []
+        for trial in (plus, minus):
+            par.value = trial
+            params.update_constraints()
+            evaluations.append(model.eval(params, x=x))
+        par.value = value
+        params.update_constraints()
+        numeric = (evaluations[0] - evaluations[1]) / (plus - minus)
+        scale = np.max(np.abs(numeric))
+        report[name] = float(np.max(np.abs(analytic[:, i] - numeric)) / scale) if scale > 0 else \
+            float(np.max(np.abs(analytic[:, i])))
+    return report
+
+
+def format_jacobian_check(report):
+    """Text of a check_jacobian report, one variable per line and the worst one last."""
+    lines = ["Jacobian cross-check (max relative deviation from finite differences):"]
+    lines += [f"  {name}: {deviation:.2e}" for name, deviation in report.items()]
+    if report:
+        worst = max(report, key=report.get)
+        lines.append(f"  worst: {worst} ({report[worst]:.2e})")
+    return "\n".join(lines)
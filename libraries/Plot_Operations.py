@@ -2,6 +2,7 @@
 
 import re
 import wx
+import copy
 import os
 import lmfit
 import numpy as np
@@ -15,6 +16,7 @@ import matplotlib.colors as mcolors
 from scipy.ndimage import gaussian_filter
 
 from libraries.Peak_Functions import PeakFunctions, BackgroundCalculations, OtherCalc
+from libraries.Voigt_Conversions import voigt_height_to_area, pseudo_voigt_height_to_area
 
 from libraries.Save import save_state
 
@@ -33,6 +35,11 @@ class PlotManager:
         self.residuals_subplot = None  # Add this line
         self.residuals_visible = True  # Keep existing
 
+        # Interactive background editing (shift-drag of the offsets)
+        self._drag_line = None
+        self._drag_blit_background = None
+        self._drag_background = None
+
         # init for preference window
         self.plot_style = "scatter"
         self.scatter_size = 20
@@ -195,7 +202,7 @@ class PlotManager:
             peak_model = lmfit.models.VoigtModel()
             sigma = float(peak_params.get('sigma', 1.2)) / 2.355
             gamma = float(peak_params.get('gamma', 0.06)) / 2
-            amplitude = y / peak_model.eval(center=0, amplitude=1, sigma=sigma, gamma=gamma, x=0)
+            amplitude = voigt_height_to_area(y, sigma, gamma)
             params = peak_model.make_params(center=x, amplitude=amplitude, sigma=sigma, gamma=gamma)
         elif fitting_model == "ExpGauss.(Area, \u03c3, \u03b3)":
             peak_model = lmfit.models.ExponentialGaussianModel()
@@ -218,7 +225,7 @@ class PlotManager:
         elif fitting_model == "Pseudo-Voigt (Area)":
             sigma = fwhm / 2
             peak_model = lmfit.models.PseudoVoigtModel()
-            amplitude = y / peak_model.eval(center=0, amplitude=1, sigma=sigma, fraction=lg_ratio / 100, x=0)
+            amplitude = pseudo_voigt_height_to_area(y, sigma, lg_ratio)
             params = peak_model.make_params(center=x, amplitude=amplitude, sigma=sigma, fraction=lg_ratio / 100)
         elif fitting_model in ["LA (Area, \u03c3, \u03b3)", "LA (Area, \u03c3/\u03b3, \u03b3)"]:
             peak_model = lmfit.Model(PeakFunctions.LA)
@@ -964,7 +971,7 @@ class PlotManager:
             # Create the selected peak using updated position and height
             if window.selected_fitting_method in ["Voigt (Area, L/G, \u03c3)", "Voigt (Area, \u03c3, \u03b3)"]:
                 peak_model = lmfit.models.VoigtModel()
-                amplitude = y / peak_model.eval(center=0, amplitude=1, sigma=sigma, gamma=gamma, x=0)
+                amplitude = voigt_height_to_area(y, sigma, gamma)
                 params = peak_model.make_params(center=x, amplitude=amplitude, sigma=sigma, gamma=gamma)
             elif window.selected_fitting_method in ["ExpGauss.(Area, \u03c3, \u03b3)"]:
                 peak_model = lmfit.models.VoigtModel()
@@ -973,8 +980,8 @@ class PlotManager:
                 params = peak_model.make_params(center=x, amplitude=amplitude, sigma=sigma, gamma=gamma)
             elif window.selected_fitting_method == "Pseudo-Voigt (Area)":
                 peak_model = lmfit.models.PseudoVoigtModel()
-                amplitude = y / peak_model.eval(center=0, amplitude=1, sigma=sigma, fraction=lg_ratio, x=0)
-                params = peak_model.make_params(center=x, amplitude=amplitude, sigma=sigma, fraction=lg_ratio)
+                amplitude = pseudo_voigt_height_to_area(y, sigma, lg_ratio)
+                params = peak_model.make_params(center=x, amplitude=amplitude, sigma=sigma, fraction=lg_ratio / 100)
             elif window.selected_fitting_method in ["LA (Area, \u03c3, \u03b3)", "LA (Area, \u03c3/\u03b3, \u03b3)"]:
                 peak_model = lmfit.Model(PeakFunctions.LA)
                 sigma = float(window.peak_params_grid.GetCellValue(row, 7))
@@ -1100,7 +1107,7 @@ class PlotManager:
                 peak_model = lmfit.models.VoigtModel()
                 sigma = float(window.peak_params_grid.GetCellValue(row, 7)) / 2.355
                 gamma = float(window.peak_params_grid.GetCellValue(row, 8)) / 2
-                amplitude = peak_y / peak_model.eval(center=0, amplitude=1, sigma=sigma, gamma=gamma, x=0)
+                amplitude = voigt_height_to_area(peak_y, sigma, gamma)
                 params = peak_model.make_params(center=peak_x, amplitude=amplitude, sigma=sigma, gamma=gamma)
             elif fitting_model == "ExpGauss.(Area, \u03c3, \u03b3)":
                 peak_model = lmfit.models.ExponentialGaussianModel()
@@ -1112,7 +1119,7 @@ class PlotManager:
             elif fitting_model == "Pseudo-Voigt (Area)":
                 sigma = fwhm / 2
                 peak_model = lmfit.models.PseudoVoigtModel()
-                amplitude = peak_y / peak_model.eval(center=0, amplitude=1, sigma=sigma, fraction=lg_ratio / 100, x=0)
+                amplitude = pseudo_voigt_height_to_area(peak_y, sigma, lg_ratio)
                 params = peak_model.make_params(center=peak_x, amplitude=amplitude, sigma=sigma,
                                                 fraction=lg_ratio / 100)
             elif fitting_model in ["LA (Area, \u03c3, \u03b3)", "LA (Area, \u03c3/\u03b3, \u03b3)"]:
@@ -1735,7 +1742,80 @@ class PlotManager:
             traceback.print_exc()
             wx.MessageBox(str(e), "Error", wx.OK | wx.ICON_ERROR)
 
-    def _calculate_adaptive_smart_background(self, window, x_values, y_values, offset_h, offset_l):
+    def start_background_drag(self, window):
+        """
+        Enter the interactive background-editing mode used while shift-dragging an offset.
+
+        The background line is made animated and the rest of the axes is saved once, so that each
+        preview only has to restore that image and redraw the background line (blitting).
+
+        Args:
+            window: The main application window.
+
+        Returns:
+            bool: True if a background line is available for interactive editing.
+        """
+        lines = [line for line in self.ax.lines if line.get_label().startswith("Background")]
+        if not lines:
+            return False
+        self._drag_line = lines[0]
+        self._drag_background = np.asarray(window.background, dtype=float).copy()
+        self._drag_line.set_animated(True)
+        self.canvas.draw()
+        self._drag_blit_background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.ax.draw_artist(self._drag_line)
+        self.canvas.blit(self.ax.bbox)
+        return True
+
+    def update_background_drag(self, window):
+        """
+        Recompute the background with the current offsets and redraw only the background line.
+
+        The previous preview is used as a warm start for the Shirley iteration. Nothing is written to
+        window.Data, the full update is done by end_background_drag.
+
+        Args:
+            window: The main application window.
+        """
+        if self._drag_line is None:
+            return
+        sheet_name = window.sheet_combobox.GetValue()
+        x_values = np.array(window.Data['Core levels'][sheet_name]['B.E.'], dtype=float)
+        y_values = np.array(window.Data['Core levels'][sheet_name]['Raw Data'], dtype=float)
+        method = getattr(window, 'background_method', "Multi-Regions Smart")
+        try:
+            offset_h = float(window.offset_h)
+            offset_l = float(window.offset_l)
+        except (AttributeError, ValueError):
+            return
+
+        initial_background = self._drag_background if len(self._drag_background) == len(x_values) else None
+        if method == "Multi-Regions Smart":
+            background, _ = self._calculate_adaptive_smart_background(window, x_values, y_values, offset_h, offset_l,
+                                                                      initial_background, preview=True)
+        else:
+            background, _ = self._calculate_other_background(window, x_values, y_values, method, offset_h, offset_l,
+                                                             initial_background, preview=True)
+        if background is None:
+            return
+        self._drag_background = background
+
+        self._drag_line.set_ydata(background)
+        self.canvas.restore_region(self._drag_blit_background)
+        self.ax.draw_artist(self._drag_line)
+        self.canvas.blit(self.ax.bbox)
+
+    def end_background_drag(self, window):
+        """Leave the interactive background-editing mode and run the full background update."""
+        if self._drag_line is not None:
+            self._drag_line.set_animated(False)
+        self._drag_line = None
+        self._drag_blit_background = None
+        self._drag_background = None
+        self.plot_background(window)
+
+    def _calculate_adaptive_smart_background(self, window, x_values, y_values, offset_h, offset_l,
+                                             initial_background=None, preview=False):
         """Helper method to calculate Multi-Regions Smart background."""
         sheet_name = window.sheet_combobox.GetValue()  # Get the current sheet name
         bg_min_energy, bg_max_energy = min(x_values), max(x_values)
@@ -1749,13 +1829,23 @@ class PlotManager:
         else:
             adaptive_range = (bg_min_energy, bg_max_energy)
 
-        current_background = np.array(window.Data['Core levels'][sheet_name]['Background']['Bkg Y'])
-        background_filtered = BackgroundCalculations.calculate_adaptive_smart_background(
-            x_values, y_values, adaptive_range, current_background, offset_h, offset_l
-        )
+        # Shirley or Linear is chosen per region from the data, like calculate_adaptive_smart_background
+        region = BackgroundCalculations.make_background_region("Auto", adaptive_range[0], adaptive_range[1],
+                                                               offset_h, offset_l, self._get_averaging_points(window))
+        background_filtered = self._calculate_region_background(window, x_values, y_values, region,
+                                                                initial_background, preview)
         return background_filtered, 'Background (Multi-Regions Smart)'
 
-    def _calculate_other_background(self, window, x_values, y_values, method, offset_h, offset_l):
+    @staticmethod
+    def _get_averaging_points(window):
+        """Number of points averaged at the background endpoints, as set in the Background tab."""
+        try:
+            return max(1, int(window.averaging_points))
+        except (AttributeError, ValueError, TypeError):
+            return 5
+
+    def _calculate_other_background(self, window, x_values, y_values, method, offset_h, offset_l,
+                                    initial_background=None, preview=False):
         """Helper method to calculate background for non-Multi-Regions Smart methods."""
         sheet_name = window.sheet_combobox.GetValue()
         bg_min_energy = window.Data['Core levels'][sheet_name]['Background'].get('Bkg Low')
@@ -1765,55 +1855,89 @@ class PlotManager:
             wx.MessageBox("Invalid energy range selected.", "Warning", wx.OK | wx.ICON_INFORMATION)
             return None, None
 
-        mask = (x_values >= bg_min_energy) & (x_values <= bg_max_energy)
-        x_values_filtered = x_values[mask]
-        y_values_filtered = y_values[mask]
-
-        if method == "Shirley":
-            background_filtered = BackgroundCalculations.calculate_shirley_background(x_values_filtered,
-                                                                                      y_values_filtered, offset_h,
-                                                                                      offset_l)
-            label = 'Background (Shirley)'
-        elif method == "Linear":
-            background_filtered = BackgroundCalculations.calculate_linear_background(x_values_filtered,
-                                                                                     y_values_filtered, offset_h,
-                                                                                     offset_l)
-            label = 'Background (Linear)'
-        elif method in ["Smart", "Multi-Regions Smart", "Multiple Regions Smart"]:
-            background_filtered = BackgroundCalculations.calculate_smart_background(x_values_filtered,
-                                                                                    y_values_filtered, offset_h,
-                                                                                    offset_l)
-            label = 'Background (Smart)'
-
-        elif method == "1x U4-Tougaard":
-            background_filtered = BackgroundCalculations.calculate_tougaard_background(x_values_filtered,
-                                                                                       y_values_filtered,
-                                                                                       sheet_name,
-                                                                                       window)
-            label = 'Background (Tougaard)'
-        elif method == "2x U4-Tougaard":
-            background_filtered = BackgroundCalculations.calculate_double_tougaard_background(x_values_filtered,
-                                                                                       y_values_filtered,
-                                                                                       sheet_name,
-                                                                                       window)
-            label = 'Background (Tougaard)'
-        elif method == "3x U4-Tougaard":
-            background_filtered = BackgroundCalculations.calculate_triple_tougaard_background(x_values_filtered,
-                                                                                       y_values_filtered,
-                                                                                       sheet_name,
-                                                                                       window)
+        # Every method goes through the shared background cache
+        cross_sections = None
+        if method in BackgroundCalculations.TOUGAARD_METHODS:
+            bg_data = window.Data['Core levels'][sheet_name]['Background']
+            cross_sections = BackgroundCalculations.get_tougaard_cross_sections(
+                bg_data, BackgroundCalculations.TOUGAARD_METHODS[method])
+
+        region = BackgroundCalculations.make_background_region(method, bg_min_energy, bg_max_energy, offset_h,
+                                                               offset_l, self._get_averaging_points(window),
+                                                               cross_sections)
+        new_background = self._calculate_region_background(window, x_values, y_values, region, initial_background,
+                                                           preview)
+        if method in ["Shirley", "Linear", "Smart2"]:
+            label = f'Background ({method})'
+        elif method in BackgroundCalculations.TOUGAARD_METHODS:
             label = 'Background (Tougaard)'
         else:
-            background_filtered = BackgroundCalculations.calculate_smart_background(x_values_filtered,
-                                                                                    y_values_filtered, offset_h,
-                                                                                    offset_l)
             label = 'Background (Smart)'
-            # raise ValueError(f"Unknown background method: {method}")
-
-        new_background = np.array(window.Data['Core levels'][sheet_name]['Background']['Bkg Y'])
-        new_background[mask] = background_filtered
         return new_background, label
 
+    def _calculate_region_background(self, window, x_values, y_values, region, initial_background=None,
+                                     preview=False):
+        """
+        Add a background region to the current sheet, or update the region with the same range, and
+        recalculate only that region and the points it covers.
+
+        Args:
+            window: The main application window.
+            x_values (array): X-axis values of the sheet
+            y_values (array): Y-axis values of the sheet
+            region (dict): Region created by BackgroundCalculations.make_background_region
+            initial_background (array): Optional warm start for the Shirley iteration
+            preview (bool): Work on a copy of the region list and leave window.Data untouched
+
+        Returns:
+            array: Composite background of the sheet
+        """
+        sheet_name = window.sheet_combobox.GetValue()
+        bg_data = window.Data['Core levels'][sheet_name]['Background']
+        regions = bg_data.setdefault('Regions', [])
+        if preview:
+            regions = copy.deepcopy(regions)
+
+        # Regions are matched by range, to within half a data step
+        tolerance = 0.5 * np.min(np.abs(np.diff(x_values))) if len(x_values) > 1 else 0.0
+        index = BackgroundCalculations.find_background_region(regions, region['Low'], region['High'], tolerance)
+        if index is None:
+            regions.append(region)
+            BackgroundCalculations.prune_background_regions(x_values, regions)
+        elif not BackgroundCalculations.same_region_settings(regions[index], region):
+            region['Low'], region['High'] = regions[index]['Low'], regions[index]['High']
+            regions[index] = region
+
+        current_background = np.array(bg_data['Bkg Y'], dtype=float)
+        return BackgroundCalculations.update_region_backgrounds(x_values, y_values, regions, current_background,
+                                                                initial_background)
+
+    def apply_background_regions(self, window, regions, sheet_names):
+        """
+        Replay a list of background regions on other sheets, rebuilding their backgrounds from the raw data.
+
+        Args:
+            window: The main application window.
+            regions (list): Regions to apply, typically Data['Core levels'][sheet]['Background']['Regions']
+            sheet_names (list): Names of the sheets to apply the regions to
+        """
+        for sheet_name in sheet_names:
+            core_level_data = window.Data['Core levels'][sheet_name]
+            x_values = np.array(core_level_data['B.E.'], dtype=float)
+            y_values = np.array(core_level_data['Raw Data'], dtype=float)
+
+            sheet_regions = copy.deepcopy(regions)
+            for region in sheet_regions:
+                region['Dirty'] = True
+            background = BackgroundCalculations.update_region_backgrounds(x_values, y_values, sheet_regions)
+
+            core_level_data.setdefault('Background', {}).update({
+                'Regions': sheet_regions,
+                'Bkg Y': background.tolist(),
+                'Bkg X': x_values.tolist(),
+                'Bkg Type': BackgroundCalculations.region_bkg_type(sheet_regions[-1]['Method']) if sheet_regions else ''
+            })
+
     def _update_background_data(self, window, sheet_name, x_values, background, method, offset_h, offset_l):
         """Helper method to update the background data in window.Data."""
         window.Data['Core levels'][sheet_name]['Background']['Bkg Y'] = background.tolist()
@@ -1875,7 +1999,8 @@ class PlotManager:
                 'Bkg Low': '',
                 'Bkg High': '',
                 'Bkg Offset Low': '',
-                'Bkg Offset High': ''
+                'Bkg Offset High': '',
+                'Regions': []
             })
 
             # Set plot limits and formatting
@@ -1933,7 +2058,8 @@ class PlotManager:
                 'Bkg Low': '',
                 'Bkg High': '',
                 'Bkg Offset Low': '',
-                'Bkg Offset High': ''
+                'Bkg Offset High': '',
+                'Regions': []
             })
 
             # Reset vlines
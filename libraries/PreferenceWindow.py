@@ -2,6 +2,8 @@ import wx
 import json
 import os
 import openpyxl
+from libraries import Compiled_Kernels
+from libraries.Peak_Jacobians import JACOBIAN_MODES
 
 
 class PreferenceWindow(wx.Frame):
@@ -26,12 +28,14 @@ class PreferenceWindow(wx.Frame):
         self.text_tab = wx.Panel(self.notebook)
         self.save_tab = wx.Panel(self.notebook)
         self.instrument_tab = wx.Panel(self.notebook)
+        self.computation_tab = wx.Panel(self.notebook)
 
         # Add tabs to notebook
         self.notebook.AddPage(self.plot_tab, "Plot Settings")
         self.notebook.AddPage(self.text_tab, "Text/Axis Settings")
         self.notebook.AddPage(self.save_tab, "Save Settings")
         self.notebook.AddPage(self.instrument_tab, "Instrument Settings")
+        self.notebook.AddPage(self.computation_tab, "Computation")
 
         # Add notebook to sizer
         main_sizer.Add(self.notebook, 1, wx.EXPAND | wx.ALL, 5)
@@ -60,6 +64,7 @@ class PreferenceWindow(wx.Frame):
         self.init_instrument_tab()
         self.init_text_tab()
         self.init_save_settings_tab()
+        self.init_computation_tab()
         self.LoadSettings()
 
     def init_text_tab(self):
@@ -269,6 +274,77 @@ class PreferenceWindow(wx.Frame):
         self.save_tab.SetSizer(save_sizer)
 
 
+    def init_computation_tab(self):
+        computation_sizer = wx.BoxSizer(wx.VERTICAL)
+
+        kernel_box = wx.StaticBox(self.computation_tab, label="Line Shape Kernels")
+        kernel_sizer = wx.StaticBoxSizer(kernel_box, wx.VERTICAL)
+        kernel_grid = wx.GridBagSizer(5, 5)
+
+        kernel_grid.Add(wx.StaticText(self.computation_tab, label="Backend:"), pos=(0, 0),
+                        flag=wx.ALIGN_CENTER_VERTICAL)
+        self.kernel_backend_combo = wx.ComboBox(self.computation_tab, choices=Compiled_Kernels.BACKENDS,
+                                                style=wx.CB_READONLY)
+        self.kernel_backend_combo.SetMinSize((150, -1))
+        self.kernel_backend_combo.SetToolTip("Numba compiles the GL, SGL, LA, LA*G and Pseudo-Voigt line shapes "
+                                             "and the Shirley/Tougaard integrals. Results are identical to NumPy.")
+        kernel_grid.Add(self.kernel_backend_combo, pos=(0, 1))
+
+        self_test_btn = wx.Button(self.computation_tab, label="Self-Test")
+        self_test_btn.SetToolTip("Compare the NumPy and compiled kernels on a synthetic spectrum")
+        self_test_btn.SetMinSize((110, -1))
+        self_test_btn.Bind(wx.EVT_BUTTON, self.on_kernel_self_test)
+        kernel_grid.Add(self_test_btn, pos=(0, 2))
+
+        status = "Numba is installed." if Compiled_Kernels.NUMBA_AVAILABLE else \
+            "Numba is not installed, the NumPy kernels are used."
+        kernel_grid.Add(wx.StaticText(self.computation_tab, label=status), pos=(1, 0), span=(1, 3))
+
+        kernel_sizer.Add(kernel_grid, 0, wx.ALL, 5)
+        computation_sizer.Add(kernel_sizer, 0, wx.EXPAND | wx.ALL, 5)
+
+        fit_box = wx.StaticBox(self.computation_tab, label="Fitting")
+        fit_sizer = wx.StaticBoxSizer(fit_box, wx.VERTICAL)
+        fit_grid = wx.GridBagSizer(5, 5)
+
+        fit_grid.Add(wx.StaticText(self.computation_tab, label="Jacobian:"), pos=(0, 0),
+                     flag=wx.ALIGN_CENTER_VERTICAL)
+        self.jacobian_mode_combo = wx.ComboBox(self.computation_tab, choices=JACOBIAN_MODES, style=wx.CB_READONLY)
+        self.jacobian_mode_combo.SetMinSize((150, -1))
+        self.jacobian_mode_combo.SetToolTip("Analytic derivatives for leastsq/least_squares fits (finite "
+                                            "differences for LA*G, skewed Voigt and exponential Gaussian peaks). "
+                                            "Cross-Check also shows their deviation from finite differences "
+                                            "after each fit. "
+                                            "Sparse only differentiates each peak within ±10 FWHM of its "
+                                            "position, for fits of many peaks (surveys, joined scans).")
+        fit_grid.Add(self.jacobian_mode_combo, pos=(0, 1))
+
+        self.persist_fit_cache_cb = wx.CheckBox(self.computation_tab, label="Save stored fits with the project")
+        self.persist_fit_cache_cb.SetToolTip("Fits already done are reused when the same fit is requested again. "
+                                             "Also save them next to the project file and reload them on opening.")
+        fit_grid.Add(self.persist_fit_cache_cb, pos=(1, 0), span=(1, 2))
+
+        fit_sizer.Add(fit_grid, 0, wx.ALL, 5)
+        computation_sizer.Add(fit_sizer, 0, wx.EXPAND | wx.ALL, 5)
+
+        self.computation_tab.SetSizer(computation_sizer)
+
+    def on_kernel_self_test(self, event):
+        wx.BeginBusyCursor()
+        try:
+            results = Compiled_Kernels.self_test()
+        finally:
+            wx.EndBusyCursor()
+
+        compiled = results.pop('compiled')
+        lines = [f"{name}: {deviation:.2e} {'OK' if passed else 'FAILED'}"
+                 for name, (deviation, passed) in results.items()]
+        if not compiled:
+            lines.append("\nNumba is not installed, the kernels were run uncompiled.")
+        all_passed = all(passed for _, passed in results.values())
+        wx.MessageBox("Maximum relative deviation from NumPy:\n\n" + "\n".join(lines), "Kernel Self-Test",
+                      wx.OK | (wx.ICON_INFORMATION if all_passed else wx.ICON_WARNING))
+
     def init_instrument_tab(self):
         sizer = wx.GridBagSizer(5, 5)
 
@@ -782,6 +858,10 @@ class PreferenceWindow(wx.Frame):
         self.ref_peak_text.SetValue(self.parent.ref_peak_name)
         self.ref_peak_value.SetValue(self.parent.ref_peak_be)
 
+        self.kernel_backend_combo.SetValue(Compiled_Kernels.get_backend())
+        self.jacobian_mode_combo.SetValue(self.parent.jacobian_mode)
+        self.persist_fit_cache_cb.SetValue(self.parent.persist_fit_cache)
+
     def OnPeakNumberChange(self, event):
         current_peak = event.GetPosition() - 1
         if current_peak < len(self.temp_peak_colors):
@@ -925,6 +1005,13 @@ class PreferenceWindow(wx.Frame):
         self.parent.ref_peak_name = self.ref_peak_text.GetValue()
         self.parent.ref_peak_be = self.ref_peak_value.GetValue()
 
+        self.parent.jacobian_mode = self.jacobian_mode_combo.GetValue()
+        self.parent.persist_fit_cache = self.persist_fit_cache_cb.GetValue()
+        self.parent.kernel_backend = Compiled_Kernels.set_backend(self.kernel_backend_combo.GetValue())
+        if self.parent.kernel_backend != self.kernel_backend_combo.GetValue():
+            wx.MessageBox("Numba is not installed, the NumPy kernels will be used.", "Line Shape Kernels",
+                          wx.OK | wx.ICON_INFORMATION)
+
         # Save the configuration
         self.parent.save_config()
 
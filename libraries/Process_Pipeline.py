@@ -0,0 +1,90 @@
+# PROCESS PIPELINE ---------------------------------------------------------
+# Base class of the batch operations run in a process pool (all-sheets
+# background and fit, multi-start search, fit uncertainty).
+# -------------------------------------------------------------------------
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+
+class ProcessPipeline:
+    """
+    Run tasks through a worker function in a process pool and collect the results without blocking the caller.
+
+    Call start(), then poll() repeatedly (e.g. between progress dialog updates) until finished is True,
+    or cancel(). By default results[key] holds the return value of the worker and errors[key] the message of
+    its exception, key being task_key(task); subclasses override task_key and collect to store results
+    differently. More tasks can be added with submit() while the pipeline runs.
+    """
+
+    def __init__(self, worker, tasks, max_workers=None):
+        """
+        Args:
+            worker: Module-level function called with one task in a worker process
+            tasks (list): Task dicts, passed to the worker as they are
+            max_workers (int): Number of worker processes, default one per task up to the number of CPUs
+        """
+        self.worker = worker
+        self.tasks = list(tasks)
+        self.max_workers = max_workers or min(len(self.tasks), os.cpu_count() or 1) or 1
+        self.results = {}
+        self.errors = {}
+        self.cancelled = False
+        self._executor = None
+        self._futures = {}
+        self._done = 0
+
+    @staticmethod
+    def task_key(task):
+        """Key of a task in results and errors, and in the list returned by poll."""
+        return task['Sheet']
+
+    @property
+    def completed(self):
+        return self._done
+
+    @property
+    def finished(self):
+        return self.cancelled or self._done == len(self.tasks)
+
+    def start(self):
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        for task in self.tasks:
+            self._futures[self._executor.submit(self.worker, task)] = task
+
+    def submit(self, task, worker=None):
+        """Add a task to a started pipeline, run by worker (default the worker of the pipeline)."""
+        self.tasks.append(task)
+        self._futures[self._executor.submit(worker or self.worker, task)] = task
+
+    def collect(self, task, result):
+        """Store the result of a finished task."""
+        self.results[self.task_key(task)] = result
+
+    def poll(self, timeout=0.1):
+        """Collect the tasks finished within timeout seconds and return their keys."""
+        pending = [future for future in self._futures if not future.done()]
+        if pending:
+            wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+        finished_keys = []
+        for future in [future for future in self._futures if future.done()]:
+            task = self._futures.pop(future)
+            try:
+                self.collect(task, future.result())
+            except Exception as e:
+                self.errors[self.task_key(task)] = str(e)
+            self._done += 1
+            finished_keys.append(self.task_key(task))
+
+        if not self._futures:
+            self._shutdown()
+        return finished_keys
+
+    def cancel(self):
+        self.cancelled = True
+        self._shutdown()
+
+    def _shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -17,6 +17,7 @@ from openpyxl.styles import Border, Side, PatternFill, Font
 from openpyxl import load_workbook
 from libraries.Sheet_Operations import on_sheet_selected
 from copy import deepcopy
+from libraries.Fit_Cache import FitCache, fit_cache, fit_cache_path
 # from Functions import convert_to_serializable_and_round
 
 
@@ -50,6 +51,7 @@ def save_all_sheets_with_plots(window):
         json_data = convert_to_serializable_and_round(window.Data)
         with open(json_file_path, 'w') as json_file:
             json.dump(json_data, json_file, indent=2)
+        save_fit_cache(window, file_path)
 
         window.show_popup_message2("Save Complete", "All sheets, plots, and results table have been saved.")
 
@@ -80,6 +82,7 @@ def save_data(window, data):
 
         with open(json_file_path, 'w') as json_file:
             json.dump(json_data, json_file, indent=2)
+        save_fit_cache(window, file_path)
 
         # print(json.dumps(window.Data['Results']['Peak'], indent=2))
         print("Data Saved")
@@ -87,6 +90,14 @@ def save_data(window, data):
         wx.MessageBox(f"Error saving data: {str(e)}", "Error", wx.OK | wx.ICON_ERROR)
 
 
+def save_fit_cache(window, file_path):
+    """Save the stored fits of the project's sheets next to the project when enabled in the preferences."""
+    if getattr(window, 'persist_fit_cache', False):
+        spectra = {FitCache.spectrum_key(core_level_data['B.E.'], core_level_data['Raw Data'])
+                   for core_level_data in window.Data['Core levels'].values()}
+        fit_cache.save(fit_cache_path(file_path), spectra)
+
+
 def convert_to_serializable_and_round2(obj, decimal_places=2):
     try:
         if isinstance(obj, (float, np.float32, np.float64)):
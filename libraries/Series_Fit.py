@@ -0,0 +1,195 @@
+# SERIES FIT ---------------------------------------------------------------
+# Fits the peak model of a seed sheet to an ordered series of sheets (depth
+# profile, angle or time series). The seed is compiled once, every sheet only
+# swaps the spectrum and starts from the converged parameters of the previous
+# one.
+# -------------------------------------------------------------------------
+import copy
+import threading
+import time
+
+import numpy as np
+
+from libraries.Fit_Problem import compile_fit_problem, core_level_spectrum, PeakFitter, peak_results
+
+SWEEP_MODES = ["Forward", "Forward then backward"]
+
+# Peak values listed per sheet in the series table
+SERIES_VALUES = ['Position', 'Height', 'FWHM', 'L/G', 'Area']
+
+
+class SeriesFit:
+    """
+    Warm-started fits of the peaks of seed_sheet to the sheets of sheet_names, in that order.
+
+    The forward sweep fits every sheet from the result of the previous one (the first from the seed values).
+    The backward sweep then goes back through the series from the last forward result, and keeps, for every
+    sheet, the fit with the lower chi². Each sheet keeps its own spectrum, background and range, read when
+    the series is created so that run() can be called from a worker thread (see start()).
+    """
+
+    def __init__(self, data, seed_sheet, sheet_names, method='leastsq', max_nfev=None, jacobian_mode="Analytic",
+                 sweep="Forward"):
+        self.data = data
+        self.seed_sheet = seed_sheet
+        self.sheet_names = list(sheet_names)
+        self.method = method
+        self.max_nfev = max_nfev
+        self.jacobian_mode = jacobian_mode
+        self.sweep = sweep
+
+        self.seed = compile_fit_problem(data, seed_sheet)
+        if self.seed is None:
+            raise ValueError("Sheets with Unfitted or D-parameter peaks are not fitted")
+        self.seed_peaks = copy.deepcopy(data['Core levels'][seed_sheet]['Fitting']['Peaks'])
+
+        self.results = {}   # {sheet name: result dict}
+        self.errors = {}    # {sheet name: message}
+        self.cancelled = False
+        self.spectra = {}
+        for sheet_name in self.sheet_names:
+            try:
+                self.spectra[sheet_name] = core_level_spectrum(data, sheet_name)
+            except Exception as e:
+                self.errors[sheet_name] = str(e)
+
+        self._cancel = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, post=None, on_progress=None, on_done=None):
+        """
+        Run the series in a worker thread.
+
+        Args:
+            post (callable): Calls the callbacks, e.g. wx.CallAfter to run them in the GUI thread
+            on_progress (callable): on_progress(step, number of steps, sheet name), before every fit
+            on_done (callable): on_done(), once the run has finished or stopped after cancel()
+        """
+        post = post or (lambda func, *args: func(*args))
+
+        def progress(step, total, sheet_name):
+            if on_progress is not None:
+                post(on_progress, step, total, sheet_name)
+            return not self._cancel.is_set()
+
+        def work():
+            try:
+                self.run(progress)
+            finally:
+                self.cancelled = self.cancelled or self._cancel.is_set()
+                if on_done is not None:
+                    post(on_done)
+
+        self._thread = threading.Thread(target=work, name=f"series {self.seed_sheet}", daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        """Stop before the next fit of a run started with start(), the run is then cancelled."""
+        self._cancel.set()
+
+    def run(self, progress=None):
+        """
+        Fit the series.
+
+        Args:
+            progress (callable): Optional progress(step, number of steps, sheet name) called before every fit,
+                returning False cancels the run (like wx.ProgressDialog.Update)
+
+        Returns:
+            dict: {sheet name: result dict}, in series order
+        """
+        order = [("Forward", sheet_name) for sheet_name in self.sheet_names]
+        if self.sweep == "Forward then backward":
+            order += [("Backward", sheet_name) for sheet_name in reversed(self.sheet_names[:-1])]
+
+        values = dict(zip(self.seed.param_names, self.seed.values))
+        for step, (direction, sheet_name) in enumerate(order):
+            if progress is not None and progress(step, len(order), sheet_name) is False:
+                self.cancelled = True
+                break
+            if sheet_name in self.errors:
+                continue
+            try:
+                fit_result = self.fit_sheet(sheet_name, values, direction)
+            except Exception as e:
+                self.errors[sheet_name] = str(e)
+                continue
+            previous = self.results.get(sheet_name)
+            if previous is None or fit_result['Chi2'] < previous['Chi2']:
+                self.results[sheet_name] = fit_result
+            # The next sheet starts from the best fit of this one
+            values = self.results[sheet_name]['Values']
+
+        self.results = {sheet_name: self.results[sheet_name] for sheet_name in self.sheet_names
+                        if sheet_name in self.results}
+        return self.results
+
+    def fit_sheet(self, sheet_name, values, direction="Forward"):
+        """Fit the seed model to one sheet from values ({parameter: value}) and return its result dict."""
+        start = time.perf_counter()
+        problem = self.seed.with_spectrum(sheet_name, *self.spectra[sheet_name])
+        # The lmfit models are shared with the seed (cached per combination of peak models)
+        result = PeakFitter(problem).fit(method=self.method, max_nfev=self.max_nfev,
+                                         jacobian_mode=self.jacobian_mode, params=problem.parameters(values))
+
+        ss_tot = np.sum((problem.y_subtracted - np.mean(problem.y_subtracted)) ** 2)
+        r_squared = 1 - np.sum((problem.y_subtracted - result.best_fit) ** 2) / ss_tot
+        peaks = peak_results(problem, result.params)
+        for peak in peaks:
+            peak.pop('y_values', None)
+        return {
+            'Sheet': sheet_name,
+            'Sweep': direction,
+            'Values': {name: par.value for name, par in result.params.items()},
+            'Peaks': peaks,
+            'R2': float(r_squared),
+            'Chi2': float(result.chisqr),
+            'Red. Chi2': float(result.redchi),
+            'Nfev': int(result.nfev),
+            'Time': time.perf_counter() - start,
+        }
+
+    def table(self):
+        """
+        Parameter-vs-index table of the series.
+
+        Returns:
+            tuple: (column labels, rows), one row per fitted sheet in series order
+        """
+        columns = ["Index", "Sheet"]
+        for label in self.seed.labels:
+            columns += [f"{label} {name}" for name in SERIES_VALUES]
+        columns += ["R²", "Red. Chi²", "Iterations", "Sweep"]
+
+        rows = []
+        for index, sheet_name in enumerate(self.sheet_names):
+            fit_result = self.results.get(sheet_name)
+            if fit_result is None:
+                continue
+            row = [index, sheet_name]
+            for peak in fit_result['Peaks']:
+                row += [peak[name] for name in SERIES_VALUES]
+            row += [round(fit_result['R2'], 5), round(fit_result['Red. Chi2'], 2), fit_result['Nfev'],
+                    fit_result['Sweep']]
+            rows.append(row)
+        return columns, rows
+
+    def store_results(self, data):
+        """
+        Give every fitted sheet the peaks of the seed with its fitted values.
+
+        The peaks of the fitted sheets are replaced, their constraints are those of the seed.
+
+        Returns:
+            list: Names of the sheets written
+        """
+        for sheet_name, fit_result in self.results.items():
+            peaks = copy.deepcopy(self.seed_peaks)
+            for label, peak in zip(self.seed.labels, fit_result['Peaks']):
+                peaks[label].update(peak)
+            data['Core levels'][sheet_name].setdefault('Fitting', {})['Peaks'] = peaks
+        return list(self.results)
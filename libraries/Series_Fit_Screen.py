@@ -0,0 +1,132 @@
+import wx
+import wx.grid
+
+from libraries.Batch_Fit import FIT_METHODS
+from libraries.Export import export_sheet_results
+from libraries.Grid_Operations import populate_results_grid
+from libraries.Open import load_library_data
+from libraries.Save import save_state
+from libraries.Series_Fit import SWEEP_MODES, SeriesFit
+from libraries.Sheet_Operations import on_sheet_selected
+
+
+def fit_series(window):
+    """
+    Fit the peaks of the current sheet to an ordered series of sheets, each starting from the previous fit.
+
+    The user picks and orders the sheets of the series and the sweep. The fits run in a worker thread behind
+    a progress dialog. The fitted sheets get the peaks and constraints of the current sheet with their own
+    fitted values, their results are exported and a parameter-vs-index table of the series is shown. A
+    cancelled run leaves window.Data unchanged.
+
+    Args:
+        window: The main application window.
+    """
+    seed_sheet = window.sheet_combobox.GetValue()
+    if not window.Data['Core levels'].get(seed_sheet, {}).get('Fitting', {}).get('Peaks'):
+        wx.MessageBox("Fit the seed sheet first: the current sheet has no peaks.", "Fit Series",
+                      wx.OK | wx.ICON_INFORMATION)
+        return
+
+    # Checked sheets are fitted from top to bottom, the seed sheet is listed first
+    sheet_names = list(window.Data['Core levels'])
+    sheet_names.insert(0, sheet_names.pop(sheet_names.index(seed_sheet)))
+    order = [0] + [~index for index in range(1, len(sheet_names))]
+    dialog = wx.RearrangeDialog(window, f"Check the sheets of the series and move them into the fitting order, "
+                                        f"starting from the peaks of {seed_sheet}.\nTheir peaks are replaced by "
+                                        f"those of {seed_sheet}.", "Fit Series", order, sheet_names)
+    if dialog.ShowModal() != wx.ID_OK:
+        dialog.Destroy()
+        return
+    series = [sheet_names[index] for index in dialog.GetOrder() if index >= 0]
+    dialog.Destroy()
+    if not series:
+        return
+
+    dialog = wx.SingleChoiceDialog(window, "Sweep:", "Fit Series", SWEEP_MODES)
+    if dialog.ShowModal() != wx.ID_OK:
+        dialog.Destroy()
+        return
+    sweep = dialog.GetStringSelection()
+    dialog.Destroy()
+
+    method = window.fitting_window.get_optimization_method() if window.fitting_window else "least_squares"
+    if method not in FIT_METHODS:
+        method = "least_squares"
+    try:
+        series_fit = SeriesFit(window.Data, seed_sheet, series, method, window.max_iterations,
+                               getattr(window, 'jacobian_mode', "Analytic"), sweep)
+    except ValueError as e:
+        wx.MessageBox(str(e), "Fit Series", wx.OK | wx.ICON_ERROR)
+        return
+
+    save_state(window)
+    num_steps = len(series) * 2 - 1 if sweep == "Forward then backward" else len(series)
+    progress = wx.ProgressDialog("Fit Series", f"Fitting {len(series)} sheets...", maximum=num_steps,
+                                 parent=window,
+                                 style=wx.PD_APP_MODAL | wx.PD_CAN_ABORT | wx.PD_ELAPSED_TIME)
+
+    def on_progress(step, total, sheet_name):
+        if not progress.Update(step, f"Fitting {sheet_name}")[0]:
+            series_fit.cancel()
+
+    def on_done():
+        progress.Destroy()
+        on_series_done(window, series_fit)
+
+    series_fit.start(post=wx.CallAfter, on_progress=on_progress, on_done=on_done)
+
+
+def on_series_done(window, series_fit):
+    """Store, export and tabulate the results of a finished series fit."""
+    if series_fit.cancelled:
+        return
+
+    library_data = load_library_data()
+    for sheet_name in series_fit.store_results(window.Data):
+        export_sheet_results(window, sheet_name, library_data)
+    populate_results_grid(window)
+
+    on_sheet_selected(window, series_fit.seed_sheet)
+    save_state(window)
+
+    SeriesTableWindow(window, series_fit).Show()
+    if series_fit.errors:
+        errors = "\n".join(f"{sheet}: {error}" for sheet, error in series_fit.errors.items())
+        wx.MessageBox(f"Fit failed for:\n{errors}", "Fit Series", wx.OK | wx.ICON_WARNING)
+
+
+class SeriesTableWindow(wx.Frame):
+    """Parameter-vs-index table of a series fit, with a button copying it as tab-separated text."""
+
+    def __init__(self, parent, series_fit):
+        super().__init__(parent, title=f"Series Fit - seed {series_fit.seed_sheet}", size=(900, 400),
+                         style=wx.DEFAULT_FRAME_STYLE | wx.STAY_ON_TOP)
+        self.columns, self.rows = series_fit.table()
+
+        panel = wx.Panel(self)
+        main_sizer = wx.BoxSizer(wx.VERTICAL)
+
+        self.grid = wx.grid.Grid(panel)
+        self.grid.CreateGrid(len(self.rows), len(self.columns))
+        self.grid.EnableEditing(False)
+        self.grid.SetRowLabelSize(0)
+        for col, label in enumerate(self.columns):
+            self.grid.SetColLabelValue(col, label)
+        for row, values in enumerate(self.rows):
+            for col, value in enumerate(values):
+                self.grid.SetCellValue(row, col, str(value))
+        self.grid.AutoSizeColumns()
+        main_sizer.Add(self.grid, 1, wx.EXPAND | wx.ALL, 5)
+
+        copy_button = wx.Button(panel, label="Copy Table")
+        copy_button.Bind(wx.EVT_BUTTON, self.on_copy)
+        main_sizer.Add(copy_button, 0, wx.ALIGN_CENTER | wx.ALL, 5)
+
+        panel.SetSizer(main_sizer)
+
+    def on_copy(self, event):
+        text = "\n".join("\t".join(str(value) for value in values) for values in [self.columns] + self.rows)
+        if wx.TheClipboard.Open():
+            wx.TheClipboard.SetData(wx.TextDataObject(text))
+            wx.TheClipboard.Close()
@@ -0,0 +1,169 @@
+# FIT UNCERTAINTY ---------------------------------------------------------
+# Monte Carlo / bootstrap confidence intervals of the fitted peaks. Replicate
+# spectra are drawn from the converged fit (resampled residuals or Poisson
+# noise), refitted from the converged parameters in a process pool, and the
+# replicate areas are propagated to the atomic percentages.
+# -------------------------------------------------------------------------
+import copy
+import os
+
+import numpy as np
+
+from libraries.Fit_Problem import compile_fit_problem, PeakFitter, peak_results
+from libraries.Process_Pipeline import ProcessPipeline
+
+RESAMPLING_MODES = ["Residual bootstrap", "Poisson noise"]
+CONFIDENCE_LEVELS = ["68%", "95%", "99%"]
+
+# Peak values collected for every replicate
+REPLICATE_VALUES = ['Position', 'Height', 'FWHM', 'Area']
+
+
+def replicate_spectra(problem, best_fit, num_replicates, rng, mode="Residual bootstrap"):
+    """
+    Background-subtracted replicate spectra around a converged fit.
+
+    "Residual bootstrap" adds the residuals of the fit, resampled with replacement, to the fitted envelope.
+    "Poisson noise" draws counts around the fitted envelope plus background, then subtracts the background.
+
+    Args:
+        problem (FitProblem): The fitted problem
+        best_fit (np.ndarray): Fitted envelope over problem.x
+        num_replicates (int): Number of replicates
+        rng (np.random.Generator): Random generator (seeded for reproducible replicates)
+        mode (str): One of RESAMPLING_MODES
+
+    Returns:
+        np.ndarray: (num_replicates, len(problem.x))
+    """
+    if mode == "Poisson noise":
+        expected = np.clip(best_fit + problem.background, 0, None)
+        return rng.poisson(expected, size=(num_replicates, len(expected))) - problem.background
+    residuals = problem.y_subtracted - best_fit
+    return best_fit + rng.choice(residuals, size=(num_replicates, len(residuals)), replace=True)
+
+
+def fit_converged(task):
+    """
+    Worker: fit one sheet and draw its replicate spectra around the converged fit.
+
+    Returns:
+        tuple: ({parameter: converged value}, replicates array (replicates, points))
+    """
+    problem = task['Problem']
+    result = PeakFitter(problem).fit(method=task['Method'], max_nfev=task['Max Nfev'], jacobian_mode=task['Jacobian'])
+    replicates = replicate_spectra(problem, result.best_fit, task['Num Replicates'],
+                                   np.random.default_rng(task['Seed']), task['Mode'])
+    return {name: par.value for name, par in result.params.items()}, replicates
+
+
+def fit_replicates(task):
+    """
+    Worker: refit a chunk of replicate spectra from the converged parameters.
+
+    Returns:
+        tuple: (sheet name, first replicate index, {value: array (replicates, peaks)} for REPLICATE_VALUES)
+    """
+    problem = copy.copy(task['Problem'])
+    fitter = PeakFitter(problem)
+    values = {name: np.empty((len(task['Replicates']), problem.num_peaks)) for name in REPLICATE_VALUES}
+    for i, y_subtracted in enumerate(task['Replicates']):
+        problem.y_subtracted = y_subtracted
+        problem.y = y_subtracted + problem.background
+        result = fitter.fit(method=task['Method'], max_nfev=task['Max Nfev'], jacobian_mode=task['Jacobian'],
+                            params=problem.parameters(task['Values']))
+        for peak, peak_values in enumerate(peak_results(problem, result.params)):
+            for name in REPLICATE_VALUES:
+                values[name][i, peak] = peak_values[name]
+    return task['Sheet'], task['First'], values
+
+
+def confidence_interval(samples, level=0.95, axis=0):
+    """Percentile interval holding the given fraction of the samples (NaN ignored), as (low, high) arrays."""
+    tail = (1 - level) / 2 * 100
+    return np.nanpercentile(samples, tail, axis=axis), np.nanpercentile(samples, 100 - tail, axis=axis)
+
+
+def format_interval(interval, decimals=2):
+    """'low - high' for a (low, high) pair, '' when there is none."""
+    if not interval:
+        return ""
+    return f"{interval[0]:.{decimals}f} - {interval[1]:.{decimals}f}"
+
+
+def atomic_percent_replicates(areas, divisors):
+    """
+    Atomic percentages of every replicate.
+
+    Args:
+        areas (np.ndarray): (replicates, peaks) areas of the peaks quantified together
+        divisors (np.ndarray): (replicates, peaks) quantification divisors (RSF, TXFN, ECF and angle)
+
+    Returns:
+        np.ndarray: (replicates, peaks) atomic percentages
+    """
+    normalized = areas / divisors
+    totals = np.sum(normalized, axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(totals > 0, normalized / totals * 100, 0.0)
+
+
+class UncertaintyRun(ProcessPipeline):
+    """
+    Replicate fits of several core levels in a process pool.
+
+    Every sheet is first fitted once in the pool to get the converged parameters and its replicates. The
+    replicates are then split into one chunk per worker, submitted as the fit of their sheet finishes.
+    Replicates are drawn from a seeded generator per sheet, so the same seed gives the same intervals. Call
+    start(), then poll() until finished is True, or cancel(); num_steps is the number of tasks of a run without
+    errors. samples[sheet][value] holds the (replicates, peaks) arrays, labels[sheet] the peak labels.
+    """
+
+    def __init__(self, data, sheet_names, num_replicates=100, seed=0, mode="Residual bootstrap",
+                 method='least_squares', max_nfev=None, jacobian_mode="Analytic", max_workers=None):
+        self.num_replicates = num_replicates
+        self.chunk_size = int(np.ceil(num_replicates / (max_workers or os.cpu_count() or 1)))
+        self.labels = {}
+        self.samples = {}
+        errors = {}
+        tasks = []
+
+        seeds = np.random.SeedSequence(seed).spawn(len(sheet_names))
+        for sheet_name, sheet_seed in zip(sheet_names, seeds):
+            try:
+                problem = compile_fit_problem(data, sheet_name)
+                if problem is None:
+                    raise ValueError("Sheets with Unfitted or D-parameter peaks are not fitted")
+            except Exception as e:
+                errors[sheet_name] = str(e)
+                continue
+            self.labels[sheet_name] = problem.labels
+            tasks.append({'Sheet': sheet_name, 'Problem': problem, 'Seed': sheet_seed, 'Num Replicates': num_replicates,
+                          'Mode': mode, 'Method': method, 'Max Nfev': max_nfev, 'Jacobian': jacobian_mode})
+
+        super().__init__(fit_converged, tasks, max_workers or os.cpu_count() or 1)
+        self.errors.update(errors)
+        self.num_steps = len(tasks) * (1 + int(np.ceil(num_replicates / self.chunk_size)))
+
+    def collect(self, task, result):
+        if 'First' in task:
+            sheet_name, first, values = result
+            for name, array in values.items():
+                self.samples[sheet_name][name][first:first + len(array)] = array
+            return
+
+        # Converged fit of a sheet: refit its replicates in chunks
+        converged, replicates = result
+        problem = task['Problem']
+        self.samples[task['Sheet']] = {name: np.full((self.num_replicates, problem.num_peaks), np.nan)
+                                       for name in REPLICATE_VALUES}
+        for first in range(0, self.num_replicates, self.chunk_size):
+            self.submit({'Sheet': task['Sheet'], 'First': first, 'Problem': problem, 'Values': converged,
+                         'Replicates': replicates[first:first + self.chunk_size], 'Method': task['Method'],
+                         'Max Nfev': task['Max Nfev'], 'Jacobian': task['Jacobian']}, fit_replicates)
+
+    def peak_samples(self, sheet_name, label, name='Area'):
+        """Replicate values of one peak, None when its sheet failed."""
+        if sheet_name in self.errors or sheet_name not in self.samples:
+            return None
+        return self.samples[sheet_name][name][:, self.labels[sheet_name].index(label)]
@@ -0,0 +1,141 @@
+import wx
+import numpy as np
+
+from libraries.Export import quantification_divisor
+from libraries.Grid_Operations import populate_results_grid
+from libraries.Save import save_state
+from libraries.Uncertainty import (RESAMPLING_MODES, CONFIDENCE_LEVELS, UncertaintyRun, confidence_interval,
+                                   atomic_percent_replicates)
+
+
+class UncertaintySettingsDialog(wx.Dialog):
+    """Number of replicates, resampling, seed and confidence level of an uncertainty estimate."""
+
+    def __init__(self, parent):
+        super().__init__(parent, title="Estimate Uncertainties")
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        grid_sizer = wx.FlexGridSizer(4, 2, 5, 5)
+
+        self.replicates_spin = wx.SpinCtrl(self, value=str(parent.uncertainty_replicates), min=10, max=5000)
+        self.mode_combobox = wx.ComboBox(self, choices=RESAMPLING_MODES, value=parent.uncertainty_mode,
+                                         style=wx.CB_READONLY)
+        self.seed_spin = wx.SpinCtrl(self, value=str(parent.uncertainty_seed), min=0, max=2 ** 31 - 1)
+        self.level_combobox = wx.ComboBox(self, choices=CONFIDENCE_LEVELS, value=parent.uncertainty_level,
+                                          style=wx.CB_READONLY)
+        for label, control in [("Replicates:", self.replicates_spin), ("Resampling:", self.mode_combobox),
+                               ("Seed:", self.seed_spin), ("Confidence:", self.level_combobox)]:
+            grid_sizer.Add(wx.StaticText(self, label=label), 0, wx.ALIGN_CENTER_VERTICAL)
+            grid_sizer.Add(control, 0, wx.EXPAND)
+        sizer.Add(grid_sizer, 0, wx.ALL, 10)
+        sizer.Add(self.CreateButtonSizer(wx.OK | wx.CANCEL), 0, wx.ALIGN_CENTER | wx.ALL, 5)
+        self.SetSizerAndFit(sizer)
+
+    def apply(self, window):
+        window.uncertainty_replicates = self.replicates_spin.GetValue()
+        window.uncertainty_mode = self.mode_combobox.GetValue()
+        window.uncertainty_seed = self.seed_spin.GetValue()
+        window.uncertainty_level = self.level_combobox.GetValue()
+
+
+def estimate_uncertainties(window):
+    """
+    Confidence intervals of the areas and atomic percentages of the Results grid.
+
+    The sheets of the exported peaks are refitted on replicate spectra (resampled residuals or Poisson noise)
+    in a process pool, from their converged parameters. Every replicate is quantified like the Results grid
+    (RSF, TXFN, ECF and angular correction over the ticked peaks). The intervals are stored in
+    window.Data['Results'] ('Area CI', 'at. % CI') and shown in the last two columns of the Results grid,
+    which the results table export includes.
+
+    Args:
+        window: The main application window.
+    """
+    results = window.Data.get('Results', {}).get('Peak', {})
+    if not results:
+        wx.MessageBox("Export the fits to the Results grid first.", "Information", wx.OK | wx.ICON_INFORMATION)
+        return
+
+    dialog = UncertaintySettingsDialog(window)
+    if dialog.ShowModal() != wx.ID_OK:
+        dialog.Destroy()
+        return
+    dialog.apply(window)
+    dialog.Destroy()
+
+    sheet_names = []
+    for peak_data in results.values():
+        sheet_name = peak_data.get('Sheetname')
+        if sheet_name in window.Data['Core levels'] and sheet_name not in sheet_names:
+            sheet_names.append(sheet_name)
+
+    method = window.fitting_window.get_optimization_method() if window.fitting_window else "least_squares"
+    if method not in ['leastsq', 'least_squares']:
+        method = 'least_squares'
+    wx.BeginBusyCursor()
+    try:
+        run = UncertaintyRun(window.Data, sheet_names, window.uncertainty_replicates, window.uncertainty_seed,
+                             window.uncertainty_mode, method, window.max_iterations,
+                             getattr(window, 'jacobian_mode', "Analytic"))
+    finally:
+        wx.EndBusyCursor()
+
+    if run.tasks:
+        progress = wx.ProgressDialog("Estimate Uncertainties",
+                                     f"Fitting {window.uncertainty_replicates} replicates of "
+                                     f"{len(run.labels)} core levels...", maximum=run.num_steps, parent=window,
+                                     style=wx.PD_APP_MODAL | wx.PD_CAN_ABORT | wx.PD_ELAPSED_TIME |
+                                     wx.PD_AUTO_HIDE)
+        try:
+            run.start()
+            while not run.finished:
+                run.poll(0.1)
+                keep_going, _ = progress.Update(run.completed)
+                if not keep_going:
+                    run.cancel()
+        finally:
+            progress.Destroy()
+        if run.cancelled:
+            return
+
+    level = float(window.uncertainty_level.rstrip('%')) / 100
+    store_intervals(window, run, level)
+    populate_results_grid(window)
+    save_state(window)
+
+    if run.errors:
+        errors = "\n".join(f"{sheet}: {error}" for sheet, error in run.errors.items())
+        wx.MessageBox(f"No uncertainty for:\n{errors}", "Estimate Uncertainties", wx.OK | wx.ICON_WARNING)
+
+
+def store_intervals(window, run, level=0.95):
+    """
+    Write the area and atomic percentage intervals of a finished run into window.Data['Results'].
+
+    The atomic percentages are only given when every ticked peak has replicates.
+    """
+    results = window.Data['Results']['Peak']
+    checked = []
+    for peak_label, peak_data in results.items():
+        peak_data.pop('Area CI', None)
+        peak_data.pop('at. % CI', None)
+        areas = run.peak_samples(peak_data['Sheetname'], peak_data['Name'], 'Area') \
+            if peak_data['Name'] in run.labels.get(peak_data['Sheetname'], []) else None
+        if areas is not None:
+            low, high = confidence_interval(areas, level)
+            peak_data['Area CI'] = [round(float(low), 2), round(float(high), 2)]
+        if peak_data.get('Checkbox', '0') == '1':
+            checked.append((peak_label, areas))
+
+    if not checked or any(areas is None for _, areas in checked):
+        return
+    areas = np.column_stack([areas for _, areas in checked])
+    positions = np.column_stack([run.peak_samples(results[peak_label]['Sheetname'], results[peak_label]['Name'],
+                                                  'Position') for peak_label, _ in checked])
+    divisors = np.empty_like(areas)
+    for column, (peak_label, _) in enumerate(checked):
+        peak_data = results[peak_label]
+        divisors[:, column] = [quantification_divisor(window, peak_data['Name'], position, peak_data['RSF'])
+                               for position in positions[:, column]]
+    lows, highs = confidence_interval(atomic_percent_replicates(areas, divisors), level)
+    for (peak_label, _), low, high in zip(checked, lows, highs):
+        results[peak_label]['at. % CI'] = [round(float(low), 2), round(float(high), 2)]
@@ -0,0 +1,79 @@
+# VOIGT AND PSEUDO-VOIGT CONVERSIONS ---------------------------------------
+# Height <-> area <-> FWHM for the lmfit Voigt and Pseudo-Voigt conventions,
+# evaluated in closed form so they accept scalars or arrays of peaks.
+# -------------------------------------------------------------------------
+import numpy as np
+from scipy.special import voigt_profile
+
+SQRT_LN2_OVER_PI = np.sqrt(np.log(2) / np.pi)
+
+
+def voigt_peak_value(sigma, gamma):
+    """
+    Maximum of a unit-area Voigt profile, Re[w(i·gamma / (sigma·√2))] / (sigma·√(2π)).
+
+    Args:
+        sigma (float or array): Gaussian sigma
+        gamma (float or array): Lorentzian half width (lmfit gamma)
+
+    Returns:
+        float or array: Height of the unit-area profile at its center
+    """
+    return voigt_profile(0.0, np.asarray(sigma, dtype=float), np.asarray(gamma, dtype=float))
+
+
+def voigt_area_to_height(area, sigma, gamma):
+    """Height of a Voigt peak of the given area (lmfit amplitude)."""
+    return np.asarray(area, dtype=float) * voigt_peak_value(sigma, gamma)
+
+
+def voigt_height_to_area(height, sigma, gamma):
+    """Area (lmfit amplitude) of a Voigt peak of the given height."""
+    return np.asarray(height, dtype=float) / voigt_peak_value(sigma, gamma)
+
+
+def voigt_fwhm(sigma, gamma):
+    """
+    FWHM of a Voigt profile from the Olivero-Longbothum approximation (accurate to about 0.02%).
+
+    Args:
+        sigma (float or array): Gaussian sigma
+        gamma (float or array): Lorentzian half width (lmfit gamma)
+
+    Returns:
+        float or array: FWHM
+    """
+    fg = 2 * np.asarray(sigma, dtype=float) * np.sqrt(2 * np.log(2))
+    fl = 2 * np.asarray(gamma, dtype=float)
+    return 0.5346 * fl + np.sqrt(0.2166 * fl ** 2 + fg ** 2)
+
+
+def pseudo_voigt_peak_value(sigma, fraction):
+    """
+    Maximum of a unit-area lmfit Pseudo-Voigt profile (FWHM = 2·sigma for both components).
+
+    Args:
+        sigma (float or array): Half width at half maximum
+        fraction (float or array): Lorentzian fraction in percent
+
+    Returns:
+        float or array: Height of the unit-area profile at its center
+    """
+    sigma = np.asarray(sigma, dtype=float)
+    fraction = np.asarray(fraction, dtype=float) / 100
+    return (1 - fraction) * SQRT_LN2_OVER_PI / sigma + fraction / (np.pi * sigma)
+
+
+def pseudo_voigt_area_to_height(area, sigma, fraction):
+    """Height of a Pseudo-Voigt peak of the given area (lmfit amplitude), fraction in percent."""
+    return np.asarray(area, dtype=float) * pseudo_voigt_peak_value(sigma, fraction)
+
+
+def pseudo_voigt_height_to_area(height, sigma, fraction):
+    """Area (lmfit amplitude) of a Pseudo-Voigt peak of the given height, fraction in percent."""
+    return np.asarray(height, dtype=float) / pseudo_voigt_peak_value(sigma, fraction)
+
+
+def pseudo_voigt_fwhm(sigma):
+    """FWHM of the lmfit Pseudo-Voigt profile."""
+    return 2 * np.asarray(sigma, dtype=float)
@@ -16,6 +16,11 @@ from libraries.Open import open_vamas_file_dialog, open_kal_file_dialog, import_
 from libraries.Export import export_word_report
 from libraries.Utilities import CropWindow, PlotModWindow, on_delete_sheet, copy_sheet, JoinSheetsWindow
 from libraries.Help import show_libraries_used, show_version_log, report_bug
+from libraries.Cache_Screen import CacheStatisticsWindow
+from libraries.Batch_Background_Screen import compute_all_backgrounds
+from libraries.Batch_Fit_Screen import fit_all_core_levels
+from libraries.Series_Fit_Screen import fit_series
+from libraries.Uncertainty_Screen import estimate_uncertainties
 from Functions import (import_avantage_file, on_save, save_all_sheets_with_plots, save_results_table, open_avg_file,
                        import_multiple_avg_files, create_plot_script_from_excel, on_save_plot, \
     on_save_plot_pdf, on_save_plot_svg, on_exit, undo, redo, toggle_plot, show_shortcuts, show_mini_game, on_about)
@@ -183,7 +188,7 @@ def create_results_grid(window, parent):
     results_sizer_inner = wx.BoxSizer(wx.VERTICAL)
 
     window.results_grid = wx.grid.Grid(window.results_frame)
-    window.results_grid.CreateGrid(0, 29)
+    window.results_grid.CreateGrid(0, 31)
 
     # Set column labels and properties for results grid
     column_labels = ["Peak\nLabel", "Position\n(eV)", "Height\n(CPS)", "FWHM\n(eV)", "L/G \n\u03c3/\u03b3 (%)",
@@ -192,7 +197,7 @@ def create_results_grid(window, parent):
                      "\u03c3 or \u03B1\nW_g", "\u03b3 or \u03B2\nW_l", "Bkg Type", "Bkg Low\n(eV)", "Bkg High\n(eV)", "Bkg Offset Low\n(CPS)",
                      "Bkg Offset High\n(CPS)", "Sheetname", "Position\nConstraint", "Height\nConstraint",
                      "FWHM\nConstraint", "L/G\nConstraint", "Area\nConstraint", "\u03c3\nConstraint",
-                     "\u03b3\nConstraint"]
+                     "\u03b3\nConstraint", "Area\nConf. Interval", "Atomic (%)\nConf. Interval"]
     for i, label in enumerate(column_labels):
         window.results_grid.SetColLabelValue(i, label)
 
@@ -207,7 +212,7 @@ def create_results_grid(window, parent):
     # Adjust specific column sizes
     col_sizes = [120, 70, 70, 70, 50, 80, 80, 20, 30, 40, 50, 80,120, 80, 80, 70, 70, 100, 100, 80, 80, 80, 120, 120,
                  120,
-                 70,70,70]
+                 70,70,70,70,110,110]
     for i, size in enumerate(col_sizes):
         window.results_grid.SetColSize(i, size)
 
@@ -385,6 +390,21 @@ def create_menu(window):
     Noise_item = tools_menu.Append(wx.NewId(), "Noise Analysis")
     window.Bind(wx.EVT_MENU, lambda event: window.on_open_noise_analysis_window, Noise_item)
 
+    Batch_bkg_item = tools_menu.Append(wx.NewId(), "Compute All Backgrounds")
+    window.Bind(wx.EVT_MENU, lambda event: compute_all_backgrounds(window), Batch_bkg_item)
+
+    Batch_fit_item = tools_menu.Append(wx.NewId(), "Fit All Core Levels")
+    window.Bind(wx.EVT_MENU, lambda event: fit_all_core_levels(window), Batch_fit_item)
+
+    Series_fit_item = tools_menu.Append(wx.NewId(), "Fit Series...")
+    window.Bind(wx.EVT_MENU, lambda event: fit_series(window), Series_fit_item)
+
+    Uncertainty_item = tools_menu.Append(wx.NewId(), "Estimate Uncertainties...")
+    window.Bind(wx.EVT_MENU, lambda event: estimate_uncertainties(window), Uncertainty_item)
+
+    Cache_item = tools_menu.Append(wx.NewId(), "Cache Statistics")
+    window.Bind(wx.EVT_MENU, lambda event: CacheStatisticsWindow(window).Show(), Cache_item)
+
     # Help menu items
     # mini_help_item = help_menu.Append(wx.NewId(), "Help")
     # window.Bind(wx.EVT_MENU, window.on_mini_help, mini_help_item)